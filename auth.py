@@ -0,0 +1,152 @@
+"""Bearer-token authentication for the API and WebSockets.
+
+Tokens are HS256 JWTs issued by /api/login. A verified token is remembered in
+an LRU until its ``exp``, so a repeat request costs one dict lookup instead
+of base64, HMAC and JSON decoding. Role and permission flags come only from
+``Database.get_user`` (TTL-cached, invalidated on permission changes): a token
+whose user has no row (deleted, or never existed) is refused, whatever its
+claims say. The principal built from a user row is reused for as long as the
+cache hands back that same row. Only in demo mode, without a database, is the
+token's role claim used.
+"""
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException, Request, WebSocket
+
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+JWT_TTL_DAYS = int(os.environ.get("JWT_TTL_DAYS", 7))
+
+PERMISSIONS = ("can_hunt", "can_campaign", "can_share", "can_see_all_data")
+# Column defaults of the users table, for accounts without a row
+DEFAULT_PERMISSIONS = {"can_hunt": True, "can_campaign": True, "can_share": False, "can_see_all_data": False}
+
+
+class TokenVerifier:
+    def __init__(self, secret: str, algorithm: str = "HS256", max_entries: int = AUTH_CACHE_SIZE):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.verified: "OrderedDict[str, list]" = OrderedDict()  # token -> [exp, claims, row, principal]
+        self.hits = 0
+        self.misses = 0
+
+    def issue(self, subject: str, **claims) -> str:
+        import jwt  # imported on first use so startup does not pay for it
+
+        payload = {"sub": subject, "exp": datetime.utcnow() + timedelta(days=JWT_TTL_DAYS), **claims}
+        return jwt.encode(payload, self.secret, algorithm=self.algorithm)
+
+    def entry(self, token: str) -> list:
+        """Cache entry for a valid token; raises jwt.InvalidTokenError otherwise"""
+        entry = self.verified.get(token)
+        if entry is not None and entry[0] > time.time():
+            self.hits += 1
+            self.verified.move_to_end(token)
+            return entry
+        self.misses += 1
+        import jwt
+
+        claims = jwt.decode(token, self.secret, algorithms=[self.algorithm], options={"require": ["exp", "sub"]})
+        entry = [claims["exp"], claims, None, None]
+        self.verified[token] = entry
+        if len(self.verified) > self.max_entries:
+            self.verified.popitem(last=False)
+        return entry
+
+    def forget(self, token: str):
+        self.verified.pop(token, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.verified),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def build_principal(username: str, row: Optional[dict], claims: dict) -> dict:
+    if row is None:
+        # Demo mode without a database: trust only the role the token was issued with
+        is_admin = claims.get("role") == "admin"
+        perms = {p: True for p in PERMISSIONS} if is_admin else dict(DEFAULT_PERMISSIONS)
+        return {"username": username, "role": claims.get("role", "user"), "is_admin": is_admin, **perms}
+    is_admin = bool(row.get("is_admin")) or row.get("role") == "admin"
+    return {
+        "username": username,
+        "role": row.get("role") or "user",
+        "is_admin": is_admin,
+        **{p: is_admin or bool(row.get(p, DEFAULT_PERMISSIONS[p])) for p in PERMISSIONS},
+    }
+
+
+class Authenticator:
+    """FastAPI dependencies: ``Depends(auth)`` for any user, ``Depends(auth.require("can_hunt"))``"""
+
+    def __init__(self, verifier: TokenVerifier, db=None, database_configured: bool = False):
+        self.verifier = verifier
+        self.db = db
+        # With a database configured but not attached yet, tokens are not trusted on their claims
+        self.database_configured = database_configured
+
+    async def principal(self, token: str) -> Optional[dict]:
+        import jwt
+
+        try:
+            entry = self.verifier.entry(token)
+        except jwt.InvalidTokenError:
+            return None
+        username = entry[1]["sub"]
+        if self.db is not None:
+            row = await self.db.get_user(username)
+            if row is None:
+                return None  # deleted or unknown user: the token alone grants nothing
+        elif self.database_configured:
+            return None
+        else:
+            row = None
+        if entry[3] is None or entry[2] is not row:
+            entry[2], entry[3] = row, build_principal(username, row, entry[1])
+        return entry[3]
+
+    async def __call__(self, request: Request) -> dict:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Missing bearer token", headers={"WWW-Authenticate": "Bearer"})
+        user = await self.principal(token)
+        if user is None and self.db is None and self.database_configured:
+            raise HTTPException(status_code=503, detail="Database not ready", headers={"Retry-After": "1"})
+        if user is None:
+            raise HTTPException(status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+        return user
+
+    def require(self, permission: str):
+        async def dependency(request: Request) -> dict:
+            user = await self(request)
+            if not user.get(permission) and not user["is_admin"]:
+                raise HTTPException(status_code=403, detail=f"Missing permission: {permission}")
+            return user
+        return dependency
+
+    async def websocket_user(self, websocket: WebSocket) -> Optional[dict]:
+        """User for ``?token=`` (browsers can't set headers on WebSockets) or a bearer header"""
+        token = websocket.query_params.get("token")
+        if not token:
+            scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+        return await self.principal(token) if token else None
+
+
+def scope_user_id(user: dict, requested: Optional[str]) -> Optional[str]:
+    """``requested`` for users who may see everyone's data, otherwise their own id"""
+    if user["is_admin"] or user["can_see_all_data"]:
+        return requested
+    return user["username"]
+
+
+def can_access(user: dict, owner_id: Optional[str]) -> bool:
+    return scope_user_id(user, owner_id) == owner_id
@@ -0,0 +1,306 @@
+"""Local stand-ins for Supabase (PostgREST), Serper and Twilio.
+
+One Starlette app on one port serves all three, so the API can be pointed at
+it with SUPABASE_URL, SERPER_URL and TWILIO_API_BASE:
+
+    python bench/fakes.py --port 9100 --db-latency 15 --serper-latency 300 \\
+        --twilio-latency 120 --error-rate 0.01 --seed-leads 20000
+
+The PostgREST fake keeps tables in memory and understands the subset of the
+query language database.py uses (eq/neq/lt/lte/gt/gte/in/is filters, nested
+or/and, order, limit/offset, count, upsert with on_conflict, rpc
+leads_breakdown) and, like PostgREST, refuses bulk inserts whose objects do
+not all have the same keys. Latencies are mean milliseconds with +/-50% jitter;
+``--error-rate`` makes that fraction of calls fail (503 for PostgREST,
+429 for Serper and Twilio).
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+UNIQUE = {"leads": "phone_number", "users": "username"}
+PREFIXES = ("010", "011", "012", "015")
+
+config = {"db_latency": 0.0, "serper_latency": 0.0, "twilio_latency": 0.0, "error_rate": 0.0}
+tables: dict = {}
+calls = Counter()
+versions = Counter()  # table -> write count, invalidates sorted views
+sorted_views: dict = {}  # (table, order) -> (version, rows)
+
+
+async def delay(kind: str):
+    latency = config[f"{kind}_latency"] / 1000
+    if latency:
+        await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+
+
+def failing() -> bool:
+    return random.random() < config["error_rate"]
+
+
+def random_phone() -> str:
+    return random.choice(PREFIXES) + "".join(random.choices("0123456789", k=8))
+
+
+# ---------- PostgREST ----------
+def split_top(text: str):
+    """Split on commas that are not inside parentheses or quotes"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p for p in parts if p]
+
+
+def unquote(value: str) -> str:
+    return value[1:-1] if len(value) > 1 and value[0] == value[-1] == '"' else value
+
+
+def compare(op: str, actual, expected: str) -> bool:
+    if op == "is":
+        return actual is None if expected == "null" else str(actual).lower() == expected
+    if op == "in":
+        return str(actual) in {unquote(v) for v in split_top(expected.strip("()"))}
+    if actual is None:
+        return False
+    expected = unquote(expected)
+    actual = str(actual).lower() if isinstance(actual, bool) else str(actual)
+    return {
+        "eq": actual == expected, "neq": actual != expected,
+        "lt": actual < expected, "lte": actual <= expected,
+        "gt": actual > expected, "gte": actual >= expected,
+    }[op]
+
+
+def parse_condition(text: str):
+    """``col.op.value`` or ``and(...)``/``or(...)`` -> predicate"""
+    match = re.match(r"^(and|or)\((.*)\)$", text)
+    if match:
+        parts = [parse_condition(p) for p in split_top(match.group(2))]
+        combine = all if match.group(1) == "and" else any
+        return lambda row: combine(p(row) for p in parts)
+    column, op, value = text.split(".", 2)
+    return lambda row: compare(op, row.get(column), value)
+
+
+def filters_from(request: Request):
+    predicates = []
+    for key, value in request.query_params.multi_items():
+        if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+            continue
+        if key in ("or", "and"):
+            predicates.append(parse_condition(f"{key}{value}"))
+        else:
+            predicates.append(parse_condition(f"{key}.{value}"))
+    return predicates
+
+
+def sorted_view(table: str, order: str):
+    """Rows of ``table`` in ``order``, re-sorted only after writes"""
+    cached = sorted_views.get((table, order))
+    if cached and cached[0] == versions[table]:
+        return cached[1]
+    rows = list(tables.get(table, []))
+    for term in reversed(order.split(",")):
+        if term:
+            column, _, direction = term.partition(".")
+            rows.sort(key=lambda row: (row.get(column) is None, str(row.get(column) or "")),
+                      reverse=direction.startswith("desc"))
+    sorted_views[(table, order)] = (versions[table], rows)
+    return rows
+
+
+def select_rows(request: Request, table: str):
+    predicates = filters_from(request)
+    offset = int(request.query_params.get("offset", 0))
+    limit = request.query_params.get("limit")
+    counting = "count=" in request.headers.get("prefer", "")
+    wanted = None if counting or not limit else offset + int(limit)
+    rows, total = [], 0
+    for row in sorted_view(table, ",".join(request.query_params.getlist("order"))):
+        if all(p(row) for p in predicates):
+            total += 1
+            if wanted is None or len(rows) < wanted:
+                rows.append(row)
+            elif not counting:
+                break
+    rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+    select = request.query_params.get("select", "*")
+    if select != "*":
+        columns = select.split(",")
+        rows = [{c: row.get(c) for c in columns} for row in rows]
+    return rows, total
+
+
+def with_count(request: Request, payload, rows, total) -> Response:
+    headers = {}
+    if "count=" in request.headers.get("prefer", ""):
+        headers["Content-Range"] = f"0-{max(len(rows) - 1, 0)}/{total}"
+    return JSONResponse(payload, headers=headers)
+
+
+async def postgrest(request: Request):
+    calls["postgrest"] += 1
+    await delay("db")
+    if failing():
+        return JSONResponse({"message": "fake outage"}, status_code=503)
+    table = request.path_params["table"]
+    rows = tables.setdefault(table, [])
+    prefer = request.headers.get("prefer", "")
+    if request.method == "GET":
+        selected, total = select_rows(request, table)
+        return with_count(request, selected, selected, total)
+    versions[table] += 1
+    if request.method == "POST":
+        body = json.loads(await request.body() or b"[]")
+        body = body if isinstance(body, list) else [body]
+        if len({frozenset(record) for record in body}) > 1:
+            # Real PostgREST derives the column list from the first object
+            return JSONResponse({"code": "PGRST102", "message": "All object keys must match",
+                                 "details": None, "hint": None}, status_code=400)
+        key = request.query_params.get("on_conflict") or UNIQUE.get(table)
+        index = {row.get(key): row for row in rows} if key else {}
+        written = []
+        for record in body:
+            existing = index.get(record.get(key)) if key else None
+            if existing is not None:
+                if "resolution=ignore-duplicates" in prefer:
+                    continue
+                if "resolution=merge-duplicates" not in prefer:
+                    return JSONResponse({"code": "23505", "message": "duplicate key value"}, status_code=409)
+                existing.update(record)
+                written.append(existing)
+                continue
+            row = {"id": str(uuid.uuid4()), "created_at": datetime.now().isoformat(), **record}
+            rows.append(row)
+            if key:
+                index[row.get(key)] = row
+            written.append(row)
+        if "return=minimal" in prefer:
+            return Response(status_code=201)
+        return JSONResponse(written, status_code=201)
+    predicates = filters_from(request)
+    matched = [row for row in rows if all(p(row) for p in predicates)]
+    if request.method == "PATCH":
+        changes = json.loads(await request.body() or b"{}")
+        for row in matched:
+            row.update(changes)
+    else:
+        ids = {id(row) for row in matched}
+        tables[table] = [row for row in rows if id(row) not in ids]
+    return JSONResponse(matched)
+
+
+async def rpc(request: Request):
+    calls["postgrest"] += 1
+    await delay("db")
+    if request.path_params["function"] != "leads_breakdown":
+        return JSONResponse({"message": "function not found"}, status_code=404)
+    days = json.loads(await request.body() or b"{}").get("days", 7)
+    since = (datetime.now() - timedelta(days=days)).date().isoformat()
+    leads = tables.get("leads", [])
+    return JSONResponse({
+        "by_status": dict(Counter(row.get("status") or "" for row in leads)),
+        "by_user": dict(Counter(row.get("user_id") or "" for row in leads)),
+        "by_day": dict(Counter(row["created_at"][:10] for row in leads if row["created_at"][:10] >= since)),
+    })
+
+
+# ---------- Serper ----------
+async def serper(request: Request):
+    calls["serper"] += 1
+    await delay("serper")
+    if failing():
+        return JSONResponse({"message": "Too many requests"}, status_code=429)
+    query = json.loads(await request.body()).get("q", "")
+    organic = [
+        {
+            "title": f"{query} #{i}",
+            "link": f"https://example{i % 7}.com/ad/{uuid.uuid4().hex[:8]}",
+            "snippet": f"للتواصل {random_phone()} أو واتساب +20 {random_phone()[1:]}",
+        }
+        for i in range(10)
+    ]
+    return JSONResponse({"organic": organic})
+
+
+# ---------- Twilio ----------
+async def twilio(request: Request):
+    calls["twilio"] += 1
+    await delay("twilio")
+    if failing():
+        return JSONResponse({"code": 20429, "message": "Too Many Requests"}, status_code=429)
+    form = await request.form()
+    return JSONResponse({"sid": "SM" + uuid.uuid4().hex, "status": "queued", "to": form.get("To")}, status_code=201)
+
+
+async def fake_stats(request: Request):
+    return JSONResponse({"calls": dict(calls), "rows": {name: len(rows) for name, rows in tables.items()}})
+
+
+def seed(leads: int):
+    now = datetime.now()
+    tables["users"] = [{
+        "id": str(uuid.uuid4()), "username": "admin@example.com", "password": "admin123",
+        "role": "admin", "is_admin": True, "can_hunt": True, "can_campaign": True,
+        "can_share": True, "can_see_all_data": True,
+    }]
+    phones = set()
+    while len(phones) < leads:
+        phones.add(random_phone())
+    tables["leads"] = [
+        {
+            "id": str(uuid.uuid4()), "phone_number": phone, "full_name": "", "source": "seed",
+            "quality": random.choice(["جيد ⭐", "ممتاز ⭐⭐"]), "status": "NEW", "notes": "",
+            "user_id": "admin", "created_at": (now - timedelta(seconds=i)).isoformat(),
+        }
+        for i, phone in enumerate(phones)
+    ]
+
+
+app = Starlette(routes=[
+    Route("/rest/v1/rpc/{function}", rpc, methods=["POST"]),
+    Route("/rest/v1/{table}", postgrest, methods=["GET", "POST", "PATCH", "DELETE"]),
+    Route("/search", serper, methods=["POST"]),
+    Route("/2010-04-01/Accounts/{sid}/Messages.json", twilio, methods=["POST"]),
+    Route("/_stats", fake_stats),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--db-latency", type=float, default=10, help="ms")
+    parser.add_argument("--serper-latency", type=float, default=250, help="ms")
+    parser.add_argument("--twilio-latency", type=float, default=120, help="ms")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed-leads", type=int, default=5000)
+    args = parser.parse_args()
+    config.update(db_latency=args.db_latency, serper_latency=args.serper_latency,
+                  twilio_latency=args.twilio_latency, error_rate=args.error_rate)
+    seed(args.seed_leads)
+
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Offline load test: fake Supabase/Serper/Twilio plus the real app.
+
+Starts bench/fakes.py and bench/serve_app.py as subprocesses on localhost,
+drives each scenario at the requested concurrency for a fixed duration and
+reports throughput and p50/p95/p99 latency, compared with bench/baseline.json:
+
+    python bench/run.py                         # all scenarios, compare
+    python bench/run.py -s leads -s add_lead -c 64 -d 20
+    python bench/run.py --save-baseline         # record this run as baseline
+    python bench/run.py --fail-on-regression    # exit 1 if p95/throughput regress
+
+No network is needed; fake latencies and error rates are set with
+--db-latency/--serper-latency/--twilio-latency/--error-rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+import jwt
+import websockets
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "baseline.json")
+JWT_SECRET = "bench-secret"
+
+SAMPLE_TEXT = ("إعلان شقة للبيع في القاهرة للتواصل 01012345678 أو ٠١١٢٣٤٥٦٧٨٩ "
+               "واتساب +20 1223456789 السعر قابل للتفاوض. ") * 20
+
+
+def random_phone() -> str:
+    return random.choice(("010", "011", "012", "015")) + "".join(random.choices("0123456789", k=8))
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# ---------- scenarios ----------
+# Each factory gets (http client, worker index) and returns one request coroutine factory
+def succeeded(response: httpx.Response) -> bool:
+    """Most endpoints answer failures with 200 and {"success": false, ...}"""
+    if response.status_code >= 400:
+        return False
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        return True
+    data = response.json()
+    return not (isinstance(data, dict) and data.get("success") is False)
+
+
+def http_scenario(method: str, path: str, body: Callable[[], dict] = None):
+    def factory(client: httpx.AsyncClient, worker: int):
+        async def call() -> bool:
+            response = await client.request(method, path, json=body() if body else None)
+            return succeeded(response)
+        return call
+    return factory
+
+
+def ws_admin_chat(base_ws: str, token: str):
+    def factory(client: httpx.AsyncClient, worker: int):
+        state = {}
+
+        async def call() -> bool:
+            if "ws" not in state:
+                state["ws"] = await websockets.connect(f"{base_ws}/ws/admin-chat?token={token}")
+            await state["ws"].send("الوقت")
+            await state["ws"].recv()
+            return True
+        return call
+    return factory
+
+
+def scenarios(base_ws: str, token: str) -> Dict[str, Callable]:
+    return {
+        "leads": http_scenario("GET", "/api/leads?limit=50"),
+        "add_lead": http_scenario("POST", "/api/add-lead", lambda: {
+            "phone_number": random_phone(), "full_name": "bench", "user_id": "admin"}),
+        "extract_phones": http_scenario("POST", "/api/extract-phones", lambda: {"text": SAMPLE_TEXT}),
+        "start_hunt": http_scenario("POST", "/start_hunt", lambda: {
+            "intent_sentence": random.choice(["شقة للبيع", "عربية مستعملة", "محل للإيجار"]), "city": "القاهرة"}),
+        "send_whatsapp": http_scenario("POST", "/api/send-whatsapp", lambda: {
+            "phone_number": random_phone(), "message": "عرض خاص", "user_id": "admin"}),
+        "ws_admin_chat": ws_admin_chat(base_ws, token),
+    }
+
+
+async def drive(name: str, factory, base_url: str, token: str, concurrency: int, duration: float) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30,
+                                 headers={"Authorization": f"Bearer {token}"}) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker(index: int):
+            nonlocal errors
+            call = factory(client, index)
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    ok = await call()
+                except Exception:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "errors": errors,
+    }
+
+
+# ---------- processes ----------
+def wait_ready(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_processes(args):
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    fakes = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "fakes.py"), "--port", str(args.fake_port),
+        "--db-latency", str(args.db_latency), "--serper-latency", str(args.serper_latency),
+        "--twilio-latency", str(args.twilio_latency), "--error-rate", str(args.error_rate),
+        "--seed-leads", str(args.seed_leads),
+    ], stdout=None if args.verbose else subprocess.DEVNULL)
+    env = {
+        **os.environ,
+        "PORT": str(args.app_port),
+        "SUPABASE_URL": fake_url,
+        "SUPABASE_KEY": "bench-key",
+        "SERPER_URL": f"{fake_url}/search",
+        "SERPER_KEYS": ",".join(f"bench-key-{i}" for i in range(8)),
+        "SERPER_RATE_PER_MIN": "100000",
+        "TWILIO_API_BASE": fake_url,
+        "TWILIO_SID": "ACbench",
+        "TWILIO_TOKEN": "bench",
+        "TWILIO_WHATSAPP_NUMBER": "+15550000000",
+        "SENDER_RATE_PER_MIN": "1000000",
+        "JWT_SECRET": JWT_SECRET,
+        "HUNT_CACHE_DB": "",
+    }
+    app = subprocess.Popen([sys.executable, os.path.join(HERE, "serve_app.py")], env=env,
+                           stdout=None if args.verbose else subprocess.DEVNULL)
+    try:
+        wait_ready(f"{fake_url}/_stats")
+        wait_ready(f"http://127.0.0.1:{args.app_port}/health")
+    except Exception:
+        stop_processes(fakes, app)
+        raise
+    return fakes, app
+
+
+def stop_processes(*processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# ---------- report ----------
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    print(f"\n{'scenario':<16}{'req':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'err':>6}   vs baseline")
+    for name, r in results.items():
+        base = baseline.get(name)
+        delta = ""
+        if base:
+            rps_change = (r["rps"] - base["rps"]) / base["rps"] if base["rps"] else 0
+            p95_change = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0
+            delta = f"rps {rps_change:+.0%}  p95 {p95_change:+.0%}"
+            if rps_change < -tolerance or p95_change > tolerance:
+                regressions.append(name)
+                delta += "  ⚠️ regression"
+        print(f"{name:<16}{r['requests']:>8}{r['rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>6}   {delta}")
+    return regressions
+
+
+async def run(args) -> dict:
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    token = jwt.encode({"sub": "admin@example.com", "role": "admin", "exp": int(time.time()) + 3600},
+                       JWT_SECRET, algorithm="HS256")
+    available = scenarios(base_url.replace("http", "ws", 1), token)
+    results = {}
+    for name in args.scenario or available:
+        results[name] = await drive(name, available[name], base_url, token, args.concurrency, args.duration)
+        print(f"✅ {name}: {results[name]['rps']} req/s, p95 {results[name]['p95_ms']} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for Hunter Pro CRM")
+    parser.add_argument("-s", "--scenario", action="append",
+                        choices=["leads", "add_lead", "extract_phones", "start_hunt", "send_whatsapp", "ws_admin_chat"])
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("-d", "--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--db-latency", type=float, default=10, help="ms")
+    parser.add_argument("--serper-latency", type=float, default=250, help="ms")
+    parser.add_argument("--twilio-latency", type=float, default=120, help="ms")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed-leads", type=int, default=5000)
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--app-port", type=int, default=9200)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change before flagging")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show app and fake server output")
+    args = parser.parse_args()
+
+    processes = start_processes(args)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        stop_processes(*processes)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+    regressions = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "settings": {k: getattr(args, k) for k in ("concurrency", "duration", "db_latency",
+                                                           "serper_latency", "twilio_latency", "error_rate")},
+                "results": {**baseline, **results},
+            }, f, indent=2)
+        print(f"💾 Baseline saved to {args.baseline}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Run main.py under uvicorn against the local fakes.
+
+If ``create_client`` cannot be built here (no network, or a gotrue/httpx
+mismatch) the lifespan handler is given a bare PostgREST client pointed at
+SUPABASE_URL instead: database.py only uses ``table()``/``rpc()``, so every query still
+goes over HTTP to the fake exactly as it would to Supabase.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from postgrest import SyncPostgrestClient
+
+import main
+
+
+class PostgrestOnly:
+    """The parts of supabase.Client that Database uses"""
+
+    def __init__(self, url: str, key: str):
+        self.postgrest = SyncPostgrestClient(
+            f"{url.rstrip('/')}/rest/v1", headers={"apikey": key, "Authorization": f"Bearer {key}"}
+        )
+
+    def table(self, name: str):
+        return self.postgrest.from_(name)
+
+    def rpc(self, fn: str, params: dict):
+        return self.postgrest.rpc(fn, params)
+
+
+def use_bare_postgrest():
+    """Fall back to PostgrestOnly when the lifespan handler cannot build a Supabase client"""
+    create_supabase_client = main.create_supabase_client
+
+    def create():
+        try:
+            return create_supabase_client()
+        except Exception as e:
+            print(f"🧪 Using bare PostgREST client for the fake database ({type(e).__name__})")
+            return PostgrestOnly(os.environ["SUPABASE_URL"], os.environ.get("SUPABASE_KEY", "bench"))
+    main.create_supabase_client = create
+
+
+if __name__ == "__main__":
+    use_bare_postgrest()
+    uvicorn.run(main.app, host="127.0.0.1", port=int(os.environ.get("PORT", 9200)), log_level="warning", access_log=False)
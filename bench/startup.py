@@ -0,0 +1,81 @@
+"""Cold start: process spawn to the first 200 from /health/live and /health/ready.
+
+Runs ``uvicorn main:app`` the way the Dockerfile does, polls both endpoints
+every few milliseconds and reports the median over several starts, together
+with the import time main.py reports about itself:
+
+    python bench/startup.py                  # 5 starts, no database
+    python bench/startup.py --budget-ms 1200 # exit 1 when /health/live is slower
+    python bench/startup.py -v               # show the app's own output
+
+SUPABASE_URL/SUPABASE_KEY from the environment are passed through, so
+readiness can also be timed against a real (or fake, see fakes.py) database.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def first_ok(client: httpx.Client, url: str) -> bool:
+    try:
+        return client.get(url).status_code == 200
+    except httpx.HTTPError:
+        return False
+
+
+def one_start(port: int, verbose: bool, timeout: float = 30) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, stdout=None if verbose else subprocess.DEVNULL, stderr=None if verbose else subprocess.DEVNULL,
+    )
+    live = ready = None
+    try:
+        with httpx.Client(timeout=1) as client:
+            while time.perf_counter() - started < timeout and ready is None:
+                if live is None and first_ok(client, f"{base}/health/live"):
+                    live = time.perf_counter() - started
+                if live is not None and first_ok(client, f"{base}/health/ready"):
+                    ready = time.perf_counter() - started
+                    startup = client.get(f"{base}/health/ready").json()["startup"]
+                time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    if ready is None:
+        raise RuntimeError("app did not become ready")
+    return {"live_ms": live * 1000, "ready_ms": ready * 1000, "import_ms": startup["import_ms"],
+            "app_import_ms": startup["app_import_ms"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark for Hunter Pro CRM")
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=9300)
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail when median /health/live exceeds this")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    runs = []
+    for i in range(args.runs):
+        runs.append(one_start(args.port, args.verbose))
+        print(f"  start {i + 1}: live {runs[-1]['live_ms']:.0f}ms, ready {runs[-1]['ready_ms']:.0f}ms, "
+              f"import {runs[-1]['import_ms']:.0f}ms ({runs[-1]['app_import_ms']:.0f}ms after FastAPI)")
+    median = {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+    print(f"✅ median over {args.runs}: live {median['live_ms']:.0f}ms, ready {median['ready_ms']:.0f}ms, "
+          f"main.py import {median['import_ms']:.0f}ms ({median['app_import_ms']:.0f}ms after FastAPI)")
+    if args.budget_ms is not None and median["live_ms"] > args.budget_ms:
+        print(f"⚠️ over budget ({args.budget_ms:.0f}ms)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""WhatsApp campaign dispatcher.
+
+A campaign's recipients (the owner's own leads, unless the owner may see all
+data) are streamed page by page out of ``leads`` into one bounded
+``asyncio.Queue`` shared by a fixed pool of sender workers. Each sender
+number has its own token bucket, failed sends are retried with
+exponential backoff, and progress counters are flushed to
+``whatsapp_campaigns`` every few seconds instead of once per message.
+
+Campaign state lives in the database: a campaign stays ``running`` until its
+queue drains, and on restart ``resume_pending`` re-queues every unfinished
+campaign, skipping recipients that already have a ``campaign_logs`` row.
+
+With several worker processes (a ``store``, see shared_state) a run is only
+started by the worker that wins the ``campaign:<id>`` lease; the owner
+renews it with every progress flush and releases it once the run is
+finished, so no recipient is sent the same campaign twice. A lease held by a
+worker that died lapses and the campaign is resumed by the next one to start.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from auth import build_principal, scope_user_id
+from messaging import SendError
+from phones import to_e164
+from rate_limiter import KeyRateLimiter
+
+CAMPAIGN_WORKERS = int(os.environ.get("CAMPAIGN_WORKERS", 32))
+CAMPAIGN_QUEUE_SIZE = int(os.environ.get("CAMPAIGN_QUEUE_SIZE", 1000))
+CAMPAIGN_MAX_RETRIES = int(os.environ.get("CAMPAIGN_MAX_RETRIES", 3))
+CAMPAIGN_RETRY_BASE = float(os.environ.get("CAMPAIGN_RETRY_BASE", 2.0))
+CAMPAIGN_PROGRESS_INTERVAL = float(os.environ.get("CAMPAIGN_PROGRESS_INTERVAL", 2.0))
+SENDER_RATE_PER_MIN = float(os.environ.get("SENDER_RATE_PER_MIN", 600))  # per sender number
+SENDER_BURST = float(os.environ.get("SENDER_BURST", 10))
+CAMPAIGN_LEASE_TTL = float(os.environ.get("CAMPAIGN_LEASE_TTL", 30))
+RECIPIENT_PAGE_SIZE = 500
+TRACKED_SIDS = 100000
+
+ACTIVE_STATUSES = ["queued", "running"]
+
+
+class _Fields(dict):
+    def __missing__(self, key):
+        return ""
+
+
+def render_message(template: str, lead: dict) -> str:
+    """Fill {name}/{full_name}/{phone} placeholders; unknown ones become empty"""
+    if "{" not in template:
+        return template
+    fields = _Fields(lead)
+    fields.setdefault("name", lead.get("full_name") or "")
+    fields.setdefault("phone", lead.get("phone_number") or "")
+    try:
+        return template.format_map(fields)
+    except (ValueError, IndexError):
+        return template
+
+
+class CampaignRun:
+    """Live progress of one campaign in this process"""
+
+    def __init__(self, campaign: dict):
+        self.campaign_id = campaign["id"]
+        self.name = campaign.get("name", "")
+        self.template = campaign.get("message", "")
+        self.media_url = campaign.get("media_url") or None
+        self.user_id = campaign.get("user_id")
+        quality = campaign.get("target_quality") or []
+        self.target_quality = [quality] if isinstance(quality, str) else list(quality)
+        self.target_status = campaign.get("target_status") or None
+        self.status = "running"
+        self.total = 0
+        self.sent = campaign.get("sent_count") or 0
+        self.delivered = campaign.get("delivered_count") or 0
+        self.failed = campaign.get("failed_count") or 0
+        self.pending = 0
+        self.skipped = 0
+        self.producer_done = False
+        self.cancelled = False
+        self.leased = False
+        self.dirty = True
+        self.errors: List[str] = []
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "cancelled", "failed")
+
+    def progress(self) -> dict:
+        return {"sent_count": self.sent, "delivered_count": self.delivered,
+                "failed_count": self.failed, "status": self.status}
+
+    def to_dict(self) -> dict:
+        return {
+            "campaign_id": self.campaign_id,
+            "name": self.name,
+            **self.progress(),
+            "total": self.total,
+            "pending": self.pending,
+            "skipped": self.skipped,
+            "errors": self.errors[-10:],
+            "duration_seconds": round((self.finished_at or time.time()) - self.started_at, 2),
+        }
+
+
+class CampaignDispatcher:
+    """Shared worker pool that drains every running campaign.
+
+    ``send(sender, to, body, media_url)`` delivers one message and returns a
+    dict with ``sid``/``status`` or raises SendError; ``log(row)`` records a
+    ``campaign_logs`` row. ``on_progress(run)`` is called whenever a run's
+    counters or status change. ``store`` shares sender rate limits and
+    campaign leases between worker processes (see shared_state).
+    """
+
+    def __init__(
+        self,
+        db,
+        send: Callable[..., Awaitable[dict]],
+        senders: List[str],
+        log: Callable[[dict], Awaitable[None]],
+        workers: int = CAMPAIGN_WORKERS,
+        on_progress: Optional[Callable[[CampaignRun], None]] = None,
+        store=None,
+    ):
+        self.db = db
+        self.send = send
+        self.log = log
+        self.workers = workers
+        self.on_progress = on_progress
+        self.store = store
+        self.senders = KeyRateLimiter(
+            senders, rate_per_min=SENDER_RATE_PER_MIN, burst=SENDER_BURST, name="WhatsApp sender", store=store
+        )
+        self.runs: Dict[str, CampaignRun] = {}
+        self.sids: "OrderedDict[str, CampaignRun]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = set()
+
+    # ---------- lifecycle ----------
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _ensure_started(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=CAMPAIGN_QUEUE_SIZE)
+        for _ in range(self.workers):
+            self._spawn(self._worker())
+        self._spawn(self._progress_loop())
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await self._flush_progress()
+        self._queue = None
+
+    # ---------- control ----------
+    async def launch(self, campaign: dict) -> Optional[CampaignRun]:
+        """Start dispatching a campaign row; returns the existing run if active here,
+        or None when another worker is already sending it"""
+        run = self.runs.get(campaign["id"])
+        if run and not run.finished:
+            return run
+        leased = self.store is not None
+        if leased and not await asyncio.to_thread(self.store.claim, _lease(campaign["id"]), CAMPAIGN_LEASE_TTL):
+            return None
+        self._ensure_started()
+        run = CampaignRun(campaign)
+        run.leased = leased
+        self.runs[run.campaign_id] = run
+        await self.db.update_campaign(run.campaign_id, {"status": "running"})
+        self._spawn(self._produce(run))
+        self._changed(run)
+        return run
+
+    async def resume_pending(self) -> int:
+        """Re-queue campaigns a previous process left queued or running"""
+        campaigns = await self.db.get_campaigns(status=ACTIVE_STATUSES) or []
+        resumed = 0
+        for campaign in campaigns:
+            if await self.launch(campaign):
+                resumed += 1
+        return resumed
+
+    def cancel(self, campaign_id: str) -> Optional[CampaignRun]:
+        run = self.runs.get(campaign_id)
+        if run and not run.finished:
+            run.cancelled = True
+            run.status = "cancelled"
+            run.finished_at = time.time()
+            self._changed(run)
+        return run
+
+    def on_status(self, sid: str, status: str):
+        """Delivery receipt from the provider's status callback"""
+        run = self.sids.get(sid)
+        if run is None:
+            return
+        if status in ("delivered", "read"):
+            self.sids.pop(sid, None)
+            run.delivered += 1
+            self._changed(run)
+        elif status in ("failed", "undelivered"):
+            self.sids.pop(sid, None)
+            run.failed += 1
+            self._changed(run)
+
+    # ---------- pipeline ----------
+    async def _recipient_owner(self, run: CampaignRun) -> Optional[str]:
+        """user_id filter for a run's recipients; None only when its owner may see every lead"""
+        if not run.user_id:
+            raise ValueError("campaign has no owner")
+        owner = await self.db.get_user(run.user_id)
+        return scope_user_id(build_principal(run.user_id, owner, {}), None)
+
+    async def _produce(self, run: CampaignRun):
+        try:
+            user_id = await self._recipient_owner(run)
+            already_sent = await self.db.get_campaign_sent_phones(run.campaign_id)
+            seen = set()
+            for quality in run.target_quality or [None]:
+                cursor = None
+                while not run.cancelled:
+                    page = await self.db.get_leads_page(
+                        user_id=user_id, limit=RECIPIENT_PAGE_SIZE, cursor=cursor, quality=quality,
+                        status=run.target_status, fields=["phone_number", "full_name"],
+                    )
+                    for lead in page["leads"]:
+                        phone = lead.get("phone_number")
+                        if phone in already_sent:
+                            run.skipped += 1
+                            continue
+                        if not phone or phone in seen:
+                            continue
+                        seen.add(phone)
+                        run.total += 1
+                        run.pending += 1
+                        await self._queue.put((run, lead, 0))  # blocks when workers fall behind
+                    cursor = page["next_cursor"]
+                    if not cursor:
+                        break
+        except Exception as e:
+            run.errors.append(f"recipients: {e}")
+            if not run.total:
+                run.status = "failed"
+        finally:
+            run.producer_done = True
+            self._maybe_finish(run)
+
+    async def _worker(self):
+        while True:
+            run, lead, attempt = await self._queue.get()
+            try:
+                if run.cancelled:
+                    run.pending -= 1
+                    continue
+                retry = await self._deliver(run, lead, attempt)
+                if retry:
+                    self._spawn(self._retry(run, lead, attempt + 1))
+                else:
+                    run.pending -= 1
+            except Exception as e:
+                run.pending -= 1
+                run.failed += 1
+                run.errors.append(str(e))
+            finally:
+                self._changed(run)
+                self._queue.task_done()
+                self._maybe_finish(run)
+
+    async def _deliver(self, run: CampaignRun, lead: dict, attempt: int) -> bool:
+        """Send one message; returns True when it should be retried"""
+        to = to_e164(lead["phone_number"])
+        body = render_message(run.template, lead)
+        row = {
+            "campaign_id": run.campaign_id,
+            "lead_phone": lead["phone_number"],
+            "message_sent": body,
+            "user_id": run.user_id,
+            "created_at": datetime.now().isoformat(),
+        }
+        if not to:
+            run.failed += 1
+            await self.log({**row, "status": "failed", "error_message": "Invalid phone number"})
+            return False
+        sender = await self.senders.acquire()
+        if sender is None:
+            raise SendError("No sender numbers configured", retryable=False)
+        try:
+            result = await self.send(sender, to, body, run.media_url)
+        except SendError as e:
+            await self.senders.report(sender, e.status or 500)
+            if e.retryable and attempt < CAMPAIGN_MAX_RETRIES:
+                return True
+            run.failed += 1
+            run.errors.append(f"{lead['phone_number']}: {e}")
+            await self.log({**row, "status": "failed", "error_message": str(e)[:500]})
+            return False
+        await self.senders.report(sender, 200)
+        run.sent += 1
+        sid = result.get("sid")
+        if sid:
+            self.sids[sid] = run
+            if len(self.sids) > TRACKED_SIDS:
+                self.sids.popitem(last=False)
+        await self.log({**row, "status": "sent", "response_text": sid})
+        return False
+
+    async def _retry(self, run: CampaignRun, lead: dict, attempt: int):
+        await asyncio.sleep(CAMPAIGN_RETRY_BASE * 2 ** (attempt - 1))
+        await self._queue.put((run, lead, attempt))
+
+    def _maybe_finish(self, run: CampaignRun):
+        if run.producer_done and run.pending <= 0 and not run.finished:
+            run.status = "completed"
+            run.finished_at = time.time()
+            self._changed(run)
+        elif run.finished and not run.finished_at:
+            run.finished_at = time.time()
+
+    # ---------- progress ----------
+    def _changed(self, run: CampaignRun):
+        run.dirty = True
+        if self.on_progress and self.runs.get(run.campaign_id) is run:
+            self.on_progress(run)
+
+    async def _progress_loop(self):
+        while True:
+            await asyncio.sleep(CAMPAIGN_PROGRESS_INTERVAL)
+            await self._flush_progress()
+            await self._renew_leases()
+
+    async def _flush_progress(self):
+        for run in list(self.runs.values()):
+            if not run.dirty:
+                continue
+            run.dirty = False
+            try:
+                await self.db.update_campaign(run.campaign_id, run.progress())
+            except Exception as e:
+                run.dirty = True
+                print(f"⚠️ Campaign progress update failed: {e}")
+
+    # ---------- leases ----------
+    async def _renew_leases(self):
+        """Keep the leases of running campaigns; drop them once the final progress is written"""
+        held = [run for run in self.runs.values() if run.leased]
+        if not held:
+            return
+        live = [run.campaign_id for run in held if not run.finished]
+        done = [run for run in held if run.finished and not run.dirty]
+        try:
+            lost = await asyncio.to_thread(self._sync_leases, live, [run.campaign_id for run in done])
+        except Exception as e:
+            print(f"⚠️ Campaign lease renewal failed: {e}")
+            return
+        for run in done:
+            run.leased = False
+        for campaign_id in lost:
+            # Our lease lapsed and another worker resumed the campaign: stop
+            # sending without writing progress over theirs
+            run = self.runs.pop(campaign_id)
+            run.cancelled = True
+            print(f"⚠️ Campaign {campaign_id} was taken over by another worker")
+
+    def _sync_leases(self, live: List[str], done: List[str]) -> List[str]:
+        for campaign_id in done:
+            self.store.release(_lease(campaign_id))
+        return [campaign_id for campaign_id in live if not self.store.claim(_lease(campaign_id), CAMPAIGN_LEASE_TTL)]
+
+
+def _lease(campaign_id: str) -> str:
+    return f"campaign:{campaign_id}"
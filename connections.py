@@ -0,0 +1,247 @@
+"""Registry of open WebSockets with room broadcast.
+
+Connections live in a dict keyed by id and rooms are sets, so joining,
+leaving and disconnecting are O(1). ``broadcast(room, payload)`` encodes the
+payload once and sends it to every member concurrently, all sends sharing one
+WS_SEND_TIMEOUT deadline; a socket that errors or times out is dropped without
+affecting the others. A heartbeat pings quiet sockets and evicts those that
+have not been heard from in WS_IDLE_TIMEOUT seconds.
+
+Broadcasts go through a pub/sub backend so they also reach sockets held by
+other worker processes. The default is in-process; set WS_BROADCAST_URL to a
+``redis://`` URL (needs the ``redis`` package; a local ``redis-server`` works
+as a stand-in) to share one channel between workers.
+"""
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", 5))
+WS_HEARTBEAT = float(os.environ.get("WS_HEARTBEAT", 30))
+WS_IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", 120))  # 0 disables idle eviction
+WS_BROADCAST_URL = os.environ.get("WS_BROADCAST_URL", "")
+WS_BROADCAST_CHANNEL = os.environ.get("WS_BROADCAST_CHANNEL", "ws:broadcast")
+
+_ids = itertools.count(1)
+
+
+class Connection:
+    __slots__ = ("id", "websocket", "rooms", "connected_at", "last_seen", "lock")
+
+    def __init__(self, websocket):
+        self.id = next(_ids)
+        self.websocket = websocket
+        self.rooms: Set[str] = set()
+        self.connected_at = self.last_seen = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    async def send_text(self, text: str):
+        # One writer at a time per socket; broadcasts and replies may overlap
+        async with self.lock:
+            await self.websocket.send_text(text)
+
+    async def send_json(self, payload):
+        await self.send_text(json.dumps(payload, ensure_ascii=False))
+
+
+class LocalBackend:
+    """In-process pub/sub: a publish is delivered straight back to this worker"""
+
+    async def start(self, deliver: Callable[[str, str], Awaitable[None]]):
+        self.deliver = deliver
+
+    async def publish(self, room: str, text: str):
+        await self.deliver(room, text)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Redis pub/sub shared by every worker process"""
+
+    def __init__(self, url: str, channel: str = WS_BROADCAST_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Callable[[str, str], Awaitable[None]]):
+        import redis.asyncio as aioredis  # optional dependency, only needed here
+        self.redis = aioredis.from_url(self.url)
+        self.pubsub = self.redis.pubsub()
+        await self.pubsub.subscribe(self.channel)
+        self.deliver = deliver
+        self._task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        async for message in self.pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            try:
+                data = json.loads(message["data"])
+                await self.deliver(data["room"], data["text"])
+            except Exception as e:
+                print(f"⚠️ Broadcast delivery failed: {e}")
+
+    async def publish(self, room: str, text: str):
+        await self.redis.publish(self.channel, json.dumps({"room": room, "text": text}, ensure_ascii=False))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.pubsub.close()
+        await self.redis.close()
+
+
+def make_backend(url: str = WS_BROADCAST_URL):
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackend(url)
+    return LocalBackend()
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        backend=None,
+        send_timeout: float = WS_SEND_TIMEOUT,
+        heartbeat: float = WS_HEARTBEAT,
+        idle_timeout: float = WS_IDLE_TIMEOUT,
+    ):
+        self.backend = backend or make_backend()
+        self.send_timeout = send_timeout
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self.connections: Dict[int, Connection] = {}
+        self.rooms: Dict[str, Set[Connection]] = {}
+        self.sent = 0
+        self.dropped = 0
+        self.evicted = 0
+        self._started = False
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    async def start(self):
+        if self._started:
+            return
+        self._started = True
+        try:
+            await self.backend.start(self._deliver)
+        except Exception as e:
+            print(f"⚠️ Broadcast backend unavailable, using in-process delivery: {e}")
+            self.backend = LocalBackend()
+            await self.backend.start(self._deliver)
+        if self.heartbeat > 0:
+            self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._started:
+            await self.backend.close()
+            self._started = False
+
+    # ---------- membership ----------
+    async def connect(self, websocket, rooms: Iterable[str] = ()) -> Connection:
+        await websocket.accept()
+        await self.start()
+        conn = Connection(websocket)
+        self.connections[conn.id] = conn
+        for room in rooms:
+            self.join(conn, room)
+        return conn
+
+    def disconnect(self, conn: Connection):
+        if self.connections.pop(conn.id, None) is None:
+            return
+        for room in list(conn.rooms):
+            self.leave(conn, room)
+
+    def join(self, conn: Connection, room: str):
+        conn.rooms.add(room)
+        self.rooms.setdefault(room, set()).add(conn)
+
+    def leave(self, conn: Connection, room: str):
+        conn.rooms.discard(room)
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(conn)
+            if not members:
+                del self.rooms[room]
+
+    def room_size(self, room: str) -> int:
+        return len(self.rooms.get(room, ()))
+
+    # ---------- broadcast ----------
+    async def broadcast(self, room: str, payload) -> None:
+        """Send ``payload`` (str or JSON-able) to ``room`` on every worker"""
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        await self.start()
+        await self.backend.publish(room, text)
+
+    async def _deliver(self, room: str, text: str):
+        members = list(self.rooms.get(room, ()))
+        if members:
+            await self._fan_out(members, text)
+
+    async def _fan_out(self, members, text: str):
+        # One shared deadline for the whole fan-out instead of a timer per send
+        tasks = {asyncio.ensure_future(conn.send_text(text)): conn for conn in members}
+        done, pending = await asyncio.wait(tasks, timeout=self.send_timeout)
+        for task in pending:
+            task.cancel()
+        for task, conn in tasks.items():
+            if task in pending or task.exception() is not None:
+                self.dropped += 1
+                await self._evict(conn)
+            else:
+                self.sent += 1
+
+    async def _evict(self, conn: Connection):
+        self.disconnect(conn)
+        try:
+            await asyncio.wait_for(conn.websocket.close(), self.send_timeout)
+        except Exception:
+            pass
+
+    # ---------- heartbeat ----------
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"⚠️ WebSocket heartbeat failed: {e}")
+
+    async def sweep(self):
+        """Evict idle sockets and ping the ones that have been quiet"""
+        now = time.monotonic()
+        quiet = []
+        for conn in list(self.connections.values()):
+            idle = now - conn.last_seen
+            if self.idle_timeout and idle > self.idle_timeout:
+                self.evicted += 1
+                await self._evict(conn)
+            elif idle >= self.heartbeat:
+                quiet.append(conn)
+        if quiet:
+            await self._fan_out(quiet, json.dumps({"type": "ping"}))
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "rooms": len(self.rooms),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "backend": type(self.backend).__name__,
+        }
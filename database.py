@@ -1,48 +1,347 @@
 import os
-from supabase import create_client, Client
+import time
+import asyncio
+import base64
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 from datetime import datetime
 
+from metrics import DB_ERRORS, instrument_postgrest
+
+if TYPE_CHECKING:
+    from supabase import Client
+    from replica import LocalReplica
+
 SUPABASE_URL = os.getenv("SUPABASE_URL", "https://your-project.supabase.co")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "your-anon-key")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 16))
+LEADS_PAGE_MAX = int(os.getenv("LEADS_PAGE_MAX", 500))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 1000))
+
+LEAD_COLUMNS = [
+    "id", "phone_number", "full_name", "email", "source", "quality", "status",
+    "notes", "user_id", "is_public", "shared_with", "created_at",
+]
+LEAD_FIELDS = set(LEAD_COLUMNS)
+CAMPAIGN_LOG_COLUMNS = [
+    "campaign_id", "lead_phone", "message_sent", "status", "error_message", "response_text", "user_id", "created_at",
+]
+# PostgREST/Postgres error codes that reject a request for its content rather than an outage:
+# data exceptions (22), constraint violations (23), bad payloads (PGRST1xx). A missing column
+# (PGRST204) is a schema out of step with the code: it is spilled and retried, not quarantined.
+ROW_ERROR_CODES = ("22", "23", "PGRST1")
+
+# Read cache: per-method TTL (seconds) and an LRU bound on entries per method
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+CACHE_TTLS = {
+    "get_user": float(os.getenv("CACHE_TTL_USER", 60)),
+    "get_public_lead": float(os.getenv("CACHE_TTL_PUBLIC_LEAD", 300)),
+    "get_lead_share_status": float(os.getenv("CACHE_TTL_SHARE", 60)),
+    "get_last_events": float(os.getenv("CACHE_TTL_EVENTS", 5)),
+}
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    Values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, record_miss: bool = True):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+            if record_miss:
+                self.misses += 1
+            return _MISSING
+
+    def set(self, key, value, version: int = None):
+        """Store ``value`` unless an invalidation happened since ``version`` was read"""
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=_MISSING):
+        with self.lock:
+            self.version += 1
+            if key is _MISSING:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def cached(fn):
+    """Serve a Database read from its TTLCache (keyed by positional args)"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(self, *args):
+        cache = self.caches[name]
+        value = cache.get(args)
+        if value is _MISSING:
+            version = cache.version
+            value = fn(self, *args)
+            cache.set(args, value, version)
+        return value
+    wrapper.cache_name = name
+    return wrapper
+
+
+def is_row_error(error: Exception) -> bool:
+    """The database refused the rows themselves (retrying them unchanged cannot help)"""
+    return str(getattr(error, "code", "") or "").startswith(ROW_ERROR_CODES)
+
+
+def encode_cursor(row: dict) -> str:
+    raw = f"{row['created_at']}|{row['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, lead_id = raw.split("|", 1)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return created_at, lead_id
 
 class Database:
-    def __init__(self):
-        self.client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    def __init__(self, client: "Client" = None, cache_max_entries: int = CACHE_MAX_ENTRIES,
+                 replica: "LocalReplica" = None):
+        if client is None:
+            from supabase import create_client
+            client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        self.client: "Client" = client
+        try:
+            instrument_postgrest(self.client.postgrest.session)
+        except Exception:
+            pass  # metrics are best-effort (e.g. a test double without a postgrest session)
+        self.caches = {name: TTLCache(name, ttl, cache_max_entries) for name, ttl in CACHE_TTLS.items()}
+        self.replica = replica
+
+    def cached_value(self, name: str, *args):
+        """Cached result of a @cached method, or _MISSING (never hits the network)"""
+        cache = self.caches.get(name)
+        return cache.get(args, record_miss=False) if cache else _MISSING
+
+    def cache_stats(self) -> dict:
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def _lead_written(self, *phones):
+        for phone in phones:
+            self.caches["get_public_lead"].invalidate((phone,))
+
+    def _local(self, table: str):
+        """The replica when it has finished loading ``table``, else None (read from Supabase)"""
+        replica = self.replica
+        return replica if replica is not None and replica.ready(table) else None
+
+    def _mirror(self, method: str, *args, **kwargs):
+        """Apply a write that already succeeded upstream to the replica (best-effort)"""
+        if self.replica is None:
+            return
+        try:
+            getattr(self.replica, method)(*args, **kwargs)
+        except Exception as e:
+            print(f"⚠️ Replica write-through failed, waiting for the next sync: {e}")
+            self.replica.poke()
 
     # ==================== Users ====================
+    @cached
     def get_user(self, username: str):
+        local = self._local("users")
+        if local:
+            return local.find("users", username=username)
         res = self.client.table("users").select("*").eq("username", username).execute()
         if res.data:
             return res.data[0]
         return None
 
     def add_user(self, data: dict):
-        self.client.table("users").insert([data]).execute()
+        res = self.client.table("users").insert([data]).execute()
+        self._mirror("upsert", "users", res.data or [])
+        self.caches["get_user"].invalidate((data.get("username"),))
 
     def delete_user(self, username: str):
         self.client.table("users").delete().eq("username", username).execute()
+        self._mirror("delete", "users", username=username)
+        self.caches["get_user"].invalidate((username,))
+
+    def update_user_password(self, username: str, password_hash: str):
+        self.client.table("users").update({"password": password_hash}).eq("username", username).execute()
+        self._mirror("update", "users", {"password": password_hash}, username=username)
+        self.caches["get_user"].invalidate((username,))
 
     def update_user_permissions(self, data: dict):
         username = data.pop("username")
         self.client.table("users").update(data).eq("username", username).execute()
+        self._mirror("update", "users", data, username=username)
+        self.caches["get_user"].invalidate((username,))
 
     def get_serper_keys(self):
         # Example: return number of Serper API keys
         return ["key1", "key2", "key3"]
 
     # ==================== Leads ====================
-    def get_leads(self, user_id: str = None):
-        query = self.client.table("leads").select("*")
-        if user_id:
-            query = query.eq("user_id", user_id)
-        return query.execute().data
+    def get_leads(self, user_id: str = None, limit: int = 50, **kwargs):
+        return self.get_leads_page(user_id=user_id, limit=limit, **kwargs)["leads"]
+
+    def get_leads_page(self, user_id: str = None, limit: int = 50, cursor: str = None, fields=None,
+                       status: str = None, quality: str = None, source: str = None,
+                       created_from: str = None, created_to: str = None):
+        """One keyset page of leads, newest first, ordered by (created_at, id).
+
+        ``cursor`` is the ``next_cursor`` of the previous page; ``fields``
+        restricts the returned columns (created_at and id are always included).
+        """
+        limit = max(1, min(int(limit), LEADS_PAGE_MAX))
+        if fields:
+            unknown = set(fields) - LEAD_FIELDS
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+            columns = ",".join(dict.fromkeys(list(fields) + ["created_at", "id"]))
+        else:
+            columns = "*"
+        local = self._local("leads")
+        if local:
+            before = decode_cursor(cursor) if cursor else None
+            rows = local.select("leads", desc=True, limit=limit + 1, before=before, created_from=created_from,
+                                created_to=created_to, user_id=user_id or None, status=status or None,
+                                quality=quality or None, source=source or None)
+            if columns != "*":
+                rows = [{c: row.get(c) for c in columns.split(",")} for row in rows]
+            next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+            return {"leads": rows[:limit], "next_cursor": next_cursor}
+        query = self.client.table("leads").select(columns)
+        for column, value in (("user_id", user_id), ("status", status), ("quality", quality), ("source", source)):
+            if value:
+                query = query.eq(column, value)
+        if created_from:
+            query = query.gte("created_at", created_from)
+        if created_to:
+            query = query.lt("created_at", created_to)
+        if cursor:
+            created_at, lead_id = decode_cursor(cursor)
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{lead_id}")')
+        # Fetch one extra row to know whether another page exists
+        rows = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute().data or []
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return {"leads": rows[:limit], "next_cursor": next_cursor}
 
     def add_lead(self, lead: dict):
-        lead["created_at"] = datetime.now().isoformat()
-        self.client.table("leads").insert([lead]).execute()
+        # created_at is left to the database so the replica watermark follows commit time
+        res = self.client.table("leads").insert([lead]).execute()
+        if res.data:
+            lead["created_at"] = res.data[0].get("created_at")
+        self._lead_written(lead.get("phone_number"))
+        self._mirror("upsert", "leads", res.data or [])
+        return res.data[0]["id"] if res.data else None
+
+    def upsert_leads(self, leads: list, defaults: dict = None, owner: str = None):
+        """Insert or update a batch on phone_number; returns (inserted, updated, refused) rows.
+
+        ``leads`` carry only the columns the caller supplied: new leads get
+        ``defaults`` for the rest and existing ones keep their stored values.
+        With ``owner`` set, leads that belong to another user are refused
+        instead of overwritten. Every row in the request has the same columns
+        (PostgREST rejects mixed keys) and none has created_at, so existing
+        leads keep their position in the (created_at, id) ordering.
+        """
+        defaults = defaults or {}
+        columns = list(dict.fromkeys(["phone_number", "user_id", *defaults, *(k for lead in leads for k in lead)]))
+        phones = [lead["phone_number"] for lead in leads]
+        # Always asked of Supabase: the replica can lag, and a lead missing there
+        # would be inserted with defaults over the stored row's columns and owner
+        found = self.client.table("leads").select("*").in_("phone_number", phones).execute().data or []
+        existing = {row["phone_number"]: row for row in found}
+        inserted, updated, refused, rows = [], [], [], []
+        for lead in leads:
+            current = existing.get(lead["phone_number"])
+            if current is None:
+                row = {**defaults, **lead}
+                inserted.append(row)
+            elif owner is not None and current.get("user_id") != owner:
+                refused.append(lead)
+                continue
+            else:
+                row = {**current, **lead}
+                updated.append(row)
+            rows.append({column: row.get(column) for column in columns})
+        if rows:
+            self.client.table("leads").upsert(rows, on_conflict="phone_number", returning="minimal").execute()
+            self._lead_written(*(row["phone_number"] for row in rows))
+            # Updated rows are mirrored here; inserted ones have no id yet and arrive with the next sync
+            self._mirror("upsert", "leads", updated)
+            if self.replica is not None:
+                self.replica.poke()
+        return inserted, updated, refused
+
+    def save_leads(self, leads: list):
+        """Bulk insert, skipping phone numbers that already exist; returns the rows stored"""
+        res = self.client.table("leads").upsert(leads, on_conflict="phone_number", ignore_duplicates=True).execute()
+        self._lead_written(*(row["phone_number"] for row in res.data or []))
+        self._mirror("upsert", "leads", res.data or [])
+        return res.data or []
+
+    def get_phone_page(self, after_id: str = None, limit: int = 1000):
+        """(id, phone_number) rows ordered by id, starting after ``after_id``"""
+        local = self._local("leads")
+        if local:
+            rows = local.select("leads", order="id", limit=limit, after_id=after_id or None)
+            return [{"id": row["id"], "phone_number": row.get("phone_number")} for row in rows]
+        query = self.client.table("leads").select("id,phone_number")
+        if after_id:
+            query = query.gt("id", after_id)
+        return query.order("id").limit(limit).execute().data or []
+
+    def get_leads_since(self, created_at: str = None, lead_id: str = None, limit: int = 1000, columns=("*",)):
+        """Leads ordered by (created_at, id) ascending, after that keyset position"""
+        local = self._local("leads")
+        if local:
+            rows = local.select("leads", limit=limit, after=(created_at, lead_id) if created_at else None)
+            if "*" not in columns:
+                rows = [{c: row.get(c) for c in columns} for row in rows]
+            return rows
+        query = self.client.table("leads").select(",".join(columns))
+        if created_at:
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt."{lead_id}")')
+        return query.order("created_at").order("id").limit(limit).execute().data or []
 
     # ==================== Campaigns ====================
-    def create_campaign(self, name: str, message: str, user_id: str, media):
+    def create_campaign(self, name: str, message: str, user_id: str, media,
+                        target_quality: list = None, target_status: str = None):
         campaign_data = {
             "name": name,
             "message": message,
@@ -50,19 +349,61 @@ class Database:
             "status": "draft",
             "sent_count": 0,
             "delivered_count": 0,
+            "failed_count": 0,
+            "target_quality": target_quality or [],
+            "target_status": target_status,
+            "media_url": media,
             "created_at": datetime.now().isoformat()
         }
         res = self.client.table("whatsapp_campaigns").insert([campaign_data]).execute()
+        self._mirror("upsert", "whatsapp_campaigns", res.data)
         return res.data[0]['id']
 
-    def get_campaigns(self, user_id: str = None):
+    def get_campaign(self, campaign_id: str):
+        local = self._local("whatsapp_campaigns")
+        if local:
+            return local.find("whatsapp_campaigns", id=campaign_id)
+        res = self.client.table("whatsapp_campaigns").select("*").eq("id", campaign_id).execute()
+        if res.data:
+            return res.data[0]
+        return None
+
+    def get_campaigns(self, user_id: str = None, status: list = None):
+        local = self._local("whatsapp_campaigns")
+        if local:
+            return local.select("whatsapp_campaigns", in_={"status": status} if status else None, user_id=user_id or None)
         query = self.client.table("whatsapp_campaigns").select("*")
         if user_id:
             query = query.eq("user_id", user_id)
+        if status:
+            query = query.in_("status", status)
         return query.execute().data
 
+    def update_campaign(self, campaign_id: str, data: dict):
+        self.client.table("whatsapp_campaigns").update(data).eq("id", campaign_id).execute()
+        self._mirror("update", "whatsapp_campaigns", data, id=campaign_id)
+
+    def get_campaign_sent_phones(self, campaign_id: str, page_size: int = 1000):
+        """Phones that already have a log row for this campaign (used to resume)"""
+        phones, start = set(), 0
+        while True:
+            rows = (self.client.table("campaign_logs").select("lead_phone")
+                    .eq("campaign_id", campaign_id).range(start, start + page_size - 1).execute().data or [])
+            phones.update(row["lead_phone"] for row in rows)
+            if len(rows) < page_size:
+                return phones
+            start += page_size
+
     def delete_campaign(self, campaign_id: str):
         self.client.table("whatsapp_campaigns").delete().eq("id", campaign_id).execute()
+        self._mirror("delete", "whatsapp_campaigns", id=campaign_id)
+
+    def log_messages(self, logs: list):
+        self.client.table("campaign_logs").insert(logs).execute()
+
+    def log_hunt(self, data: dict):
+        data["created_at"] = datetime.now().isoformat()
+        self.client.table("hunt_logs").insert([data]).execute()
 
     # ==================== Lead Sharing ====================
     def share_lead(self, data: dict):
@@ -78,15 +419,20 @@ class Database:
             "shared_by": user_id,
             "share_date": datetime.now().isoformat()
         }
-        self.client.table("lead_shares").insert([share_data]).execute()
+        res = self.client.table("lead_shares").insert([share_data]).execute()
+        self._mirror("upsert", "lead_shares", res.data or [])
+        self.caches["get_lead_share_status"].invalidate((phone,))
         if is_public:
             return f"/public/lead/{phone}"
         return "تم مشاركة العميل داخلياً"
 
+    @cached
     def get_public_lead(self, phone: str):
-        res = self.client.table("leads").select("*").eq("phone_number", phone).execute()
-        if res.data:
-            lead = res.data[0]
+        local = self._local("leads")
+        rows = ([local.find("leads", phone_number=phone)] if local else
+                self.client.table("leads").select("*").eq("phone_number", phone).execute().data)
+        if rows and rows[0]:
+            lead = rows[0]
             return {
                 "phone_number": lead['phone_number'],
                 "full_name": lead['full_name'],
@@ -94,23 +440,99 @@ class Database:
             }
         return None
 
+    @cached
     def get_lead_share_status(self, phone: str):
-        res = self.client.table("lead_shares").select("*").eq("phone", phone).execute()
-        if res.data:
-            share = res.data[0]
+        local = self._local("lead_shares")
+        rows = ([local.find("lead_shares", phone=phone)] if local else
+                self.client.table("lead_shares").select("*").eq("phone", phone).execute().data)
+        if rows and rows[0]:
+            share = rows[0]
             return {"status": "مشارك", "date": share['share_date'], "by": share['shared_by']}
         return {"status": "غير مشارك", "date": None, "by": None}
 
     def cancel_share(self, phone: str, user_id: str):
         self.client.table("lead_shares").delete().eq("phone", phone).eq("shared_by", user_id).execute()
+        self._mirror("delete", "lead_shares", phone=phone, shared_by=user_id)
+        self.caches["get_lead_share_status"].invalidate((phone,))
 
     # ==================== Statistics & Events ====================
-    def get_admin_stats(self, user_id: str = None):
-        total_users = len(self.client.table("users").select("*").execute().data)
-        total_leads = len(self.client.table("leads").select("*").execute().data)
-        total_messages = len(self.client.table("campaign_logs").select("*").execute().data)
-        return {"total_users": total_users, "total_leads": total_leads, "total_messages": total_messages}
+    def count_rows(self, table: str, count: str = "exact", created_from: str = None,
+                   created_to: str = None, **filters):
+        """Server-side row count (PostgREST Content-Range); no rows are transferred"""
+        local = self._local(table)
+        if local:
+            return local.count(table, created_from=created_from, created_to=created_to, **filters)
+        query = self.client.table(table).select("id", count=count)
+        for column, value in filters.items():
+            if value is not None:
+                query = query.eq(column, value)
+        if created_from:
+            query = query.gte("created_at", created_from)
+        if created_to:
+            query = query.lt("created_at", created_to)
+        return query.limit(1).execute().count or 0
+
+    def get_admin_stats(self, user_id: str = None, count: str = "exact"):
+        return {
+            "total_users": self.count_rows("users", count=count),
+            "total_leads": self.count_rows("leads", count=count, user_id=user_id),
+            "total_messages": self.count_rows("campaign_logs", count=count),
+        }
 
+    def get_leads_breakdown(self, days: int = 7):
+        """Per-status, per-user and per-day lead counts via the leads_breakdown SQL function"""
+        return self.client.rpc("leads_breakdown", {"days": days}).execute().data
+
+    @cached
     def get_last_events(self):
         res = self.client.table("events").select("*").order("timestamp", desc=True).limit(20).execute()
         return res.data
+
+
+class AsyncDatabase:
+    """Awaitable facade over Database.
+
+    Every call runs the synchronous Supabase client on a dedicated, bounded
+    thread pool (DB_POOL_SIZE workers), so DB round trips never block the event
+    loop and a burst of queries can't starve the default executor.
+    ``await adb.get_leads(...)`` works for every public Database method.
+    """
+
+    def __init__(self, db: Database, max_workers: int = DB_POOL_SIZE):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="supabase")
+
+    @property
+    def client(self) -> "Client":
+        return self.db.client
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        except Exception:
+            DB_ERRORS.inc(getattr(fn, "__name__", "query"))
+            raise
+
+    async def query(self, build):
+        """Run an ad-hoc query: ``await adb.query(lambda c: c.table("x").select("*"))``"""
+        return await self.run(lambda: build(self.db.client).execute())
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        cache_name = getattr(attr, "cache_name", None)
+
+        async def call(*args, **kwargs):
+            # Cache hits are answered inline, without a trip through the pool
+            if cache_name and not kwargs:
+                value = self.db.cached_value(cache_name, *args)
+                if value is not _MISSING:
+                    return value
+            return await self.run(attr, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
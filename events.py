@@ -0,0 +1,140 @@
+"""Push channel for hunt and campaign progress.
+
+Producers call ``publish(topic, snapshot)`` on every change; that only
+records the latest ``snapshot`` callable for the topic. Once per
+EVENTS_TICK seconds the hub renders each dirty topic that has subscribers
+once and hands the result to every subscriber, so thousands of updates per
+second turn into at most one frame per subscriber per tick.
+
+Each subscriber coalesces by topic (a newer snapshot replaces an unsent one)
+and keeps at most EVENTS_QUEUE_SIZE frames queued for its socket. A slow
+consumer therefore stops receiving intermediate states rather than growing
+memory: it gets the latest state once it catches up.
+"""
+import asyncio
+import os
+from typing import Callable, Dict, List, Optional, Set
+
+EVENTS_TICK = float(os.environ.get("EVENTS_TICK", 0.25))
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 8))
+EVENTS_MAX_TOPICS = int(os.environ.get("EVENTS_MAX_TOPICS", 50))  # per subscriber
+
+
+class Subscription:
+    """One client's topics plus its coalescing outbox"""
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.topics: Set[str] = set()
+        self.pending: Dict[str, dict] = {}
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.sent = 0
+        self.coalesced = 0
+        self.lagged = 0
+
+    def offer(self, topic: str, data: dict):
+        if topic in self.pending:
+            self.coalesced += 1
+        self.pending[topic] = data
+
+    def flush(self):
+        """Move pending events into the outbox; keep them if the outbox is full"""
+        if not self.pending:
+            return
+        batch = [{"topic": topic, "data": data} for topic, data in self.pending.items()]
+        try:
+            self.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            self.lagged += 1
+            return
+        self.pending = {}
+
+    async def next_batch(self) -> List[dict]:
+        batch = await self.queue.get()
+        self.sent += len(batch)
+        return batch
+
+
+class EventHub:
+    def __init__(self, tick: float = EVENTS_TICK):
+        self.tick = tick
+        self.subscribers: Dict[str, Set[Subscription]] = {}
+        self.dirty: Dict[str, Callable[[], dict]] = {}
+        self.published = 0
+        self.rendered = 0
+        self._waiting: Set[Subscription] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, topic: str, snapshot: Callable[[], dict]):
+        """Mark ``topic`` changed; ``snapshot()`` is rendered at the next tick"""
+        self.published += 1
+        if topic in self.subscribers:
+            self.dirty[topic] = snapshot
+
+    def subscribe(self, sub: Subscription, topic: str, snapshot: Optional[Callable[[], dict]] = None) -> bool:
+        """Add ``topic`` to ``sub``; ``snapshot`` (if given) is sent as the current state"""
+        if topic not in sub.topics and len(sub.topics) >= EVENTS_MAX_TOPICS:
+            return False
+        sub.topics.add(topic)
+        self.subscribers.setdefault(topic, set()).add(sub)
+        if snapshot is not None:
+            sub.offer(topic, snapshot())
+            self._waiting.add(sub)
+        self._ensure_started()
+        return True
+
+    def unsubscribe(self, sub: Subscription, topic: Optional[str] = None):
+        """Drop one topic, or every topic when ``topic`` is None"""
+        for name in [topic] if topic else list(sub.topics):
+            sub.topics.discard(name)
+            sub.pending.pop(name, None)
+            members = self.subscribers.get(name)
+            if members is not None:
+                members.discard(sub)
+                if not members:
+                    del self.subscribers[name]
+                    self.dirty.pop(name, None)
+        if not sub.topics:
+            self._waiting.discard(sub)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.flush()
+
+    def flush(self):
+        dirty, self.dirty = self.dirty, {}
+        for topic, snapshot in dirty.items():
+            members = self.subscribers.get(topic)
+            if not members:
+                continue
+            try:
+                data = snapshot()
+            except Exception as e:
+                print(f"⚠️ Event snapshot for {topic} failed: {e}")
+                continue
+            self.rendered += 1
+            for sub in members:
+                sub.offer(topic, data)
+                self._waiting.add(sub)
+        waiting, self._waiting = self._waiting, set()
+        for sub in waiting:
+            sub.flush()
+            if sub.pending:
+                self._waiting.add(sub)  # outbox full; retry next tick
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "topics": len(self.subscribers),
+            "subscriptions": sum(len(members) for members in self.subscribers.values()),
+            "published": self.published,
+            "rendered": self.rendered,
+        }
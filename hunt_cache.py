@@ -0,0 +1,185 @@
+"""Cache of Serper search results keyed by the normalised query.
+
+Entries expire according to the hunt's ``time_filter`` (results for the past
+hour go stale much faster than results for the past month). An in-memory LRU
+tier answers hot queries; an optional SQLite tier (HUNT_CACHE_DB) keeps
+results across restarts. Concurrent identical lookups are coalesced onto one
+upstream call.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+
+if TYPE_CHECKING:
+    import sqlite3  # imported when the database is first opened, not at startup
+
+HUNT_CACHE_ENTRIES = int(os.environ.get("HUNT_CACHE_ENTRIES", 5000))
+HUNT_CACHE_DB = os.environ.get("HUNT_CACHE_DB", "")  # e.g. media/hunt_cache.sqlite3; empty disables disk tier
+
+# Seconds a result stays fresh per Serper time filter
+TIME_FILTER_TTLS = {
+    "qdr:h": 10 * 60,
+    "qdr:d": 60 * 60,
+    "qdr:w": 6 * 60 * 60,
+    "qdr:m": 24 * 60 * 60,
+    "qdr:y": 3 * 24 * 60 * 60,
+}
+DEFAULT_TTL = 3 * 24 * 60 * 60
+
+_ARABIC_FOLD = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ى": "ي", "ة": "ه", "ـ": None})
+_DIACRITICS = re.compile(r"[\u064b-\u0652]")
+
+
+def normalize_query(query: str) -> str:
+    """Case/space/diacritic-insensitive form so near-identical queries share a key"""
+    text = unicodedata.normalize("NFKC", query).lower().translate(_ARABIC_FOLD)
+    return " ".join(_DIACRITICS.sub("", text).split())
+
+
+def ttl_for(time_filter: Optional[str]) -> int:
+    return TIME_FILTER_TTLS.get(time_filter or "", DEFAULT_TTL)
+
+
+class SearchCache:
+    def __init__(self, max_entries: int = HUNT_CACHE_ENTRIES, db_path: str = HUNT_CACHE_DB):
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.inflight: dict = {}
+        self.db_path = db_path
+        self._conn: "Optional[sqlite3.Connection]" = None
+        self._db_lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = self.coalesced = 0
+
+    @staticmethod
+    def make_key(query: str, page: int, time_filter: Optional[str], **params) -> str:
+        extra = "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+        return f"{normalize_query(query)}|{page}|{time_filter or ''}|{extra}"
+
+    async def get_or_fetch(self, key: str, ttl: float, fetch: Callable[[], Awaitable[list]]) -> list:
+        """Cached results for ``key``, calling ``fetch`` at most once per expiry"""
+        value = self._memory_get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # The lookup runs as its own task, so cancelling whichever caller
+            # started it does not cancel it for the callers waiting on it
+            task = asyncio.create_task(self._load(key, ttl, fetch))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self._loaded(key, done))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                # The lookup itself was cancelled (shutdown), not this caller
+                raise RuntimeError("search was cancelled") from None
+            raise
+
+    async def _load(self, key: str, ttl: float, fetch: Callable[[], Awaitable[list]]) -> list:
+        value = await self._disk_get(key)
+        if value is not None:
+            self.disk_hits += 1
+            self._memory_set(key, value, ttl)
+            return value
+        # Errors are shared with waiting callers but never cached
+        self.misses += 1
+        value = await fetch()
+        self._memory_set(key, value, ttl)
+        await self._disk_set(key, value, ttl)
+        return value
+
+    def _loaded(self, key: str, task: asyncio.Task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved when every caller gave up waiting
+
+    # ---------- memory tier ----------
+    def _memory_get(self, key: str):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self.memory[key]
+            return None
+        self.memory.move_to_end(key)
+        return entry[1]
+
+    def _memory_set(self, key: str, value: list, ttl: float):
+        self.memory[key] = (time.time() + ttl, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    # ---------- disk tier ----------
+    def _db(self) -> "sqlite3.Connection":
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            import sqlite3
+
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, expires REAL, value TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS search_cache_expires ON search_cache (expires)")
+        return self._conn
+
+    async def _disk_get(self, key: str):
+        if not self.db_path:
+            return None
+
+        def read():
+            with self._db_lock:
+                row = self._db().execute(
+                    "SELECT value FROM search_cache WHERE key = ? AND expires > ?", (key, time.time())
+                ).fetchone()
+            return json.loads(row[0]) if row else None
+        try:
+            return await asyncio.to_thread(read)
+        except Exception as e:
+            print(f"⚠️ Hunt cache read failed: {e}")
+            return None
+
+    async def _disk_set(self, key: str, value: list, ttl: float):
+        if not self.db_path:
+            return
+
+        def write():
+            with self._db_lock:
+                conn = self._db()
+                conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, expires, value) VALUES (?, ?, ?)",
+                    (key, time.time() + ttl, json.dumps(value, ensure_ascii=False)),
+                )
+                conn.execute("DELETE FROM search_cache WHERE expires <= ?", (time.time(),))
+                conn.commit()
+        try:
+            await asyncio.to_thread(write)
+        except Exception as e:
+            print(f"⚠️ Hunt cache write failed: {e}")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self.memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,308 @@
+"""Asynchronous hunt engine for Hunter Pro CRM.
+
+A hunt expands ``intent_sentence``/``city``/``mode`` into a set of Serper
+queries, runs them concurrently over one pooled ``httpx.AsyncClient``, pulls
+phone numbers out of the result snippets as they arrive and bulk-writes the
+deduplicated leads. Every hunt gets a ``request_id`` that can be polled.
+"""
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Optional
+from urllib.parse import urlparse
+
+from hunt_cache import SearchCache, ttl_for
+
+if TYPE_CHECKING:
+    import httpx  # imported with the first hunt, not at startup
+
+SERPER_URL = os.environ.get("SERPER_URL", "https://google.serper.dev/search")
+HUNT_CONCURRENCY = int(os.environ.get("HUNT_CONCURRENCY", 16))  # Serper calls in flight per process
+MAX_ACTIVE_HUNTS = int(os.environ.get("MAX_ACTIVE_HUNTS", 32))
+HUNT_PAGES = int(os.environ.get("HUNT_PAGES", 2))
+HUNT_WRITE_BATCH = int(os.environ.get("HUNT_WRITE_BATCH", 200))
+HUNT_JOBS_KEEP = int(os.environ.get("HUNT_JOBS_KEEP", 500))
+SERPER_TIMEOUT = float(os.environ.get("SERPER_TIMEOUT", 15))
+SERPER_RETRIES = int(os.environ.get("SERPER_RETRIES", 2))  # extra attempts on 429, each with a fresh key
+
+# Query templates per hunt mode; unknown modes fall back to "general"
+MODE_TEMPLATES = {
+    "general": [
+        '{intent} {city}',
+        '"{intent}" {city} "01"',
+        '{intent} {city} رقم موبايل',
+        '{intent} {city} واتساب',
+    ],
+    "social": [
+        'site:facebook.com "{intent}" {city}',
+        'site:instagram.com "{intent}" {city}',
+        'site:twitter.com "{intent}" {city}',
+    ],
+    "classifieds": [
+        'site:olx.com.eg "{intent}" {city}',
+        'site:dubizzle.com.eg "{intent}" {city}',
+        'site:aqarmap.com.eg "{intent}" {city}',
+    ],
+}
+MODE_TEMPLATES["deep"] = [t for mode in ("general", "social", "classifieds") for t in MODE_TEMPLATES[mode]]
+
+
+def build_queries(intent: str, city: str, mode: str = "general") -> List[str]:
+    """Expand a hunt into its Serper query strings (deduplicated, order kept)"""
+    intent = " ".join(intent.split())
+    city = " ".join(city.split())
+    templates = MODE_TEMPLATES.get(mode, MODE_TEMPLATES["general"])
+    return list(dict.fromkeys(t.format(intent=intent, city=city).strip() for t in templates))
+
+
+class HuntJob:
+    """Progress and results of a single hunt"""
+
+    def __init__(self, request):
+        self.request_id = uuid.uuid4().hex
+        self.intent = request.intent_sentence
+        self.city = request.city
+        self.time_filter = request.time_filter
+        self.mode = request.mode
+        self.user_id = request.user_id
+        self.status = "queued"
+        self.queries_total = 0
+        self.queries_done = 0
+        self.queries_failed = 0
+        self.phones_found = 0
+        self.phones_known = 0
+        self.leads_saved = 0
+        self.leads_failed = 0
+        self.errors: List[str] = []
+        self.leads: List[dict] = []
+        self.seen = set()
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self, include_leads: bool = True) -> dict:
+        end = self.finished_at or time.time()
+        data = {
+            "request_id": self.request_id,
+            "status": self.status,
+            "search": self.intent,
+            "city": self.city,
+            "mode": self.mode,
+            "time_filter": self.time_filter,
+            "queries_total": self.queries_total,
+            "queries_done": self.queries_done,
+            "queries_failed": self.queries_failed,
+            "phones_found": self.phones_found,
+            "phones_known": self.phones_known,
+            "leads_saved": self.leads_saved,
+            "leads_failed": self.leads_failed,
+            "errors": self.errors[-10:],
+            "duration_seconds": round(end - self.started_at, 2) if self.started_at else 0,
+        }
+        if include_leads:
+            data["leads"] = self.leads
+        return data
+
+
+class HuntEngine:
+    """Runs hunts as asyncio tasks sharing one pooled HTTP client.
+
+    ``limiter`` hands out Serper keys (``await acquire()``) and takes status
+    feedback (``await report()``), ``extract_phones`` maps text to a list of phone
+    numbers and ``save_leads`` bulk-writes rows and returns the rows actually
+    stored. Phones for which ``is_known`` is true are dropped before
+    they reach the database, and ``cache`` (a SearchCache) lets identical
+    queries across hunts share one Serper call. ``on_progress(job)`` is called
+    (synchronously, so keep it cheap) whenever a job's counters change.
+    """
+
+    def __init__(
+        self,
+        limiter,
+        extract_phones: Callable[[str], List[str]],
+        save_leads: Callable[[List[dict]], Awaitable[List[dict]]],
+        on_finish: Optional[Callable[["HuntJob"], Awaitable[None]]] = None,
+        is_known: Optional[Callable[[str], bool]] = None,
+        cache: Optional[SearchCache] = None,
+        on_progress: Optional[Callable[["HuntJob"], None]] = None,
+    ):
+        self.limiter = limiter
+        self.extract_phones = extract_phones
+        self.save_leads = save_leads
+        self.on_finish = on_finish
+        self.is_known = is_known
+        self.cache = cache
+        self.on_progress = on_progress
+        self.jobs: "OrderedDict[str, HuntJob]" = OrderedDict()
+        self._tasks = set()
+        self._client: "Optional[httpx.AsyncClient]" = None
+        self._query_slots = asyncio.Semaphore(HUNT_CONCURRENCY)
+        self._hunt_slots = asyncio.Semaphore(MAX_ACTIVE_HUNTS)
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        if self._client is None or self._client.is_closed:
+            import httpx
+            self._client = httpx.AsyncClient(
+                timeout=SERPER_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=HUNT_CONCURRENCY,
+                    max_keepalive_connections=HUNT_CONCURRENCY,
+                ),
+            )
+        return self._client
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.cache is not None:
+            self.cache.close()
+
+    def submit(self, request) -> HuntJob:
+        """Register a hunt and schedule it on the running event loop"""
+        job = HuntJob(request)
+        self.jobs[job.request_id] = job
+        self._prune()
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, request_id: str) -> Optional[HuntJob]:
+        return self.jobs.get(request_id)
+
+    @property
+    def active_count(self) -> int:
+        return sum(1 for job in self.jobs.values() if not job.finished)
+
+    def _prune(self):
+        # Drop the oldest finished jobs once the registry grows past its cap
+        excess = len(self.jobs) - HUNT_JOBS_KEEP
+        if excess <= 0:
+            return
+        for request_id in [rid for rid, job in self.jobs.items() if job.finished][:excess]:
+            del self.jobs[request_id]
+
+    async def _run(self, job: HuntJob):
+        async with self._hunt_slots:
+            job.status = "running"
+            job.started_at = time.time()
+            queries = [
+                (query, page)
+                for query in build_queries(job.intent, job.city, job.mode)
+                for page in range(1, HUNT_PAGES + 1)
+            ]
+            job.queries_total = len(queries)
+            self._progress(job)
+            pending: List[dict] = []
+            try:
+                for next_done in asyncio.as_completed([self._search(job, q, p) for q, p in queries]):
+                    results = await next_done
+                    for item in results:
+                        pending.extend(self._collect(job, item))
+                    if len(pending) >= HUNT_WRITE_BATCH:
+                        await self._flush(job, pending)
+                        pending = []
+                if pending:
+                    await self._flush(job, pending)
+                job.status = "done" if job.queries_done or not job.queries_total else "failed"
+            except Exception as e:
+                job.status = "failed"
+                job.errors.append(str(e))
+            finally:
+                if not job.finished:
+                    job.status = "failed"  # cancelled (shutdown) or interrupted by a BaseException
+                job.finished_at = time.time()
+                self._progress(job)
+                if self.on_finish:
+                    try:
+                        await self.on_finish(job)
+                    except Exception as e:
+                        print(f"⚠️ Hunt finish hook failed: {e}")
+
+    async def _search(self, job: HuntJob, query: str, page: int) -> List[dict]:
+        payload = {"q": query, "gl": "eg", "hl": "ar", "page": page}
+        if job.time_filter:
+            payload["tbs"] = job.time_filter
+        try:
+            if self.cache is not None:
+                key = self.cache.make_key(query, page, job.time_filter, gl="eg", hl="ar")
+                results = await self.cache.get_or_fetch(key, ttl_for(job.time_filter), lambda: self._fetch(payload))
+            else:
+                results = await self._fetch(payload)
+        except Exception as e:
+            job.queries_failed += 1
+            job.errors.append(f"{query} (page {page}): {e}")
+            self._progress(job)
+            return []
+        job.queries_done += 1
+        self._progress(job)
+        return results
+
+    async def _fetch(self, payload: dict) -> List[dict]:
+        """One Serper call; throttled or dropped keys are retried on another key"""
+        async with self._query_slots:
+            for _ in range(SERPER_RETRIES + 1):
+                key = await self.limiter.acquire()
+                if not key:
+                    raise RuntimeError("No Serper keys available")
+                response = await self.client.post(
+                    SERPER_URL,
+                    json=payload,
+                    headers={"X-API-KEY": key, "Content-Type": "application/json"},
+                )
+                await self.limiter.report(key, response.status_code, response.text if response.status_code >= 400 else "")
+                if response.status_code == 429 or key not in self.limiter.active_keys:
+                    continue
+                response.raise_for_status()
+                data = response.json()
+                return data.get("organic", []) + data.get("places", [])
+        raise RuntimeError("rate limited")
+
+    def _collect(self, job: HuntJob, item: dict) -> List[dict]:
+        text = " ".join(str(item.get(k, "")) for k in ("title", "snippet", "phoneNumber", "address"))
+        link = item.get("link") or item.get("website") or ""
+        rows = []
+        for phone in self.extract_phones(text):
+            if phone in job.seen:
+                continue
+            job.seen.add(phone)
+            job.phones_found += 1
+            if self.is_known and self.is_known(phone):
+                job.phones_known += 1
+                continue
+            rows.append({
+                "phone_number": phone,
+                "full_name": "",
+                "source": urlparse(link).netloc or "Google",
+                "quality": "جيد ⭐",
+                "status": "NEW",
+                "notes": (item.get("snippet") or item.get("title") or "")[:500],
+                "user_id": job.user_id,
+            })
+        return rows
+
+    async def _flush(self, job: HuntJob, rows: List[dict]):
+        try:
+            saved = await self.save_leads(rows)
+        except Exception as e:
+            # Nothing from this batch was stored, so none of it is listed as a lead
+            job.errors.append(f"save failed: {e}")
+            job.leads_failed += len(rows)
+            saved = []
+        job.leads_saved += len(saved)
+        job.leads.extend({"phone_number": r["phone_number"], "source": r.get("source")} for r in saved)
+        self._progress(job)
+
+    def _progress(self, job: HuntJob):
+        if self.on_progress:
+            self.on_progress(job)
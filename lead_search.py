@@ -0,0 +1,460 @@
+"""In-process search index over leads for type-ahead lookups.
+
+Every lead gets a document number in insertion order (warm-up loads oldest
+first, so higher numbers are newer). Postings are sorted ``array('I')`` lists
+of document numbers:
+
+* name/notes are folded like search queries (hunt_cache.normalize_query:
+  NFKC, alef/ya/ta marbuta folding, no diacritics or tatweel) and indexed by
+  word trigrams plus one- and two-letter word prefixes, so "محم" finds
+  "مُحمّد" and a two-letter token matches the start of a word;
+* status/quality/source/user_id each have a posting list per value;
+* phone numbers live in a sorted list and a sorted list of reversed numbers,
+  so both "0101234" (prefix) and "5678" (suffix) are a bisect away; the
+  short prefixes and suffixes, which match too many numbers to list, also
+  get a posting list each.
+
+A query turns each of its postings into a bitmap (a Python int, bit n for
+document n) and ANDs them together. Bitmaps are cached, LEAD_SEARCH_MASKS
+for text keys and as many again for filter values (built for the common ones
+at warm-up), and since postings only grow they are extended with the
+documents added since instead of being rebuilt. The result is read from the
+highest bit down, so the newest matches come first, and its ``bit_count()``
+is the exact total. Facets are counted over the matches themselves when
+there are at most LEAD_SEARCH_FACET_SCAN of them, and otherwise as the
+``bit_count()`` of the result ANDed with each of the LEAD_SEARCH_FACET_VALUES
+largest values of every facet (sources are domains, so there can be
+thousands).
+
+Only what a bitmap cannot express is checked document by document, newest
+first: words longer than a trigram (whose trigrams may come from different
+places) and longer phone ranges that still match more than
+LEAD_SEARCH_FACET_SCAN numbers; those queries count at most
+LEAD_SEARCH_FACET_SCAN matches.
+Documents replaced by a newer version of the same phone are tombstoned and
+masked out until the next restart.
+
+The index is warmed from ``leads`` at startup, fed by every insert this
+process makes and topped up every LEAD_SEARCH_REFRESH seconds with rows whose
+(created_at, id) is past the last one seen, which also picks up rows written
+by other workers.
+"""
+import asyncio
+import heapq
+import os
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from hunt_cache import normalize_query
+from phones import DIGITS, NON_DIGITS
+
+LEAD_SEARCH_PAGE = int(os.environ.get("LEAD_SEARCH_PAGE", 1000))
+LEAD_SEARCH_REFRESH = float(os.environ.get("LEAD_SEARCH_REFRESH", 30))
+LEAD_SEARCH_NOTES_CHARS = int(os.environ.get("LEAD_SEARCH_NOTES_CHARS", 200))  # of notes indexed per lead
+LEAD_SEARCH_FACET_SCAN = int(os.environ.get("LEAD_SEARCH_FACET_SCAN", 5000))  # matches checked one by one
+LEAD_SEARCH_MASKS = int(os.environ.get("LEAD_SEARCH_MASKS", 128))  # posting bitmaps kept, per kind
+LEAD_SEARCH_FACET_VALUES = int(os.environ.get("LEAD_SEARCH_FACET_VALUES", 20))  # per facet on large results
+LEAD_SEARCH_MERGE = int(os.environ.get("LEAD_SEARCH_MERGE", 10000))
+
+STORED = ("id", "phone_number", "full_name", "status", "quality", "source", "user_id", "created_at")
+FACETS = ("status", "quality", "source")
+FILTERS = FACETS + ("user_id",)
+COLUMNS = STORED + ("notes",)  # what warm-up and refresh read from leads
+
+_FIELD = {name: i for i, name in enumerate(STORED)}
+PHONE_KEY_DIGITS = {"tel^": 4, "tel$": 3}  # prefix/suffix lengths with their own postings
+_EMPTY = array("I")
+PHONE_QUERY = re.compile(r"\+?[\d \-]*\d[\d \-]*")
+
+
+def _bits(docs: Sequence[int]) -> int:
+    """Bitmap of ``docs`` (bit n set for document n)"""
+    if not docs:
+        return 0
+    bits = bytearray((max(docs) >> 3) + 1)
+    for doc in docs:
+        bits[doc >> 3] |= 1 << (doc & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _descending(mask: int) -> Iterator[int]:
+    """Document numbers set in ``mask``, newest first"""
+    words = array("Q", mask.to_bytes((mask.bit_length() + 63) // 64 * 8, "little"))
+    if sys.byteorder == "big":
+        words.byteswap()
+    for i in range(len(words) - 1, -1, -1):
+        word = words[i]
+        while word:
+            top = word.bit_length() - 1
+            yield (i << 6) + top
+            word ^= 1 << top
+
+
+class _Masks:
+    """LRU of posting bitmaps, each extended with the documents appended since it was built"""
+
+    def __init__(self, size: int = LEAD_SEARCH_MASKS):
+        self.size = size
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # name -> (postings covered, bitmap)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, postings: Sequence[int]) -> int:
+        covered, mask = self.entries.pop(name, (0, 0))
+        if covered:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if covered < len(postings):
+            mask |= _bits(postings[covered:])
+        self.entries[name] = (len(postings), mask)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return mask
+
+
+_word_keys: Dict[str, tuple] = {}  # names and notes repeat the same words over and over
+
+
+def _keys(text: str) -> set:
+    """Trigrams and one/two-letter prefixes of every word in normalised ``text``"""
+    keys = set()
+    for word in text.split():
+        found = _word_keys.get(word)
+        if found is None:
+            if len(_word_keys) >= 200_000:
+                _word_keys.clear()
+            found = _word_keys[word] = (
+                "^" + word[:1], "^" + word[:2], *{word[i:i + 3] for i in range(len(word) - 2)})
+        keys.update(found)
+    return keys
+
+
+def phone_query(q: str) -> Optional[str]:
+    """Digits of ``q`` as a (partial) 01XXXXXXXXX number, or None if ``q`` is not a number"""
+    text = q.translate(DIGITS).strip()
+    if not PHONE_QUERY.fullmatch(text):
+        return None
+    digits = NON_DIGITS.sub("", text)
+    if digits.startswith("0020"):
+        digits = "0" + digits[4:]
+    elif text.startswith("+20") or (digits.startswith("20") and len(digits) >= 12):
+        digits = "0" + digits[2:]
+    return digits
+
+
+class _SortedStrings:
+    """A large sorted run plus a small sorted run merged in amortised batches,
+    as in PhoneIndex; lookups bisect both"""
+
+    def __init__(self, merge_threshold: int = LEAD_SEARCH_MERGE):
+        self.merge_threshold = merge_threshold
+        self.sorted: List[str] = []
+        self.pending: List[str] = []
+
+    def add_many(self, values: List[str]):
+        # timsort finds the already sorted run, so this is close to linear
+        self.pending.extend(values)
+        self.pending.sort()
+        if len(self.pending) >= max(self.merge_threshold, len(self.sorted) >> 5):
+            self.sorted = sorted(self.sorted + self.pending)
+            self.pending = []
+
+    def _ranges(self, prefix: str):
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return [(run, bisect_left(run, prefix), bisect_left(run, end)) for run in (self.sorted, self.pending)]
+
+    def count_starting_with(self, prefix: str) -> int:
+        return sum(stop - start for _, start, stop in self._ranges(prefix))
+
+    def starting_with(self, prefix: str) -> List[str]:
+        return [value for run, start, stop in self._ranges(prefix) for value in run[start:stop]]
+
+
+class LeadSearchIndex:
+    def __init__(self, notes_chars: int = LEAD_SEARCH_NOTES_CHARS):
+        self.notes_chars = notes_chars
+        self.docs: List[Optional[tuple]] = []  # doc -> STORED values, None once superseded
+        self.texts: List[str] = []  # doc -> normalised name + notes, to confirm trigram hits
+        self.by_phone: Dict[str, int] = {}
+        self.postings: Dict[str, array] = defaultdict(lambda: array("I"))
+        self.phone_postings: Dict[str, array] = defaultdict(lambda: array("I"))
+        self.facets: Dict[str, Dict[str, array]] = {field: defaultdict(lambda: array("I")) for field in FILTERS}
+        self.retired = array("I")  # superseded docs, in the order they were retired
+        self.masks = _Masks()  # text keys
+        self.filter_masks = _Masks()  # "field=value" and retired docs
+        self.phones = _SortedStrings()
+        self.reversed_phones = _SortedStrings()
+        self.high_water: Optional[tuple] = None  # (created_at, id) of the newest row read from the db
+        self.live = 0
+        self.ready = False
+        self.warm_seconds: Optional[float] = None
+        self.searches = 0
+        self.search_seconds = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self.live
+
+    # ---------- writes ----------
+    def add(self, row: dict):
+        self.add_many((row,))
+
+    def add_many(self, rows: Iterable[dict]):
+        new_phones = []
+        for row in rows:
+            phone = row.get("phone_number")
+            if phone:
+                self._put(phone, row, new_phones)
+        if new_phones:
+            self.phones.add_many(new_phones)
+            self.reversed_phones.add_many([phone[::-1] for phone in new_phones])
+
+    def _put(self, phone: str, row: dict, new_phones: List[str]):
+        old = self.by_phone.get(phone)
+        fields = {name: row.get(name) for name in STORED}
+        if old is not None:
+            # Columns missing from a partial write (bulk update, local insert) keep their indexed value
+            previous = dict(zip(STORED, self.docs[old]))
+            fields = {name: previous[name] if value is None else value for name, value in fields.items()}
+            text = self._text(row) if "full_name" in row or "notes" in row else self.texts[old]
+            if text == self.texts[old] and all(fields[f] == previous[f] for f in FILTERS):
+                self.docs[old] = tuple(fields.values())  # same postings; just refresh the stored columns
+                return
+            self._retire(old)
+        else:
+            text = self._text(row)
+            new_phones.append(phone)
+        fields["created_at"] = fields["created_at"] or datetime.now().isoformat()
+        values = tuple(fields.values())
+        doc = len(self.docs)
+        self.docs.append(values)
+        self.texts.append(text)
+        self.by_phone[phone] = doc
+        self.live += 1
+        postings = self.postings
+        for key in _keys(text):
+            postings[key].append(doc)
+        for n in range(1, PHONE_KEY_DIGITS["tel^"] + 1):
+            self.phone_postings["tel^" + phone[:n]].append(doc)
+        for n in range(1, PHONE_KEY_DIGITS["tel$"] + 1):
+            self.phone_postings["tel$" + phone[-n:]].append(doc)
+        for field in FILTERS:
+            value = fields[field]
+            if value:
+                self.facets[field][value].append(doc)
+
+    def _text(self, row: dict) -> str:
+        notes = (row.get("notes") or "")[:self.notes_chars]
+        return normalize_query(f"{row.get('full_name') or ''} {notes}")
+
+    def _retire(self, doc: int):
+        self.retired.append(doc)
+        self.docs[doc] = None
+        self.texts[doc] = ""
+        self.live -= 1
+
+    # ---------- queries ----------
+    def _live(self) -> int:
+        return ((1 << len(self.docs)) - 1) & ~self.filter_masks.get("retired", self.retired)
+
+    def _filter_mask(self, field: str, value: str) -> int:
+        postings = self.facets[field].get(value)
+        return self.filter_masks.get(f"{field}={value}", postings) if postings else 0
+
+    def _top_values(self, field: str) -> List[str]:
+        postings = self.facets[field]
+        if len(postings) <= LEAD_SEARCH_FACET_VALUES:
+            return list(postings)
+        return heapq.nlargest(LEAD_SEARCH_FACET_VALUES, postings, key=lambda value: len(postings[value]))
+
+    def _facet_counts(self, mask: int, total: int) -> Dict[str, Counter]:
+        counts = {field: Counter() for field in FACETS}
+        if total <= LEAD_SEARCH_FACET_SCAN:
+            for doc in _descending(mask):
+                values = self.docs[doc]
+                for field in FACETS:
+                    value = values[_FIELD[field]]
+                    if value:
+                        counts[field][value] += 1
+            return counts
+        for field in FACETS:
+            for value in self._top_values(field):
+                count = (mask & self._filter_mask(field, value)).bit_count()
+                if count:
+                    counts[field][value] = count
+        return counts
+
+    def _phone_range(self, kind: str, digits: str) -> Optional[int]:
+        """Bitmap of the docs whose phone starts ("tel^") or ends ("tel$") with
+        ``digits``; None when there are too many to list"""
+        if len(digits) <= PHONE_KEY_DIGITS[kind]:
+            postings = self.phone_postings.get(kind + digits)
+            return self.masks.get(kind + digits, postings) if postings else 0
+        if kind == "tel$":
+            phones, digits = self.reversed_phones, digits[::-1]
+        else:
+            phones = self.phones
+        if phones.count_starting_with(digits) > LEAD_SEARCH_FACET_SCAN:
+            return None
+        found = phones.starting_with(digits)
+        return _bits([self.by_phone[p if kind == "tel^" else p[::-1]] for p in found])
+
+    def _phone_filter(self, digits: str):
+        """Bitmap of the docs whose phone starts (01...) or ends with ``digits``, or
+        a predicate on the phone number when there are too many of them to list"""
+        prefix = digits if digits.startswith("0") else "0" + digits if digits.startswith("1") else None
+        ending = self._phone_range("tel$", digits)
+        starting = self._phone_range("tel^", prefix) if prefix else 0
+        if ending is None or starting is None:
+            if prefix:
+                return lambda phone: phone.startswith(prefix) or phone.endswith(digits)
+            return lambda phone: phone.endswith(digits)
+        return ending | starting
+
+    def search(self, q: str = "", limit: int = 20, facets: bool = False, **filters) -> dict:
+        """Newest matching leads for ``q`` (name/notes text or phone digits) and exact ``filters``"""
+        started = time.perf_counter()
+        mask = self._live()
+        verify: List[str] = []
+        phone_match = None
+        digits = phone_query(q) if q else None
+        if digits:
+            found = self._phone_filter(digits)
+            if callable(found):
+                phone_match = found
+            else:
+                mask &= found
+        else:
+            for token in normalize_query(q).split():
+                keys = [token[i:i + 3] for i in range(len(token) - 2)] if len(token) >= 3 else ["^" + token]
+                for key in keys:
+                    mask &= self.masks.get(key, self.postings[key]) if key in self.postings else 0
+                if len(token) > 3:
+                    verify.append(token)
+        for field in FILTERS:
+            value = filters.get(field)
+            if value:
+                mask &= self._filter_mask(field, value)
+
+        counts = None
+        if not verify and phone_match is None:
+            # The bitmap is the exact answer
+            matches = list(islice(_descending(mask), limit))
+            total, exact = mask.bit_count(), True
+            if facets:
+                counts = self._facet_counts(mask, total)
+        else:
+            matches, total, exact = [], 0, True
+            counts = {field: Counter() for field in FACETS} if facets else None
+            phone = _FIELD["phone_number"]
+            for doc in _descending(mask):
+                values = self.docs[doc]
+                if phone_match and not phone_match(values[phone]):
+                    continue
+                if verify and not all(token in self.texts[doc] for token in verify):
+                    continue
+                if len(matches) < limit:
+                    matches.append(doc)
+                if not facets:
+                    if len(matches) >= limit:
+                        break
+                    continue
+                total += 1
+                for field in FACETS:
+                    value = values[_FIELD[field]]
+                    if value:
+                        counts[field][value] += 1
+                if total >= LEAD_SEARCH_FACET_SCAN:
+                    exact = False
+                    break
+            if not facets:
+                total, exact = len(matches), False
+        elapsed = time.perf_counter() - started
+        self.searches += 1
+        self.search_seconds += elapsed
+        return {
+            "leads": [dict(zip(STORED, self.docs[doc])) for doc in matches],
+            "total": total,
+            "total_exact": exact,
+            "facets": {field: dict(c.most_common()) for field, c in counts.items()} if counts else None,
+            "took_ms": round(elapsed * 1000, 3),
+        }
+
+    # ---------- sync with the database ----------
+    async def _read_new(self, db, page_size: int) -> int:
+        """Index rows past ``high_water`` (keyset pages on created_at, id)"""
+        read = 0
+        while True:
+            after = self.high_water or (None, None)
+            rows = await db.get_leads_since(after[0], after[1], page_size, COLUMNS)
+            self.add_many(rows)
+            read += len(rows)
+            if rows:
+                self.high_water = (rows[-1]["created_at"], rows[-1]["id"])
+            if len(rows) < page_size:
+                return read
+
+    async def _build_filter_masks(self):
+        """Bitmaps for the common filter values, so first searches don't pay for them"""
+        self._live()
+        for field in FACETS:
+            for value in self._top_values(field):
+                self._filter_mask(field, value)
+                await asyncio.sleep(0)
+
+    async def warm(self, db, page_size: int = LEAD_SEARCH_PAGE) -> int:
+        started = time.time()
+        await self._read_new(db, page_size)
+        await self._build_filter_masks()
+        self.ready = True
+        self.warm_seconds = round(time.time() - started, 2)
+        return self.live
+
+    async def refresh(self, db, page_size: int = LEAD_SEARCH_PAGE) -> int:
+        return await self._read_new(db, page_size)
+
+    def start(self, db, interval: float = LEAD_SEARCH_REFRESH):
+        """Warm in the background, then refresh every ``interval`` seconds"""
+        if self._task is not None:
+            return
+
+        async def loop():
+            try:
+                count = await self.warm(db)
+                print(f"🔎 Lead search ready: {count} leads in {self.warm_seconds}s")
+            except Exception as e:
+                print(f"⚠️ Lead search warm-up failed: {e}")
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.refresh(db)
+                except Exception as e:
+                    print(f"⚠️ Lead search refresh failed: {e}")
+        self._task = asyncio.create_task(loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "leads": self.live,
+            "superseded": len(self.docs) - self.live,
+            "keys": len(self.postings),
+            "cached_masks": len(self.masks.entries) + len(self.filter_masks.entries),
+            "mask_hits": self.masks.hits + self.filter_masks.hits,
+            "mask_misses": self.masks.misses + self.filter_masks.misses,
+            "ready": self.ready,
+            "warm_seconds": self.warm_seconds,
+            "searches": self.searches,
+            "avg_search_ms": round(self.search_seconds / self.searches * 1000, 3) if self.searches else 0.0,
+        }
@@ -0,0 +1,209 @@
+"""Write-behind buffer for append-only log tables (campaign_logs).
+
+Rows are accepted synchronously into memory and written in bulk inserts when
+LOG_BUFFER_SIZE rows are waiting or every LOG_FLUSH_INTERVAL seconds,
+whichever comes first. ``columns`` gives every row the same keys, since
+PostgREST refuses a bulk insert whose objects differ. Call ``close()`` on
+shutdown to flush what is left.
+
+If the database is down the batch is appended to this process's NDJSON spill
+file, which is replayed ahead of new rows once the database answers again.
+A worker replays its own spill file and those left behind by workers that
+have exited, claiming each one by renaming it first, so no rows are replayed
+twice or lost to an append that races the replay. Rows the database refuses
+for their content (``bad_rows(error)`` is true) are retried one at a time and
+the ones that still fail go to a ``.rejected.ndjson`` file instead of
+blocking everything queued behind them.
+"""
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+LOG_BUFFER_SIZE = int(os.environ.get("LOG_BUFFER_SIZE", 500))
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", 1.0))
+LOG_SPILL_DIR = os.environ.get("LOG_SPILL_DIR", "media")
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_rows(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _write_lines(path: str, records: List[dict], mode: str = "a"):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, mode, encoding="utf-8") as f:
+        f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        write: Callable[[List[dict]], Awaitable[None]],
+        name: str = "campaign_logs",
+        max_rows: int = LOG_BUFFER_SIZE,
+        interval: float = LOG_FLUSH_INTERVAL,
+        spill_dir: str = LOG_SPILL_DIR,
+        columns: Optional[Sequence[str]] = None,
+        bad_rows: Callable[[Exception], bool] = lambda error: False,
+    ):
+        self.write = write
+        self.name = name
+        self.max_rows = max_rows
+        self.interval = interval
+        self.spill_dir = spill_dir
+        self.columns = list(columns) if columns else None
+        self.bad_rows = bad_rows
+        self.rows: List[dict] = []
+        self.written = 0
+        self.flushes = 0
+        self.spilled = 0
+        self.rejected = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def add(self, row: dict):
+        """Queue one row; never waits on the database"""
+        self.rows.append(row)
+        self._ensure_started()
+        if len(self.rows) >= self.max_rows:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            batch, self.rows = self.rows, []
+            if not await self._replay_spills():
+                if batch:
+                    await self._spill(batch)
+                return
+            left = await self._write_rows(batch)
+            if left:
+                await self._spill(left)
+
+    # ---------- writing ----------
+    def _shape(self, row: dict) -> dict:
+        return {column: row.get(column) for column in self.columns} if self.columns else row
+
+    async def _write_rows(self, rows: List[dict]) -> List[dict]:
+        """Insert ``rows`` in batches; returns those left unwritten because the database is down"""
+        rows = [self._shape(row) for row in rows]
+        for start in range(0, len(rows), self.max_rows):
+            batch = rows[start:start + self.max_rows]
+            try:
+                await self.write(batch)
+            except Exception as e:
+                if not self.bad_rows(e):
+                    print(f"⚠️ {self.name} write failed, keeping {len(rows) - start} rows for later: {e}")
+                    return rows[start:]
+                left = await self._write_one_by_one(batch)
+                if left:
+                    return left + rows[start + self.max_rows:]
+                continue
+            self.written += len(batch)
+            self.flushes += 1
+        return []
+
+    async def _write_one_by_one(self, rows: List[dict]) -> List[dict]:
+        """A batch was refused for its content: write what goes in, set aside what doesn't"""
+        refused = []
+        try:
+            for i, row in enumerate(rows):
+                try:
+                    await self.write([row])
+                    self.written += 1
+                except Exception as e:
+                    if not self.bad_rows(e):
+                        return rows[i:]
+                    refused.append({"row": row, "error": str(e)[:500]})
+            return []
+        finally:
+            if refused:
+                await asyncio.to_thread(_write_lines, self._path("rejected"), refused)
+                self.rejected += len(refused)
+                print(f"⚠️ {self.name}: {len(refused)} rows refused by the database, kept in {self._path('rejected')}")
+
+    # ---------- spill files ----------
+    def _path(self, kind: str, pid: int = None) -> str:
+        return os.path.join(self.spill_dir, f"{self.name}.{pid or os.getpid()}.{kind}.ndjson")
+
+    def _claimable(self) -> List[str]:
+        """Spill/replay files of this process and of workers that have exited"""
+        try:
+            names = os.listdir(self.spill_dir)
+        except FileNotFoundError:
+            return []
+        found = []
+        for name in names:
+            if name == f"{self.name}.spill.ndjson":
+                found.append(os.path.join(self.spill_dir, name))  # the shared file older versions wrote
+                continue
+            pid, _, kind = name[len(self.name) + 1:].partition(".")
+            if not name.startswith(self.name + ".") or kind not in ("spill.ndjson", "replay.ndjson"):
+                continue
+            if pid.isdigit() and (int(pid) == os.getpid() or not _alive(int(pid))):
+                found.append(os.path.join(self.spill_dir, name))
+        return sorted(found)
+
+    async def _spill(self, rows: List[dict]):
+        await asyncio.to_thread(_write_lines, self._path("spill"), rows)
+        self.spilled += len(rows)
+
+    async def _replay_spills(self) -> bool:
+        """Insert spilled rows; returns False (rest kept on disk) while the database is down"""
+        replay = self._path("replay")
+        while True:
+            if not os.path.exists(replay):
+                claimable = [path for path in self._claimable() if path != replay]
+                if not claimable:
+                    return True
+                try:
+                    os.rename(claimable[0], replay)
+                except FileNotFoundError:
+                    continue  # another worker claimed it first
+            rows = await asyncio.to_thread(_read_rows, replay)
+            left = await self._write_rows(rows)
+            if left:
+                await asyncio.to_thread(_write_lines, replay, left, "w")
+                return False
+            os.remove(replay)
+            print(f"✅ Replayed {len(rows)} spilled {self.name} rows")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self.rows), "written": self.written, "flushes": self.flushes,
+            "spilled": self.spilled, "rejected": self.rejected,
+        }
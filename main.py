@@ -1,13 +1,34 @@
-from fastapi import FastAPI, BackgroundTasks, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, Form
+import time
+IMPORT_STARTED = time.perf_counter()  # measured against STARTUP_IMPORT_BUDGET_MS
+
+from fastapi import FastAPI, BackgroundTasks, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List, Dict, Any
-import os, re, json, requests, time, jwt
+import os, re, io, csv, json, asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from supabase import create_client, Client
-from twilio.rest import Client as TwilioClient
-from passlib.context import CryptContext
+FRAMEWORK_IMPORTED = time.perf_counter()  # FastAPI/pydantic alone; the budget covers what follows
+from hunt_engine import HuntEngine
+from hunt_cache import SearchCache
+from rate_limiter import KeyRateLimiter
+from campaigns import CampaignDispatcher
+from messaging import get_messaging_client, close_messaging_client, valid_twilio_signature, TWILIO_STATUS_CALLBACK
+from log_buffer import WriteBehindBuffer
+from stats import StatsService
+from phone_index import PhoneIndex
+from lead_search import LeadSearchIndex
+from events import EventHub, Subscription
+from connections import ConnectionManager
+from static_pages import CachedPage
+from auth import TokenVerifier, Authenticator, PERMISSIONS, build_principal, scope_user_id, can_access
+from passwords import PasswordHasher, PasswordBusy
+from shared_state import make_shared_state, WEB_CONCURRENCY
+from replica import make_replica
+from metrics import MetricsMiddleware, registry as metrics_registry, PROCESS_STARTED
+from phones import extract_phones as extract_phones_from_text, normalize_phone, to_e164, extract_phones_async, extract_many_async, shutdown_pool
+from database import Database, AsyncDatabase, LEAD_COLUMNS, LEADS_PAGE_MAX, BULK_BATCH_SIZE, CAMPAIGN_LOG_COLUMNS, is_row_error
 
 # ========== CONFIGURATION ==========
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
@@ -20,6 +41,24 @@ TWILIO_WHATSAPP_NUMBER = os.environ.get("TWILIO_WHATSAPP_NUMBER")
 JWT_SECRET = os.environ.get("JWT_SECRET", "change-this-in-production-123456")
 JWT_ALGORITHM = "HS256"
 PORT = int(os.environ.get("PORT", 10000))  # Render.com uses port 10000
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # optional bearer token for /metrics
+STARTUP_IMPORT_BUDGET_MS = float(os.environ.get("STARTUP_IMPORT_BUDGET_MS", 200))  # app modules + routes, after the framework
+
+# ========== LIFESPAN ==========
+# The server starts answering /health/live as soon as the app is imported;
+# Supabase is connected in the background and /health/ready turns 200 once
+# that attempt (and the startup tasks depending on it) has finished.
+readiness = {"database": False, "started_at": None, "ready_at": None}
+
+@asynccontextmanager
+async def lifespan(app):
+    readiness["started_at"] = time.perf_counter()
+    startup_task = asyncio.create_task(startup())
+    try:
+        yield
+    finally:
+        startup_task.cancel()
+        await shutdown()
 
 # ========== INITIALIZE APP ==========
 app = FastAPI(
@@ -27,7 +66,8 @@ app = FastAPI(
     version="3.0",
     description="نظام إدارة العملاء والتسويق الذكي",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -37,24 +77,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # ========== DATABASE CONNECTION ==========
-if SUPABASE_URL and SUPABASE_KEY:
-    try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("✅ Connected to Supabase successfully!")
-    except Exception as e:
-        print(f"❌ Supabase connection error: {e}")
-        supabase = None
-else:
-    print("⚠️ Supabase credentials not configured")
-    supabase = None
+# Connected by the lifespan handler; until then (or without credentials) these stay None
+supabase = None
+# All Supabase calls from async code go through db (bounded thread pool)
+db: Optional[AsyncDatabase] = None
+stats_service: Optional[StatsService] = None
+phone_index = PhoneIndex()
+lead_search = LeadSearchIndex()
+replica = make_replica()  # None unless REPLICA_DB is set
+
+def create_supabase_client():
+    """Build the Supabase client (the supabase package is imported here, not at startup)"""
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def attach_database(client):
+    """Point every component at a connected client"""
+    global supabase, db, stats_service
+    supabase = client
+    db = AsyncDatabase(Database(client, replica=replica))
+    stats_service = StatsService(db)
+    auth.db = db
+    campaign_dispatcher.db = db
 
 # ========== OTHER INITIALIZATIONS ==========
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-key_index = 0
-request_count = 0
-last_reset = time.time()
+password_hasher = PasswordHasher()
+shared_state = make_shared_state()  # None with a single worker
+serper_limiter = KeyRateLimiter(SERPER_KEYS, store=shared_state)
+event_hub = EventHub()
+token_verifier = TokenVerifier(JWT_SECRET, JWT_ALGORITHM)
+auth = Authenticator(token_verifier, db, database_configured=bool(SUPABASE_URL and SUPABASE_KEY))
+ws_manager = ConnectionManager()
+started_at = PROCESS_STARTED
 
 print(f"🎯 Hunter Pro CRM v3.0 - Ready on Render.com (Port: {PORT})")
 
@@ -88,46 +145,198 @@ class AddLeadRequest(BaseModel):
 class ExtractPhonesRequest(BaseModel):
     text: str
 
+class ExtractPhonesBatchRequest(BaseModel):
+    texts: List[str]
+
+class BroadcastRequest(BaseModel):
+    message: str
+    room: str = "admins"
+
 # ========== HELPER FUNCTIONS ==========
 def get_active_key():
-    global key_index
-    if not SERPER_KEYS:
+    """Next Serper key in rotation (exhausted keys are skipped)"""
+    return serper_limiter.next_key()
+
+def create_jwt_token(email: str, role: str = "user"):
+    return token_verifier.issue(email, role=role)
+
+async def save_hunt_leads(rows):
+    """Bulk-write hunt leads, skipping phone numbers already in the table"""
+    if not db:
+        return []
+    saved = await db.save_leads(rows)
+    phone_index.add_many(row["phone_number"] for row in rows)
+    lead_search.add_many(saved)
+    stats_service.record_leads(saved)
+    return saved
+
+async def log_hunt(job):
+    """Record a finished hunt in hunt_logs"""
+    print(f"🏁 Hunt {job.request_id} {job.status}: {job.phones_found} phones, {job.leads_saved} new leads")
+    notice = {"type": "hunt_finished", **job.to_dict(include_leads=False)}
+    for room in ["admins"] + ([f"user:{job.user_id}"] if job.user_id else []):
+        await ws_manager.broadcast(room, notice)
+    if not db:
+        return
+    await db.log_hunt({
+        "user_id": job.user_id,
+        "intent": job.intent,
+        "city": job.city,
+        "results_count": job.leads_saved,
+        "duration_seconds": int((job.finished_at or time.time()) - (job.started_at or job.created_at)),
+        "mode": job.mode
+    })
+
+def publish_hunt_progress(job):
+    topic = f"hunt:{job.request_id}"
+    event_hub.publish(topic, lambda: {"type": "hunt", **job.to_dict(include_leads=False)})
+    if shared_state:
+        shared_state.share(topic, lambda: {
+            "user_id": job.user_id, **job.to_dict(include_leads=False), "leads": list(job.leads)})
+
+def publish_campaign_progress(run):
+    topic = f"campaign:{run.campaign_id}"
+    event_hub.publish(topic, lambda: {"type": "campaign", **run.to_dict()})
+    if shared_state:
+        shared_state.share(topic, lambda: {"user_id": run.user_id, **run.to_dict()})
+
+# Hunts and campaign runs live in the worker that started them; with several
+# workers the others see them through the snapshots shared above
+async def shared_snapshot(topic: str) -> Optional[dict]:
+    """State another worker shared for ``topic`` (its owner under "user_id"), if any"""
+    if not shared_state:
         return None
-    key = SERPER_KEYS[key_index]
-    key_index = (key_index + 1) % len(SERPER_KEYS)
-    return key
-
-def safe_request_delay():
-    global request_count, last_reset
-    if time.time() - last_reset > 60:
-        request_count = 0
-        last_reset = time.time()
-    request_count += 1
-    if request_count > 30:
-        time.sleep(3.0)
-    elif request_count > 20:
-        time.sleep(2.0)
-    elif request_count > 10:
-        time.sleep(1.5)
-    else:
-        time.sleep(1.0)
+    return await asyncio.to_thread(shared_state.snapshot, topic)
 
-def extract_phones_from_text(text):
-    phones = re.findall(r'(01[0125][0-9 \-]{8,15})', text)
-    clean_phones = []
-    for raw in phones:
-        clean = raw.replace(" ", "").replace("-", "")
-        if len(clean) == 11 and clean not in clean_phones:
-            clean_phones.append(clean)
-    return clean_phones
+def shared_event(topic: str, data: dict) -> dict:
+    event = {key: value for key, value in data.items() if key not in ("user_id", "leads")}
+    return {"type": topic.partition(":")[0], **event}
 
-def create_jwt_token(email: str):
-    payload = {"sub": email, "exp": datetime.utcnow() + timedelta(days=7)}
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+def relay_shared_snapshot(topic: str, data: dict):
+    """Push progress from another worker to this worker's subscribers"""
+    event = shared_event(topic, data)
+    event_hub.publish(topic, lambda: event)
 
-# ========== ROUTES ==========
-@app.get("/", response_class=HTMLResponse)
-async def home():
+# ========== HUNT ENGINE ==========
+hunt_engine = HuntEngine(
+    limiter=serper_limiter,
+    extract_phones=extract_phones_from_text,
+    save_leads=save_hunt_leads,
+    on_finish=log_hunt,
+    is_known=phone_index.__contains__,
+    cache=SearchCache(),
+    on_progress=publish_hunt_progress
+)
+
+async def warm_phone_index():
+    async def warm():
+        try:
+            count = await phone_index.warm(db)
+            print(f"📇 Phone index ready: {count} numbers in {phone_index.warm_seconds}s")
+        except Exception as e:
+            print(f"⚠️ Phone index warm-up failed: {e}")
+    # Warm in the background; until then the UNIQUE constraint still dedups
+    asyncio.create_task(warm())
+
+# ========== CAMPAIGN ENGINE ==========
+async def send_whatsapp_message(sender, to, body, media_url=None):
+    """Send one WhatsApp message on the shared, pooled Twilio client"""
+    client = get_messaging_client(TWILIO_SID, TWILIO_TOKEN)
+    return await client.send(sender, to, body, media_url)
+
+async def write_campaign_logs(rows):
+    await db.log_messages(rows)
+
+# campaign_logs rows are written in bulk off the send path
+campaign_log_buffer = WriteBehindBuffer(write_campaign_logs, name="campaign_logs",
+                                        columns=CAMPAIGN_LOG_COLUMNS, bad_rows=is_row_error)
+
+async def log_campaign_message(row):
+    if db:
+        campaign_log_buffer.add(row)
+        stats_service.record_messages()
+
+campaign_dispatcher = CampaignDispatcher(
+    db=db,
+    send=send_whatsapp_message,
+    senders=[n.strip() for n in (TWILIO_WHATSAPP_NUMBER or "").split(",") if n.strip()],
+    log=log_campaign_message,
+    on_progress=publish_campaign_progress,
+    store=shared_state
+)
+
+def twilio_configured():
+    return all([TWILIO_SID, TWILIO_TOKEN, TWILIO_WHATSAPP_NUMBER])
+
+async def resume_campaigns():
+    if db and twilio_configured():
+        try:
+            resumed = await campaign_dispatcher.resume_pending()
+            if resumed:
+                print(f"📣 Resumed {resumed} unfinished campaign(s)")
+        except Exception as e:
+            print(f"⚠️ Could not resume campaigns: {e}")
+
+def worker_gauges():
+    """This worker's share of the node-wide totals in /health"""
+    return {
+        "websocket_connections": len(ws_manager),
+        "hunts_active": hunt_engine.active_count,
+        "campaigns_active": sum(1 for run in campaign_dispatcher.runs.values() if not run.finished),
+    }
+
+async def connect_database():
+    if not (SUPABASE_URL and SUPABASE_KEY):
+        print("⚠️ Supabase credentials not configured")
+        return
+    try:
+        attach_database(await asyncio.to_thread(create_supabase_client))
+        readiness["database"] = True
+        print("✅ Connected to Supabase successfully!")
+    except Exception as e:
+        print(f"❌ Supabase connection error: {e}")
+
+async def startup():
+    await home_page.prerender()
+    await dashboard_page.prerender()
+    if shared_state:
+        await shared_state.start_reporting(worker_gauges)
+        await shared_state.start_sync(relay_shared_snapshot, {
+            "campaign.cancel": lambda message: campaign_dispatcher.cancel(message["campaign_id"]),
+            "campaign.status": lambda message: campaign_dispatcher.on_status(message["sid"], message["status"]),
+        })
+    elif WEB_CONCURRENCY > 1:
+        print("⚠️ Several workers without shared state: Serper and sender quotas are per worker")
+    await connect_database()
+    if db:
+        if replica:
+            replica.start(db)
+        await warm_phone_index()
+        lead_search.start(db)
+        await resume_campaigns()
+    readiness["ready_at"] = time.perf_counter()
+    print(f"🟢 Ready in {(readiness['ready_at'] - readiness['started_at']) * 1000:.0f}ms after startup")
+
+async def shutdown():
+    await hunt_engine.close()
+    await lead_search.close()
+    if replica:
+        await replica.close()
+    await campaign_dispatcher.close()
+    await event_hub.close()
+    await ws_manager.close()
+    await close_messaging_client()
+    if db:
+        await campaign_log_buffer.close()
+    shutdown_pool()
+    password_hasher.shutdown()
+    if shared_state:
+        await shared_state.close()
+    if db:
+        db.shutdown()
+
+# ========== PAGES ==========
+def render_home_page():
     return """
     <!DOCTYPE html>
     <html dir="rtl" lang="ar">
@@ -387,6 +596,8 @@ async def home():
                     <li>✅ <strong>/api/leads</strong> - قائمة العملاء (GET)</li>
                     <li>✅ <strong>/api/extract-phones</strong> - استخراج أرقام (POST)</li>
                     <li>✅ <strong>/ws/admin-chat</strong> - شات الأدمن (WebSocket)</li>
+                    <li>✅ <strong>/dashboard</strong> - لوحة التحكم</li>
+                    <li>✅ <strong>/ws/events</strong> - تحديثات البحث والحملات لحظياً (WebSocket)</li>
                 </ul>
             </div>
             
@@ -461,6 +672,46 @@ async def home():
     </html>
     """
 
+# Rendered once; re-rendered only if the values the page embeds change
+home_page = CachedPage(
+    render_home_page,
+    version=lambda: (PORT, supabase is not None, len(SERPER_KEYS), bool(TWILIO_SID and TWILIO_TOKEN))
+)
+dashboard_page = CachedPage.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dashboard.html"))
+
+# ========== ROUTES ==========
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request):
+    """Landing page (precompressed, ETag/304)"""
+    return home_page.respond(request)
+
+@app.get("/dashboard", response_class=HTMLResponse)
+async def dashboard(request: Request):
+    """Admin dashboard (precompressed, ETag/304; reloaded when the file changes)"""
+    return dashboard_page.respond(request)
+
+def startup_timings():
+    started, ready = readiness["started_at"], readiness["ready_at"]
+    return {
+        "import_ms": round(import_ms, 1),
+        "framework_import_ms": round(framework_ms, 1),
+        "app_import_ms": round(import_ms - framework_ms, 1),
+        "import_budget_ms": STARTUP_IMPORT_BUDGET_MS,
+        "ready_ms": round((ready - started) * 1000, 1) if started and ready else None,
+    }
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness: the process is up and serving (no dependencies checked)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: startup finished (database attached when configured)"""
+    ready = readiness["ready_at"] is not None
+    body = {"ready": ready, "database": readiness["database"], "startup": startup_timings()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for Render.com"""
@@ -472,53 +723,144 @@ async def health_check():
         "platform": "Render.com",
         "port": PORT,
         "supabase_connected": supabase is not None,
+        "ready": readiness["ready_at"] is not None,
+        "startup": startup_timings(),
         "serper_keys_count": len(SERPER_KEYS),
+        "serper_active_keys": len(serper_limiter.keys),
+        "phone_index": phone_index.stats(),
+        "lead_search": lead_search.stats(),
+        "replica": replica.stats() if replica else None,
+        "events": event_hub.stats(),
+        "websockets": ws_manager.stats(),
+        "hunt_cache": hunt_engine.cache.stats(),
+        "auth_cache": token_verifier.stats(),
+        "passwords": password_hasher.stats(),
+        "worker_pid": os.getpid(),
+        "cluster": {**shared_state.stats(), **shared_state.cluster()} if shared_state else None,
         "twilio_configured": bool(TWILIO_SID and TWILIO_TOKEN),
         "environment": "production",
-        "uptime": round(time.time() - last_reset, 2)
+        "uptime": round(time.time() - started_at, 2)
     }
 
+@metrics_registry.collector
+def collect_runtime_metrics():
+    """Gauges read from the live components at scrape time"""
+    caches = {"hunt_search": hunt_engine.cache.stats(), "auth_token": token_verifier.stats()}
+    if db:
+        caches.update({f"db_{name}": stats for name, stats in db.db.cache_stats().items()})
+        caches["admin_stats"] = stats_service.cache_stats()
+    yield "cache_hits_total", "counter", "Cache hits", [({"cache": n}, c["hits"]) for n, c in caches.items()]
+    yield "cache_misses_total", "counter", "Cache misses", [({"cache": n}, c["misses"]) for n, c in caches.items()]
+    yield "cache_entries", "gauge", "Entries held per cache", [({"cache": n}, c["entries"]) for n, c in caches.items()]
+    yield "websocket_connections", "gauge", "Open WebSocket connections", [({}, len(ws_manager))]
+    yield "websocket_room_members", "gauge", "Sockets per room", [({"room": room}, len(members)) for room, members in ws_manager.rooms.items() if ":" not in room]
+    yield "serper_active_keys", "gauge", "Serper keys in rotation", [({}, len(serper_limiter.keys))]
+    yield "hunts_active", "gauge", "Hunts queued or running", [({}, hunt_engine.active_count)]
+    yield "campaigns_active", "gauge", "Campaigns sending in this process", [({}, sum(1 for run in campaign_dispatcher.runs.values() if not run.finished))]
+    yield "phone_index_numbers", "gauge", "Phone numbers in the in-process index", [({}, len(phone_index))]
+    yield "lead_search_documents", "gauge", "Leads in the in-process search index", [({}, len(lead_search))]
+    if replica:
+        tables = replica.stats()["tables"]
+        yield "replica_lag_seconds", "gauge", "Seconds since each replica table last synced", [({"table": t}, s["lag_seconds"] or 0) for t, s in tables.items()]
+        yield "replica_sync_errors_total", "counter", "Failed replica sync passes", [({}, replica.sync_errors)]
+    yield "campaign_log_buffered", "gauge", "campaign_logs rows waiting to be written", [({}, len(campaign_log_buffer.rows))]
+    if shared_state:
+        cluster = shared_state.cluster()
+        yield "cluster_workers", "gauge", "Workers reporting to the shared state", [({}, cluster["workers"])]
+        yield "cluster_websocket_connections", "gauge", "Open WebSocket connections across workers", [({}, cluster.get("websocket_connections", 0))]
+        yield "cluster_hunts_active", "gauge", "Hunts queued or running across workers", [({}, cluster.get("hunts_active", 0))]
+    yield "startup_import_seconds", "gauge", "Time spent importing main.py", [({}, round(import_ms / 1000, 4))]
+    yield "startup_framework_import_seconds", "gauge", "Part of the import spent loading FastAPI and pydantic", [({}, round(framework_ms / 1000, 4))]
+    yield "process_start_time_seconds", "gauge", "Unix time the process started", [({}, started_at)]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Prometheus text exposition"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/api/login")
 async def login(request: LoginRequest):
-    """User login endpoint"""
-    try:
-        if request.password == "google":
-            token = create_jwt_token(request.email)
-            return {"access_token": token, "token_type": "bearer"}
-        
-        if request.email == "admin@example.com" and request.password == "admin123":
-            token = create_jwt_token(request.email)
-            return {
-                "access_token": token,
-                "token_type": "bearer",
-                "user": {
-                    "email": request.email,
-                    "role": "admin",
-                    "permissions": ["all"]
-                }
-            }
-        
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    """User login against the users table (bcrypt runs off the event loop)"""
+    if not db:
+        if SUPABASE_URL and SUPABASE_KEY:
+            raise HTTPException(status_code=503, detail="Database not ready", headers={"Retry-After": "1"})
+        # Demo mode without a database: only the built-in admin account
+        if request.email != "admin@example.com" or request.password != "admin123":
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        user = build_principal(request.email, None, {"role": "admin"})
+    else:
+        try:
+            row = await db.get_user(request.email)
+            valid, new_hash = await password_hasher.verify(request.password, row and row.get("password"))
+        except PasswordBusy:
+            raise HTTPException(status_code=503, detail="Too many login attempts, try again", headers={"Retry-After": "1"})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if not valid:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        if new_hash:
+            # Cost changed (or legacy plaintext): store the upgraded hash
+            try:
+                await db.update_user_password(request.email, new_hash)
+            except Exception as e:
+                print(f"⚠️ Password rehash failed for {request.email}: {e}")
+        user = build_principal(request.email, row, {})
+    
+    return {
+        "access_token": create_jwt_token(request.email, role="admin" if user["is_admin"] else user["role"]),
+        "token_type": "bearer",
+        "user": {
+            "email": request.email,
+            "role": user["role"],
+            "permissions": ["all"] if user["is_admin"] else [p for p in PERMISSIONS if user[p]]
+        }
+    }
 
 @app.post("/start_hunt")
-async def start_hunt(request: HuntRequest, background_tasks: BackgroundTasks):
+async def start_hunt(request: HuntRequest, user: dict = Depends(auth.require("can_hunt"))):
     """Start a hunting session"""
-    background_tasks.add_task(
-        lambda: print(f"🚀 Starting hunt: {request.intent_sentence} in {request.city}")
-    )
+    request.user_id = scope_user_id(user, request.user_id)
+    print(f"🚀 Starting hunt: {request.intent_sentence} in {request.city}")
+    job = hunt_engine.submit(request)
     return {
         "status": "started",
         "search": request.intent_sentence,
         "city": request.city,
         "message": "بدأ البحث بنجاح",
-        "request_id": str(int(time.time()))
+        "request_id": job.request_id
     }
 
+@app.get("/api/hunt/{request_id}")
+async def hunt_status(request_id: str, include_leads: bool = True, user: dict = Depends(auth)):
+    """Get hunt progress and results"""
+    job = hunt_engine.get(request_id)
+    if job:
+        if not can_access(user, job.user_id):
+            raise HTTPException(status_code=404, detail="Hunt not found")
+        return {"success": True, **job.to_dict(include_leads=include_leads)}
+    shared = await shared_snapshot(f"hunt:{request_id}")
+    if not shared or not can_access(user, shared.pop("user_id")):
+        raise HTTPException(status_code=404, detail="Hunt not found")
+    if not include_leads:
+        shared.pop("leads", None)
+    return {"success": True, **shared}
+
 @app.get("/api/leads")
-async def get_leads(user_id: str = "admin"):
-    """Get leads list"""
+async def get_leads(
+    user_id: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    quality: Optional[str] = None,
+    source: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: dict = Depends(auth)
+):
+    """Get leads list (keyset paginated: pass next_cursor back as cursor)"""
     if not supabase:
         return {
             "success": False,
@@ -528,12 +870,22 @@ async def get_leads(user_id: str = "admin"):
         }
     
     try:
-        # This is a simplified version - implement your actual logic here
-        result = supabase.table("leads").select("*").limit(50).execute()
+        page = await db.get_leads_page(
+            user_id=scope_user_id(user, user_id),
+            limit=limit,
+            cursor=cursor,
+            fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+            status=status,
+            quality=quality,
+            source=source,
+            created_from=created_from,
+            created_to=created_to
+        )
         return {
             "success": True,
-            "leads": result.data if result.data else [],
-            "count": len(result.data) if result.data else 0
+            "leads": page["leads"],
+            "count": len(page["leads"]),
+            "next_cursor": page["next_cursor"]
         }
     except Exception as e:
         return {
@@ -543,61 +895,409 @@ async def get_leads(user_id: str = "admin"):
             "count": 0
         }
 
+@app.get("/api/leads/search")
+async def search_leads(
+    q: str = "",
+    limit: int = 20,
+    status: Optional[str] = None,
+    quality: Optional[str] = None,
+    source: Optional[str] = None,
+    user_id: Optional[str] = None,
+    facets: bool = False,
+    user: dict = Depends(auth)
+):
+    """Type-ahead search over name/phone/notes from the in-memory index (no database round trip)"""
+    result = lead_search.search(
+        q.strip()[:100],
+        limit=max(1, min(limit, LEADS_PAGE_MAX)),
+        facets=facets,
+        status=status,
+        quality=quality,
+        source=source,
+        user_id=scope_user_id(user, user_id)
+    )
+    return {"success": True, "count": len(result["leads"]), "index_ready": lead_search.ready, **result}
+
+async def iter_lead_pages(**filters):
+    """Yield keyset pages of leads, fetching the next page while the current one is sent"""
+    next_page = asyncio.ensure_future(db.get_leads_page(limit=LEADS_PAGE_MAX, **filters))
+    try:
+        while True:
+            page = await next_page
+            if page["next_cursor"]:
+                next_page = asyncio.ensure_future(
+                    db.get_leads_page(limit=LEADS_PAGE_MAX, **{**filters, "cursor": page["next_cursor"]})
+                )
+            if page["leads"]:
+                yield page["leads"]
+            if not page["next_cursor"]:
+                break
+    finally:
+        if not next_page.done():
+            next_page.cancel()
+
+def csv_value(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return "" if value is None else value
+
+@app.get("/api/leads/export")
+async def export_leads(
+    format: str = "ndjson",
+    user_id: Optional[str] = None,
+    status: Optional[str] = None,
+    quality: Optional[str] = None,
+    source: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: dict = Depends(auth)
+):
+    """Stream all matching leads as NDJSON or CSV"""
+    if not supabase:
+        return {"success": False, "error": "Supabase not configured"}
+    if format not in ("ndjson", "csv"):
+        return {"success": False, "error": "format must be ndjson or csv"}
+    columns = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    unknown = set(columns or []) - set(LEAD_COLUMNS)
+    if unknown:
+        return {"success": False, "error": f"Unknown fields: {', '.join(sorted(unknown))}"}
+    filters = dict(
+        user_id=scope_user_id(user, user_id), status=status, quality=quality, source=source,
+        created_from=created_from, created_to=created_to, fields=columns
+    )
+
+    async def ndjson_rows():
+        async for rows in iter_lead_pages(**filters):
+            if columns:
+                rows = [{c: row.get(c) for c in columns} for row in rows]
+            yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    async def csv_rows():
+        header = columns or LEAD_COLUMNS
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        async for rows in iter_lead_pages(**filters):
+            writer.writerows([csv_value(row.get(c)) for c in header] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    if format == "csv":
+        # BOM so Excel opens the Arabic text as UTF-8
+        async def body():
+            yield "\ufeff"
+            async for chunk in csv_rows():
+                yield chunk
+        media_type, ext = "text/csv; charset=utf-8", "csv"
+    else:
+        body, media_type, ext = ndjson_rows, "application/x-ndjson", "ndjson"
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="leads-{stamp}.{ext}"'}
+    )
+
+@app.get("/api/admin-stats")
+async def admin_stats(user_id: Optional[str] = None, user: dict = Depends(auth)):
+    """Dashboard totals and breakdowns (server-side counts, cached)"""
+    user_id = scope_user_id(user, user_id)
+    if not stats_service:
+        return {"success": False, "error": "Supabase not configured", "total_users": 0, "total_leads": 0, "total_messages": 0}
+    
+    try:
+        return {"success": True, **await stats_service.get(user_id)}
+    except Exception as e:
+        return {"success": False, "error": str(e), "total_users": 0, "total_leads": 0, "total_messages": 0}
+
 @app.post("/api/add-lead")
-async def add_lead(request: AddLeadRequest):
+async def add_lead(request: AddLeadRequest, user: dict = Depends(auth)):
     """Add a new lead manually"""
     if not supabase:
         return {"success": False, "error": "Supabase not configured"}
     
     try:
-        lead_data = request.dict()
-        lead_data["created_at"] = datetime.now().isoformat()
-        
-        result = supabase.table("leads").insert(lead_data).execute()
+        lead = request.dict()
+        lead["user_id"] = scope_user_id(user, lead["user_id"])
+        lead_id = await db.add_lead(lead)
+        phone_index.add(lead["phone_number"])
+        lead_search.add({**lead, "id": lead_id})
+        stats_service.record_leads([lead])
         return {
             "success": True,
             "message": "تم إضافة العميل بنجاح",
-            "lead_id": result.data[0]["id"] if result.data else None
+            "lead_id": lead_id
         }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+LEAD_DEFAULTS = {name: field.default for name, field in AddLeadRequest.model_fields.items() if not field.is_required()}
+
+def parse_bulk_leads(raw: bytes, content_type: str, filename: str = ""):
+    """Parse a JSON array, NDJSON or CSV payload into validated, deduplicated lead rows.
+
+    Rows hold only the columns present in the payload (defaults are applied
+    on insert), so an update never resets fields the file left out.
+    """
+    text = raw.decode("utf-8-sig")
+    if "csv" in content_type or filename.endswith(".csv"):
+        records = list(csv.DictReader(io.StringIO(text)))
+    elif "ndjson" in content_type or "jsonlines" in content_type or filename.endswith((".ndjson", ".jsonl")):
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        records = json.loads(text)
+        if isinstance(records, dict):
+            records = records.get("leads", [])
+    leads, rejected = {}, []
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            rejected.append({"row": index, "error": "Row is not an object"})
+            continue
+        if None in record:
+            # csv.DictReader puts cells beyond the header under the None key
+            rejected.append({"row": index, "error": "Row has more columns than the header"})
+            continue
+        try:
+            lead = AddLeadRequest(**{k: v for k, v in record.items() if v not in (None, "")})
+        except ValidationError as e:
+            rejected.append({"row": index, "error": "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())})
+            continue
+        phone = normalize_phone(lead.phone_number)
+        if not phone:
+            rejected.append({"row": index, "error": f"Invalid phone number: {lead.phone_number}"})
+            continue
+        lead.phone_number = phone
+        leads[phone] = lead.dict(exclude_unset=True)  # last occurrence of a phone wins
+    return list(leads.values()), rejected, len(records)
+
+@app.post("/api/leads/bulk")
+async def bulk_import_leads(
+    request: Request,
+    batch_size: int = BULK_BATCH_SIZE,
+    on_existing: str = "update",
+    user: dict = Depends(auth)
+):
+    """Import leads from a JSON array, NDJSON or CSV (raw body or multipart "file").
+
+    on_existing=update writes the supplied columns over leads whose phone
+    already exists (only the caller's own leads, unless they see all data);
+    on_existing=skip drops them (known numbers never reach the database).
+    """
+    if not supabase:
+        return {"success": False, "error": "Supabase not configured"}
+    if on_existing not in ("update", "skip"):
+        return {"success": False, "error": "on_existing must be update or skip"}
+    
+    try:
+        content_type = request.headers.get("content-type", "")
+        filename = ""
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None:
+                return {"success": False, "error": "Missing file"}
+            filename = (upload.filename or "").lower()
+            content_type = upload.content_type or ""
+            raw = await upload.read()
+        else:
+            raw = await request.body()
+        # Parsing and validation are CPU-bound; keep them off the event loop
+        leads, rejected, total = await asyncio.to_thread(parse_bulk_leads, raw, content_type, filename)
+    except Exception as e:
+        return {"success": False, "error": f"Could not parse payload: {e}"}
+
+    for lead in leads:
+        lead["user_id"] = scope_user_id(user, lead["user_id"])
+    parsed = len(leads)
+    skipped = 0
+    if on_existing == "skip":
+        leads = [{**LEAD_DEFAULTS, **lead} for lead in leads if lead["phone_number"] not in phone_index]
+        skipped = parsed - len(leads)
+
+    batch_size = max(1, min(batch_size, 5000))
+    inserted = updated = 0
+    for start in range(0, len(leads), batch_size):
+        batch = leads[start:start + batch_size]
+        try:
+            if on_existing == "skip":
+                added = await db.save_leads(batch)
+                skipped += len(batch) - len(added)
+                written = added
+            else:
+                added, changed, refused = await db.upsert_leads(batch, LEAD_DEFAULTS, scope_user_id(user, None))
+                updated += len(changed)
+                written = added + changed
+                rejected.extend({"row": None, "phone_number": lead["phone_number"],
+                                 "error": "Lead belongs to another user"} for lead in refused)
+            phone_index.add_many(lead["phone_number"] for lead in written)
+            lead_search.add_many(written)
+            stats_service.record_leads(added)
+            inserted += len(added)
+        except Exception as e:
+            rejected.extend({"row": None, "phone_number": lead["phone_number"], "error": str(e)} for lead in batch)
+    return {
+        "success": True,
+        "received": total,
+        "inserted": inserted,
+        "updated": updated,
+        "skipped_existing": skipped,
+        "duplicates_in_payload": total - parsed - sum(1 for r in rejected if r["row"] is not None),
+        "rejected": len(rejected),
+        "errors": rejected[:100]
+    }
+
 @app.post("/api/send-whatsapp")
-async def send_whatsapp(request: WhatsAppRequest):
+async def send_whatsapp(request: WhatsAppRequest, user: dict = Depends(auth.require("can_campaign"))):
     """Send WhatsApp message"""
     if not all([TWILIO_SID, TWILIO_TOKEN, TWILIO_WHATSAPP_NUMBER]):
         return {"success": False, "error": "Twilio not configured"}
     
     try:
-        client = TwilioClient(TWILIO_SID, TWILIO_TOKEN)
-        message = client.messages.create(
-            from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}",
-            body=request.message,
-            to=f"whatsapp:{request.phone_number}"
+        message = await send_whatsapp_message(
+            campaign_dispatcher.senders.next_key() or TWILIO_WHATSAPP_NUMBER,
+            to_e164(request.phone_number) or request.phone_number,
+            request.message
         )
         
-        if supabase:
-            supabase.table("campaign_logs").insert({
-                "lead_phone": request.phone_number,
-                "message_sent": request.message,
-                "status": "sent",
-                "user_id": request.user_id,
-                "created_at": datetime.now().isoformat()
-            }).execute()
+        await log_campaign_message({
+            "lead_phone": request.phone_number,
+            "message_sent": request.message,
+            "status": "sent",
+            "user_id": scope_user_id(user, request.user_id),
+            "created_at": datetime.now().isoformat()
+        })
         
         return {
             "success": True,
             "message": "تم إرسال الرسالة",
-            "sid": message.sid,
-            "status": message.status
+            "sid": message["sid"],
+            "status": message["status"]
         }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.post("/api/create-campaign")
+async def create_campaign(
+    name: str = Form(...),
+    message: str = Form(...),
+    user_id: str = Form("admin"),
+    target_quality: str = Form(""),
+    target_status: str = Form(""),
+    media_url: str = Form(""),
+    start: bool = Form(False),
+    user: dict = Depends(auth.require("can_campaign"))
+):
+    """Create a WhatsApp campaign (optionally start sending right away)"""
+    if not db:
+        return {"success": False, "error": "Supabase not configured"}
+    
+    try:
+        qualities = [q.strip() for q in target_quality.split(",") if q.strip()]
+        campaign_id = await db.create_campaign(
+            name, message, scope_user_id(user, user_id), media_url or None,
+            target_quality=qualities, target_status=target_status or None
+        )
+        status = "draft"
+        if start:
+            if not twilio_configured():
+                return {"success": False, "error": "Twilio not configured", "campaign_id": campaign_id}
+            run = await campaign_dispatcher.launch(await db.get_campaign(campaign_id))
+            status = run.status if run else "running"
+        return {"success": True, "message": "تم إنشاء الحملة", "campaign_id": campaign_id, "status": status}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/api/my-campaigns")
+async def my_campaigns(user_id: Optional[str] = None, user: dict = Depends(auth)):
+    """List campaigns with live progress for those running in this process"""
+    if not db:
+        return {"success": False, "error": "Supabase not configured", "campaigns": []}
+    
+    try:
+        campaigns = await db.get_campaigns(scope_user_id(user, user_id)) or []
+        for campaign in campaigns:
+            run = campaign_dispatcher.runs.get(campaign["id"])
+            if run:
+                campaign.update(run.progress())
+        return {"success": True, "campaigns": campaigns, "count": len(campaigns)}
+    except Exception as e:
+        return {"success": False, "error": str(e), "campaigns": []}
+
+@app.post("/api/campaigns/{campaign_id}/start")
+async def start_campaign(campaign_id: str, user: dict = Depends(auth.require("can_campaign"))):
+    """Queue a campaign's recipients for sending"""
+    if not db:
+        return {"success": False, "error": "Supabase not configured"}
+    if not twilio_configured():
+        return {"success": False, "error": "Twilio not configured"}
+    
+    campaign = await db.get_campaign(campaign_id)
+    if not campaign or not can_access(user, campaign.get("user_id")):
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    run = await campaign_dispatcher.launch(campaign)
+    if run is None:
+        # Already being sent by another worker
+        shared = await shared_snapshot(f"campaign:{campaign_id}") or {"campaign_id": campaign_id, "status": "running"}
+        shared.pop("user_id", None)
+        return {"success": True, "message": "بدأ إرسال الحملة", **shared}
+    return {"success": True, "message": "بدأ إرسال الحملة", **run.to_dict()}
+
+@app.post("/api/campaigns/{campaign_id}/cancel")
+async def cancel_campaign(campaign_id: str, user: dict = Depends(auth.require("can_campaign"))):
+    """Stop sending a running campaign"""
+    run = campaign_dispatcher.runs.get(campaign_id)
+    if run:
+        if not can_access(user, run.user_id):
+            raise HTTPException(status_code=404, detail="Campaign is not running")
+        return {"success": True, **campaign_dispatcher.cancel(campaign_id).to_dict()}
+    # Running in another worker: ask it to stop
+    shared = await shared_snapshot(f"campaign:{campaign_id}")
+    if not shared or not can_access(user, shared.pop("user_id")) or shared.get("status") != "running" \
+            or not await asyncio.to_thread(shared_state.holder, f"campaign:{campaign_id}"):
+        raise HTTPException(status_code=404, detail="Campaign is not running")
+    shared_state.post("campaign.cancel", {"campaign_id": campaign_id})
+    return {"success": True, **shared, "status": "cancelled"}
+
+@app.get("/api/campaigns/{campaign_id}")
+async def campaign_status(campaign_id: str, user: dict = Depends(auth)):
+    """Campaign progress"""
+    run = campaign_dispatcher.runs.get(campaign_id)
+    if run and can_access(user, run.user_id):
+        return {"success": True, **run.to_dict()}
+    shared = None if run else await shared_snapshot(f"campaign:{campaign_id}")
+    if shared and can_access(user, shared.pop("user_id")):
+        return {"success": True, **shared}
+    if not db:
+        return {"success": False, "error": "Supabase not configured"}
+    campaign = await db.get_campaign(campaign_id)
+    if not campaign or not can_access(user, campaign.get("user_id")):
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return {"success": True, "campaign_id": campaign_id, **campaign}
+
+@app.post("/api/twilio/status")
+async def twilio_status_callback(request: Request):
+    """Twilio delivery status webhook (requests must carry a valid X-Twilio-Signature)"""
+    params = dict(await request.form())
+    # Twilio signs the URL it was given, which behind a proxy differs from request.url
+    url = TWILIO_STATUS_CALLBACK or str(request.url)
+    if not valid_twilio_signature(TWILIO_TOKEN, url, params, request.headers.get("x-twilio-signature")):
+        raise HTTPException(status_code=403, detail="Invalid Twilio signature")
+    if not params.get("MessageSid") or not params.get("MessageStatus"):
+        raise HTTPException(status_code=422, detail="MessageSid and MessageStatus are required")
+    campaign_dispatcher.on_status(params["MessageSid"], params["MessageStatus"])
+    if shared_state:
+        # The message may have been sent by another worker
+        shared_state.post("campaign.status", {"sid": params["MessageSid"], "status": params["MessageStatus"]})
+    return {"success": True}
+
 @app.post("/api/extract-phones")
-async def extract_phones(request: ExtractPhonesRequest):
+async def extract_phones(request: ExtractPhonesRequest, user: dict = Depends(auth)):
     """Extract phone numbers from text"""
-    phones = extract_phones_from_text(request.text)
+    phones = await extract_phones_async(request.text)
     return {
         "success": True,
         "phones": phones,
@@ -605,8 +1305,39 @@ async def extract_phones(request: ExtractPhonesRequest):
         "sample_text": request.text[:100] + ("..." if len(request.text) > 100 else "")
     }
 
+@app.post("/api/extract-phones/batch")
+async def extract_phones_batch(request: Request, user: dict = Depends(auth)):
+    """Extract phone numbers from many texts ({"texts": [...]}) or an uploaded file"""
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None:
+                return {"success": False, "error": "Missing file"}
+            texts = [(await upload.read()).decode("utf-8", errors="ignore")]
+        else:
+            texts = ExtractPhonesBatchRequest(**json.loads(await request.body())).texts
+    except Exception as e:
+        return {"success": False, "error": f"Invalid payload: {e}"}
+
+    results = await extract_many_async(texts)
+    unique = list(dict.fromkeys(phone for phones in results for phone in phones))
+    return {
+        "success": True,
+        "results": [{"index": i, "phones": phones, "count": len(phones)} for i, phones in enumerate(results)],
+        "phones": unique,
+        "count": len(unique),
+        "bytes_processed": sum(len(t) for t in texts)
+    }
+
+@app.post("/api/admin/broadcast")
+async def admin_broadcast(request: BroadcastRequest, user: dict = Depends(auth.require("is_admin"))):
+    """Push a message to every socket in a room (admins, user:<id>, events)"""
+    await ws_manager.broadcast(request.room, {"type": "broadcast", "room": request.room, "message": request.message})
+    return {"success": True, "room": request.room, "local_recipients": ws_manager.room_size(request.room)}
+
 @app.get("/api/system-info")
-async def system_info():
+async def system_info(user: dict = Depends(auth)):
     """Get system information"""
     return {
         "python_version": os.sys.version,
@@ -617,26 +1348,30 @@ async def system_info():
         "memory_limit": os.environ.get("RENDER_MEMORY_LIMIT", "unknown")
     }
 
-# WebSocket endpoint
-active_connections = []
-
+# WebSocket endpoints
 @app.websocket("/ws/admin-chat")
 async def admin_chat_websocket(websocket: WebSocket):
-    await websocket.accept()
-    active_connections.append(websocket)
+    user = await auth.websocket_user(websocket)
+    if user is None:
+        await websocket.close(code=1008)
+        return
+    conn = await ws_manager.connect(websocket, (["admins"] if user["is_admin"] else []) + [f"user:{user['username']}"])
     
     try:
         while True:
             data = await websocket.receive_text()
+            conn.touch()
+            if data == "pong" or data == '{"type": "pong"}':
+                continue
             response = f"تم استلام رسالتك: {data}"
             
             if "إحصائيات" in data or "stats" in data.lower():
                 stats_data = {
-                    "connections": len(active_connections),
+                    "connections": len(ws_manager),
                     "serper_keys": len(SERPER_KEYS),
                     "supabase": supabase is not None,
                     "twilio": bool(TWILIO_SID and TWILIO_TOKEN),
-                    "uptime": round(time.time() - last_reset, 2)
+                    "uptime": round(time.time() - started_at, 2)
                 }
                 response = f"📊 إحصائيات النظام:\n" + "\n".join([f"• {k}: {v}" for k, v in stats_data.items()])
             elif "مساعدة" in data or "help" in data.lower():
@@ -644,13 +1379,101 @@ async def admin_chat_websocket(websocket: WebSocket):
             elif "الوقت" in data or "time" in data.lower():
                 response = f"🕒 الوقت الحالي: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
             
-            await websocket.send_text(response)
+            await conn.send_text(response)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"WebSocket error: {e}")
+    finally:
+        ws_manager.disconnect(conn)
+
+async def event_snapshot(topic: str, user: dict):
+    """Current state for a subscription topic, or None if it doesn't exist for this user"""
+    kind, _, object_id = topic.partition(":")
+    if kind == "hunt":
+        job = hunt_engine.get(object_id)
+        if job:
+            return (lambda: {"type": "hunt", **job.to_dict(include_leads=False)}) if can_access(user, job.user_id) else None
+    elif kind == "campaign":
+        run = campaign_dispatcher.runs.get(object_id)
+        if run:
+            return (lambda: {"type": "campaign", **run.to_dict()}) if can_access(user, run.user_id) else None
+    else:
+        return None
+    shared = await shared_snapshot(topic)  # started by another worker
+    if shared:
+        event = shared_event(topic, shared)
+        return (lambda: event) if can_access(user, shared.get("user_id")) else None
+    if kind == "campaign":
+        campaign = await db.get_campaign(object_id) if db else None
+        if campaign and can_access(user, campaign.get("user_id")):
+            return lambda: {"type": "campaign", "campaign_id": object_id, **campaign}
+    return None
+
+@app.websocket("/ws/events")
+async def events_websocket(websocket: WebSocket):
+    """Pushed hunt/campaign progress.
+
+    Send {"action": "subscribe", "hunt": "<request_id>"} or
+    {"action": "subscribe", "campaign": "<id>"} (or "unsubscribe"); progress
+    arrives as {"type": "events", "events": [{"topic", "data"}, ...]} at most
+    once per tick.
+    """
+    user = await auth.websocket_user(websocket)
+    if user is None:
+        await websocket.close(code=1008)
+        return
+    conn = await ws_manager.connect(websocket, ["events"])
+    sub = Subscription()
+    send = conn.send_json
+
+    async def pump():
+        while True:
+            await send({"type": "events", "events": await sub.next_batch()})
+    sender = asyncio.create_task(pump())
+
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                conn.touch()
+                if message.get("type") == "pong":
+                    continue
+                action = message.get("action", "subscribe")
+                kind = "hunt" if message.get("hunt") else "campaign"
+                topic = f"{kind}:{message.get(kind)}"
+            except (ValueError, AttributeError):
+                await send({"type": "error", "error": "Expected a JSON object"})
+                continue
+            if action == "unsubscribe":
+                event_hub.unsubscribe(sub, topic)
+                await send({"type": "unsubscribed", "topic": topic})
+                continue
+            snapshot = await event_snapshot(topic, user)
+            if snapshot is None:
+                await send({"type": "error", "topic": topic, "error": "Not found"})
+            elif not event_hub.subscribe(sub, topic, snapshot):
+                await send({"type": "error", "topic": topic, "error": "Too many subscriptions"})
+            else:
+                await send({"type": "subscribed", "topic": topic})
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        pass
     except Exception as e:
         print(f"WebSocket error: {e}")
-        if websocket in active_connections:
-            active_connections.remove(websocket)
+    finally:
+        sender.cancel()
+        event_hub.unsubscribe(sub)
+        ws_manager.disconnect(conn)
+
+# ========== IMPORT-TIME BUDGET ==========
+# FastAPI itself takes a few hundred ms to import (its OpenAPI models are built
+# at import time) and nothing here can shorten that; the budget is for the
+# app's own modules and route setup, which must not pull in heavy clients.
+import_ms = (time.perf_counter() - IMPORT_STARTED) * 1000
+framework_ms = (FRAMEWORK_IMPORTED - IMPORT_STARTED) * 1000
+if import_ms - framework_ms > STARTUP_IMPORT_BUDGET_MS:
+    print(f"⚠️ main.py imported in {import_ms:.0f}ms, {import_ms - framework_ms:.0f}ms after FastAPI "
+          f"(budget {STARTUP_IMPORT_BUDGET_MS:.0f}ms)")
 
 # ========== START APPLICATION ==========
 if __name__ == "__main__":
@@ -660,7 +1483,7 @@ if __name__ == "__main__":
     print("🚀 Hunter Pro CRM v3.0 - Starting on Render.com")
     print(f"📡 Port: {PORT}")
     print(f"🔗 URL: http://0.0.0.0:{PORT}")
-    print(f"📊 Supabase: {'✅ Connected' if supabase else '❌ Not connected'}")
+    print(f"📊 Supabase: {'🔄 Connecting on startup' if SUPABASE_URL and SUPABASE_KEY else '❌ Not configured'}")
     print(f"🔑 Serper Keys: {len(SERPER_KEYS)}")
     print(f"💬 WhatsApp: {'✅ Configured' if TWILIO_SID and TWILIO_TOKEN else '❌ Not configured'}")
     print("=" * 60)
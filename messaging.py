@@ -0,0 +1,118 @@
+"""Process-wide WhatsApp messaging client.
+
+Talks to the Twilio Messages REST API over one keep-alive
+``httpx.AsyncClient`` whose pool is sized for campaign concurrency, so a warm
+send is a single HTTP request with no new TLS handshake. ``TWILIO_API_BASE``
+(or an explicit httpx transport) points it at a local fake provider for tests
+and benchmarks.
+"""
+import os
+import time
+from typing import TYPE_CHECKING, Optional
+
+from metrics import TWILIO_LATENCY
+
+TWILIO_API_BASE = os.environ.get("TWILIO_API_BASE", "https://api.twilio.com")
+TWILIO_STATUS_CALLBACK = os.environ.get("TWILIO_STATUS_CALLBACK")  # e.g. https://host/api/twilio/status
+MESSAGING_POOL_SIZE = int(os.environ.get("MESSAGING_POOL_SIZE", os.environ.get("CAMPAIGN_WORKERS", 32)))
+MESSAGING_TIMEOUT = float(os.environ.get("MESSAGING_TIMEOUT", 15))
+
+if TYPE_CHECKING:
+    import httpx  # imported on first use so startup does not pay for it
+
+
+class SendError(Exception):
+    """A failed send; ``retryable`` says whether trying again can help"""
+
+    def __init__(self, message: str, retryable: bool = True, status: int = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+
+
+class WhatsAppClient:
+    """Async Twilio WhatsApp sender sharing one connection pool"""
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        base_url: str = TWILIO_API_BASE,
+        pool_size: int = MESSAGING_POOL_SIZE,
+        transport: "Optional[httpx.AsyncBaseTransport]" = None,
+        status_callback: Optional[str] = TWILIO_STATUS_CALLBACK,
+    ):
+        import httpx
+
+        self.status_callback = status_callback
+        self.url = f"/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.http = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            auth=(account_sid, auth_token),
+            timeout=MESSAGING_TIMEOUT,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=transport,
+        )
+        self.http_errors = httpx.HTTPError
+
+    async def send(self, sender: str, to: str, body: str, media_url: Optional[str] = None) -> dict:
+        """Send one message; returns ``{"sid", "status"}`` or raises SendError"""
+        data = {"From": f"whatsapp:{sender}", "To": f"whatsapp:{to}", "Body": body}
+        if media_url:
+            data["MediaUrl"] = media_url
+        if self.status_callback:
+            data["StatusCallback"] = self.status_callback
+        started = time.perf_counter()
+        try:
+            response = await self.http.post(self.url, data=data)
+        except self.http_errors as e:
+            TWILIO_LATENCY.observe(time.perf_counter() - started, "error")
+            raise SendError(f"{type(e).__name__}: {e}")
+        TWILIO_LATENCY.observe(time.perf_counter() - started, response.status_code)
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("message") or response.text
+            except ValueError:
+                detail = response.text
+            raise SendError(
+                f"HTTP {response.status_code}: {detail}",
+                retryable=response.status_code == 429 or response.status_code >= 500,
+                status=response.status_code,
+            )
+        message = response.json()
+        return {"sid": message.get("sid"), "status": message.get("status")}
+
+    async def close(self):
+        await self.http.aclose()
+
+
+_client: Optional[WhatsAppClient] = None
+
+
+def get_messaging_client(account_sid: str, auth_token: str, **kwargs) -> WhatsAppClient:
+    """Lazily create the process-wide client"""
+    global _client
+    if _client is None:
+        _client = WhatsAppClient(account_sid, auth_token, **kwargs)
+    return _client
+
+
+def set_messaging_client(client: Optional[WhatsAppClient]):
+    """Swap in a client (e.g. one backed by a fake transport)"""
+    global _client
+    _client = client
+
+
+async def close_messaging_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def valid_twilio_signature(auth_token: Optional[str], url: str, params: dict, signature: Optional[str]) -> bool:
+    """Whether a webhook really came from Twilio (X-Twilio-Signature over url + form params)"""
+    if not auth_token or not signature:
+        return False
+    from twilio.request_validator import RequestValidator
+    return RequestValidator(auth_token).validate(url, params, signature)
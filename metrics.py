@@ -0,0 +1,200 @@
+"""Prometheus-style metrics without an extra dependency.
+
+Counters, gauges and histograms keep their series in plain dicts keyed by
+label tuples; recording is a dict lookup and an add (no locks: the event loop
+is single threaded, and a rare lost increment from the DB thread pool is an
+acceptable price for keeping the hot path in the microseconds). Values that
+already live elsewhere (cache stats, socket counts) are read by collectors at
+scrape time instead of being mirrored on every change.
+
+``registry.render()`` produces the text exposition format served on /metrics.
+"""
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Tuple
+
+if TYPE_CHECKING:
+    import httpx
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in list(self.values.items()))
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series: Dict[tuple, list] = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for key, series in list(self.series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (bound,))} {total}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register ``fn() -> [(name, kind, help, [(labels, value), ...]), ...]`` run at scrape time"""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                print(f"⚠️ Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_format_labels(labels.keys(), labels.values())} {value}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+PROCESS_STARTED = time.time()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")))
+HTTP_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being served"))
+DB_REQUESTS = registry.register(Counter(
+    "supabase_requests_total", "PostgREST requests by table and status", ("table", "method", "status")))
+DB_LATENCY = registry.register(Histogram(
+    "supabase_request_duration_seconds", "PostgREST latency to response headers", ("table", "method")))
+DB_ERRORS = registry.register(Counter(
+    "supabase_call_errors_total", "Database calls that raised", ("call",)))
+LIMITER_RESPONSES = registry.register(Counter(
+    "limiter_responses_total", "Upstream responses per rotated key (Serper keys, WhatsApp senders)",
+    ("limiter", "key", "status")))
+TWILIO_LATENCY = registry.register(Histogram(
+    "twilio_send_duration_seconds", "Twilio Messages API latency", ("status",)))
+
+
+class MetricsMiddleware:
+    """Raw ASGI middleware (no BaseHTTPMiddleware task/stream overhead)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.routes: Dict[object, str] = {}  # endpoint -> path template
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self.routes.get(endpoint)
+        if route is None:
+            app = scope.get("app")
+            route = next((r.path for r in getattr(app, "routes", ()) if getattr(r, "endpoint", None) is endpoint), "unknown")
+            self.routes[endpoint] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = self._route(scope)
+            HTTP_REQUESTS.inc(scope["method"], route, status)
+            HTTP_LATENCY.observe(time.perf_counter() - started, scope["method"], route)
+
+
+def instrument_postgrest(session: "httpx.Client"):
+    """Time every PostgREST call made through ``session`` by table"""
+    def on_request(request: "httpx.Request"):
+        request.extensions["metrics_started"] = time.perf_counter()
+
+    def on_response(response: "httpx.Response"):
+        request = response.request
+        table = request.url.path.split("/rest/v1/", 1)[-1] or "/"
+        started = request.extensions.get("metrics_started")
+        if started is not None:
+            DB_LATENCY.observe(time.perf_counter() - started, table, request.method)
+        DB_REQUESTS.inc(table, request.method, response.status_code)
+
+    hooks = session.event_hooks
+    hooks["request"] = hooks.get("request", []) + [on_request]
+    hooks["response"] = hooks.get("response", []) + [on_response]
+    session.event_hooks = hooks
@@ -0,0 +1,96 @@
+"""Password hashing off the event loop.
+
+bcrypt costs tens to hundreds of milliseconds of CPU per call, so hashing and
+verification run on a small dedicated thread pool (the bcrypt C code releases
+the GIL) behind a semaphore. At most PASSWORD_WORKERS hashes run at once and
+at most PASSWORD_MAX_WAITING more may queue; beyond that ``PasswordBusy`` is
+raised so a login storm is shed instead of piling up behind the API.
+
+Hashes made with an older cost (or a legacy plaintext value) verify normally
+and come back with a replacement hash at the current BCRYPT_ROUNDS.
+"""
+import asyncio
+import functools
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_MAX_WAITING = int(os.environ.get("PASSWORD_MAX_WAITING", 64))
+
+_pwd_context = None
+
+
+def pwd_context():
+    """The CryptContext, built on first use (passlib and bcrypt load lazily)"""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+    return _pwd_context
+
+
+class PasswordBusy(Exception):
+    """Too many hashes queued; the caller should retry later"""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_waiting: int = PASSWORD_MAX_WAITING):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._dummy: Optional[str] = None
+
+    async def _run(self, fn, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self.waiting >= self.workers + self.max_waiting:
+            self.rejected += 1
+            raise PasswordBusy("Too many concurrent logins")
+        self.waiting += 1
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+        finally:
+            self.waiting -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context().hash, password)
+
+    async def verify(self, password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """(valid, new_hash); new_hash is set when ``stored`` should be replaced"""
+        if not stored:
+            # Unknown user: still pay for one verify so both cases take as long
+            if self._dummy is None:
+                self._dummy = await self.hash("dummy-password")
+            await self._run(pwd_context().verify, password, self._dummy)
+            return False, None
+        if not pwd_context().identify(stored):
+            # Legacy plaintext row: compare in constant time, then upgrade it
+            if hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")):
+                self.rehashed += 1
+                return True, await self.hash(password)
+            return False, None
+        valid, new_hash = await self._run(pwd_context().verify_and_update, password, stored)
+        if valid and new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "rounds": BCRYPT_ROUNDS,
+        }
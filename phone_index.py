@@ -0,0 +1,106 @@
+"""In-process index of known lead phone numbers.
+
+A normalised number 01P XXXXXXXX is packed into one unsigned 32-bit int
+(prefix index * 10^8 + last eight digits), kept in a sorted ``array('I')``
+searched with ``bisect``: 4 bytes per number instead of a Python string each.
+New numbers land in a small set that is merged into the array once it passes
+PHONE_INDEX_MERGE entries (or 1/32 of the array, keeping merges amortised).
+The index is warmed from ``leads`` at startup and fed by every insert this
+process makes.
+"""
+import asyncio
+import os
+import time
+from array import array
+from bisect import bisect_left
+from typing import Iterable, List, Optional
+
+PHONE_INDEX_MERGE = int(os.environ.get("PHONE_INDEX_MERGE", 10000))
+PHONE_INDEX_PAGE = int(os.environ.get("PHONE_INDEX_PAGE", 1000))
+
+PREFIXES = {"010": 0, "011": 1, "012": 2, "015": 3}
+
+
+def encode(phone: str) -> Optional[int]:
+    """01XXXXXXXXX -> packed int, or None if it isn't a normalised mobile number"""
+    if not phone or len(phone) != 11:
+        return None
+    prefix = PREFIXES.get(phone[:3])
+    if prefix is None or not phone[3:].isdigit():
+        return None
+    return prefix * 100_000_000 + int(phone[3:])
+
+
+class PhoneIndex:
+    def __init__(self, merge_threshold: int = PHONE_INDEX_MERGE):
+        self.merge_threshold = merge_threshold
+        self.sorted = array("I")
+        self.pending = set()
+        self.ready = False
+        self._warming = False
+        self.warm_seconds: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.sorted) + len(self.pending)
+
+    def _has(self, code: int) -> bool:
+        if code in self.pending:
+            return True
+        i = bisect_left(self.sorted, code)
+        return i < len(self.sorted) and self.sorted[i] == code
+
+    def __contains__(self, phone: str) -> bool:
+        code = encode(phone)
+        return code is not None and self._has(code)
+
+    def add(self, phone: str):
+        self.add_many((phone,))
+
+    def add_many(self, phones: Iterable[str]):
+        for phone in phones:
+            code = encode(phone)
+            if code is not None and not self._has(code):
+                self.pending.add(code)
+        if len(self.pending) >= max(self.merge_threshold, len(self.sorted) >> 5) and not self._warming:
+            self._merge()
+
+    def filter_new(self, phones: Iterable[str]) -> List[str]:
+        """Phones not yet in the index (order kept)"""
+        return [phone for phone in phones if phone not in self]
+
+    def _merge(self):
+        # Both runs are sorted, so timsort merges them in close to linear time
+        self.sorted = array("I", sorted([*self.sorted, *self.pending]))
+        self.pending = set()
+
+    async def warm(self, db, page_size: int = PHONE_INDEX_PAGE):
+        """Load every phone number in ``leads`` (keyset pages on id)"""
+        started = time.time()
+        codes = array("I")
+        after_id = None
+        while True:
+            rows = await db.get_phone_page(after_id, page_size)
+            codes.extend(c for c in (encode(row["phone_number"]) for row in rows) if c is not None)
+            if len(rows) < page_size:
+                break
+            after_id = rows[-1]["id"]
+        # The merge runs in a thread on a snapshot taken here; numbers added meanwhile
+        # stay in pending (merges wait for the warm-up) and are carried over after
+        base_sorted, base_pending = self.sorted, set(self.pending)
+        self._warming = True
+        try:
+            merged = await asyncio.to_thread(lambda: array("I", sorted(set([*codes, *base_sorted, *base_pending]))))
+        finally:
+            self._warming = False
+        self.sorted, self.pending = merged, self.pending - base_pending
+        self.ready = True
+        self.warm_seconds = round(time.time() - started, 2)
+        return len(self.sorted)
+
+    def stats(self) -> dict:
+        return {
+            "numbers": len(self),
+            "bytes": self.sorted.itemsize * len(self.sorted) + 32 * len(self.pending),
+            "ready": self.ready,
+            "warm_seconds": self.warm_seconds,
+        }
@@ -0,0 +1,140 @@
+"""Egyptian mobile number extraction and normalisation.
+
+Extraction is a single pass of one compiled pattern over the text after
+Arabic-Indic digits have been mapped to ASCII with ``str.translate``; dedup is
+set-based. Large payloads are split on line boundaries and fanned out to a
+process pool so big documents use every core without blocking the event loop.
+"""
+import asyncio
+import os
+import re
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor  # imported with the first pool, not at startup
+
+PHONE_WORKERS = int(os.environ.get("PHONE_WORKERS", os.cpu_count() or 1))
+PHONE_POOL_THRESHOLD = int(os.environ.get("PHONE_POOL_THRESHOLD", 1 << 20))  # bytes before using the pool
+PHONE_CHUNK_SIZE = int(os.environ.get("PHONE_CHUNK_SIZE", 4 << 20))
+
+# Arabic-Indic (٠-٩) and Eastern Arabic-Indic (۰-۹) digits -> ASCII
+DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+
+# 01X XXXX XXXX with an optional +20 / 0020 / 20 prefix and up to three
+# spaces/dashes between digits ("010 - 1234 - 5678"). Starting with a literal
+# [+02] class (boundary checked by lookbehind after it) lets the regex engine
+# skip ahead instead of trying every position; a bare 2 is only followed up
+# when a number comes right after it.
+_SEP = r"[ \-]{0,3}"
+PHONE_PATTERN = re.compile(
+    rf"[+02](?<!\d[+02])"
+    rf"(?:(?<=2)(?=0{_SEP}0?1[0125])0{_SEP}0?|(?<=\+) ?20{_SEP}0?|(?<=0)(?:0 ?20{_SEP}0?)?)"
+    rf"1[0125](?:{_SEP}\d){{8}}(?!\d)"
+)
+NON_DIGITS = re.compile(r"\D")
+VALID_PHONE = re.compile(r"01[0125]\d{8}")
+
+_pool: "Optional[ProcessPoolExecutor]" = None
+
+
+def extract_phones(text: str) -> List[str]:
+    """Unique phone numbers in order of first appearance, as 01XXXXXXXXX"""
+    text = text.translate(DIGITS)
+    return list(dict.fromkeys("0" + NON_DIGITS.sub("", m)[-10:] for m in PHONE_PATTERN.findall(text)))
+
+
+def normalize_phone(raw) -> Optional[str]:
+    """Normalise one number to 01XXXXXXXXX, or None if it isn't an Egyptian mobile"""
+    digits = NON_DIGITS.sub("", str(raw).translate(DIGITS))
+    if digits.startswith("0020"):
+        digits = "0" + digits[4:]
+    elif digits.startswith("20") and len(digits) == 12:
+        digits = "0" + digits[2:]
+    elif len(digits) == 10 and digits.startswith("1"):
+        digits = "0" + digits
+    return digits if VALID_PHONE.fullmatch(digits) else None
+
+
+def to_e164(phone: str) -> Optional[str]:
+    """01XXXXXXXXX -> +201XXXXXXXXX (the format Twilio/WhatsApp expects)"""
+    phone = normalize_phone(phone)
+    return "+2" + phone if phone else None
+
+
+def split_text(text: str, size: int = PHONE_CHUNK_SIZE) -> List[str]:
+    """Split on newlines near ``size`` characters; numbers never span lines"""
+    chunks, start = [], 0
+    while start < len(text):
+        end = start + size
+        if end < len(text):
+            newline = text.rfind("\n", start, end)
+            end = newline + 1 if newline > start else text.find("\n", end) + 1 or len(text)
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+def extract_many(texts: Iterable[str]) -> List[List[str]]:
+    return [extract_phones(text) for text in texts]
+
+
+def get_pool() -> "ProcessPoolExecutor":
+    global _pool
+    if _pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        _pool = ProcessPoolExecutor(max_workers=PHONE_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def extract_phones_async(text: str) -> List[str]:
+    """extract_phones that fans big documents out to the process pool"""
+    if len(text) < PHONE_POOL_THRESHOLD or PHONE_WORKERS < 2:
+        if len(text) < PHONE_POOL_THRESHOLD // 16:
+            return extract_phones(text)
+        return await asyncio.to_thread(extract_phones, text)
+    loop = asyncio.get_running_loop()
+    chunk_size = max(PHONE_POOL_THRESHOLD // 4, min(PHONE_CHUNK_SIZE, len(text) // PHONE_WORKERS + 1))
+    parts = await asyncio.gather(*[
+        loop.run_in_executor(get_pool(), extract_phones, chunk) for chunk in split_text(text, chunk_size)
+    ])
+    return list(dict.fromkeys(phone for part in parts for phone in part))
+
+
+async def extract_many_async(texts: List[str]) -> List[List[str]]:
+    """Per-text results for a batch; big batches are grouped into pool tasks"""
+    total = sum(len(t) for t in texts)
+    if total < PHONE_POOL_THRESHOLD or PHONE_WORKERS < 2:
+        if total < PHONE_POOL_THRESHOLD // 16:
+            return extract_many(texts)
+        return await asyncio.to_thread(extract_many, texts)
+    # Group texts into roughly equal batches, one pool task per batch
+    target = max(PHONE_POOL_THRESHOLD // 4, total // PHONE_WORKERS + 1)
+    groups, current, size = [], [], 0
+    for text in texts:
+        if len(text) >= PHONE_POOL_THRESHOLD:
+            if current:
+                groups.append(current)
+                current, size = [], 0
+            groups.append(text)  # a single big document is split on its own
+            continue
+        current.append(text)
+        size += len(text)
+        if size >= target:
+            groups.append(current)
+            current, size = [], 0
+    if current:
+        groups.append(current)
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*[
+        extract_phones_async(group) if isinstance(group, str) else loop.run_in_executor(get_pool(), extract_many, group)
+        for group in groups
+    ])
+    return [phones for group, result in zip(groups, results) for phones in ([result] if isinstance(group, str) else result)]
@@ -0,0 +1,207 @@
+"""Per-key token-bucket rate limiting for the Serper API.
+
+Each configured key gets its own bucket, so total throughput grows with the
+number of keys. Waiting is done with ``asyncio.sleep`` and never blocks the
+event loop. Keys answering 429 are backed off exponentially, and keys that
+are out of credits or rejected are dropped from rotation.
+
+Given a ``store`` (shared_state.SharedState) the buckets, strikes, removed
+keys and rotation cursor are loaded from and written back to it around every
+acquire/report, so several worker processes share one budget per key. Those
+transactions can wait on another worker's lock, so they run in a thread and
+never on the event loop.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from metrics import LIMITER_RESPONSES
+
+SERPER_RATE_PER_MIN = float(os.environ.get("SERPER_RATE_PER_MIN", 30))  # per key
+SERPER_BURST = float(os.environ.get("SERPER_BURST", 5))
+SERPER_BACKOFF_BASE = float(os.environ.get("SERPER_BACKOFF_BASE", 2.0))
+SERPER_BACKOFF_MAX = float(os.environ.get("SERPER_BACKOFF_MAX", 120.0))
+SERPER_MAX_STRIKES = int(os.environ.get("SERPER_MAX_STRIKES", 6))  # consecutive 429s before a key is dropped
+
+
+class TokenBucket:
+    """Classic token bucket; ``rate`` is tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 means one is available now)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class KeyState:
+    def __init__(self, key: str, rate: float, capacity: float):
+        self.key = key
+        self.bucket = TokenBucket(rate, capacity)
+        self.strikes = 0
+        self.requests = 0
+        self.throttled = 0
+
+
+class KeyRateLimiter:
+    """Hands out keys (Serper API keys, sender numbers) under a per-key request budget"""
+
+    def __init__(
+        self,
+        keys: List[str],
+        rate_per_min: float = SERPER_RATE_PER_MIN,
+        burst: float = SERPER_BURST,
+        name: str = "Serper key",
+        store=None,
+    ):
+        self.name = name
+        self.rate = rate_per_min / 60.0
+        self.burst = max(1.0, burst)
+        self.keys: Dict[str, KeyState] = {k: KeyState(k, self.rate, self.burst) for k in dict.fromkeys(keys)}
+        self.removed: Dict[str, str] = {}
+        self._cursor = 0
+        self.store = store
+
+    @contextmanager
+    def _synced(self):
+        """Run a state change against the shared store (no-op when in-process)"""
+        if self.store is None:
+            yield
+            return
+        with self.store.locked() as conn:
+            cursor, states, removed = self.store.load_limiter(conn, self.name)
+            self._cursor = cursor
+            for key, reason in removed.items():
+                if self.keys.pop(key, None) is not None:
+                    self.removed[key] = reason
+            for key, fields in states.items():
+                state = self.keys.get(key)
+                if state is not None:
+                    bucket = state.bucket
+                    bucket.tokens, bucket.updated, bucket.blocked_until = (
+                        fields["tokens"], fields["updated"], fields["blocked_until"])
+                    state.strikes, state.requests, state.throttled = (
+                        fields["strikes"], fields["requests"], fields["throttled"])
+            yield
+            self.store.save_limiter(conn, self.name, self._cursor, {
+                key: {
+                    "tokens": s.bucket.tokens, "updated": s.bucket.updated, "blocked_until": s.bucket.blocked_until,
+                    "strikes": s.strikes, "requests": s.requests, "throttled": s.throttled,
+                }
+                for key, s in self.keys.items()
+            }, self.removed)
+
+    @property
+    def active_keys(self) -> List[str]:
+        return list(self.keys)
+
+    def next_key(self) -> Optional[str]:
+        """Round-robin over active keys without consuming a token"""
+        if not self.keys:
+            return None
+        keys = self.active_keys
+        key = keys[self._cursor % len(keys)]
+        self._cursor = (self._cursor + 1) % len(keys)
+        return key
+
+    def try_acquire(self) -> "tuple[Optional[str], float]":
+        """Take a token from the first ready key, starting at the rotation cursor.
+
+        Returns ``(key, 0)`` on success or ``(None, wait)`` with the shortest
+        wait across all keys. ``(None, 0)`` means no keys are left.
+        """
+        with self._synced():
+            return self._try_acquire()
+
+    def _try_acquire(self) -> "tuple[Optional[str], float]":
+        if not self.keys:
+            return None, 0.0
+        now = time.monotonic()
+        states = list(self.keys.values())
+        start = self._cursor % len(states)
+        shortest = None
+        for i in range(len(states)):
+            state = states[(start + i) % len(states)]
+            wait = state.bucket.wait_time(now)
+            if wait == 0:
+                state.bucket.take()
+                state.requests += 1
+                self._cursor = (start + i + 1) % len(states)
+                return state.key, 0.0
+            shortest = wait if shortest is None else min(shortest, wait)
+        return None, shortest
+
+    async def acquire(self) -> Optional[str]:
+        """Wait (without blocking the loop) for a key with a free token"""
+        while True:
+            if self.store is None:
+                key, wait = self._try_acquire()
+            else:
+                key, wait = await asyncio.to_thread(self.try_acquire)
+            if key or not wait:
+                return key
+            await asyncio.sleep(wait)
+
+    async def report(self, key: str, status_code: int, body: str = ""):
+        """Feed a response status back into the key's state"""
+        LIMITER_RESPONSES.inc(self.name, f"...{key[-4:]}", status_code)
+        if self.store is None:
+            self._report(key, status_code, body)
+        else:
+            await asyncio.to_thread(self._synced_report, key, status_code, body)
+
+    def _synced_report(self, key: str, status_code: int, body: str):
+        with self._synced():
+            self._report(key, status_code, body)
+
+    def _report(self, key: str, status_code: int, body: str):
+        state = self.keys.get(key)
+        if state is None:
+            return
+        if status_code == 429:
+            state.strikes += 1
+            state.throttled += 1
+            if state.strikes >= SERPER_MAX_STRIKES:
+                self.remove(key, "rate limited")
+                return
+            backoff = min(SERPER_BACKOFF_MAX, SERPER_BACKOFF_BASE * 2 ** (state.strikes - 1))
+            state.bucket.blocked_until = time.monotonic() + backoff
+            state.bucket.tokens = 0
+        elif status_code in (401, 403) or (status_code == 400 and "credits" in body.lower()):
+            self.remove(key, "exhausted" if status_code == 400 else "rejected")
+        elif status_code < 400:
+            state.strikes = 0
+
+    def remove(self, key: str, reason: str):
+        if self.keys.pop(key, None) is not None:
+            self.removed[key] = reason
+            print(f"⚠️ {self.name} ...{key[-4:]} removed from rotation ({reason})")
+
+    def stats(self) -> dict:
+        return {
+            "shared": self.store is not None,
+            "active_keys": len(self.keys),
+            "removed_keys": len(self.removed),
+            "rate_per_min_per_key": round(self.rate * 60, 2),
+            "capacity_per_min": round(self.rate * 60 * len(self.keys), 2),
+            "keys": [
+                {"key": f"...{s.key[-4:]}", "requests": s.requests, "throttled": s.throttled, "strikes": s.strikes}
+                for s in list(self.keys.values())
+            ],
+        }
@@ -0,0 +1,376 @@
+"""Local SQLite read replica of the Supabase tables the API reads most.
+
+Every lead page, login, campaign lookup and share check used to be a
+PostgREST round trip (tens of ms, and an error whenever Supabase blips).
+LocalReplica mirrors those tables into one SQLite file in WAL mode and
+Database answers the reads from it once a table has been loaded:
+
+* ``leads`` is bulk-loaded once in keyset pages on (created_at, id) and then
+  synced incrementally from that watermark every REPLICA_SYNC seconds. The
+  watermark is committed with each page, so an interrupted load resumes and a
+  restart with an existing file is ready immediately. created_at is stamped by
+  the database (NOW() at transaction start), so a row can commit after a newer
+  one has moved the watermark past it: each pass re-reads the last
+  REPLICA_OVERLAP seconds behind the watermark to pick such rows up;
+* ``users``, ``whatsapp_campaigns`` and ``lead_shares`` are small and are
+  re-read whole every REPLICA_FULL_SYNC seconds, which also picks up
+  updates and deletes made elsewhere;
+* writes still go to Supabase first; Database then applies the same change
+  here (write-through), so this node reads its own writes straight away.
+
+Rows are stored as JSON next to their id and sort column; the columns
+Database filters on get expression indexes. Changes to existing leads made
+outside this app (the Supabase dashboard, another node) are not seen until
+the file is deleted and reloaded. Reads keep being served while Supabase is
+down; ``stats()`` reports how far behind each table is.
+
+REPLICA_DB enables it (e.g. media/replica.sqlite3). Workers on one node can
+share the file: a lease makes one of them do the syncing.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    import sqlite3  # imported when the database is first opened, not at startup
+
+REPLICA_DB = os.environ.get("REPLICA_DB", "")  # empty disables the replica
+REPLICA_SYNC = float(os.environ.get("REPLICA_SYNC", 5))
+REPLICA_FULL_SYNC = float(os.environ.get("REPLICA_FULL_SYNC", 60))
+REPLICA_OVERLAP = float(os.environ.get("REPLICA_OVERLAP", 30))  # seconds re-read behind the watermark
+REPLICA_PAGE = int(os.environ.get("REPLICA_PAGE", 1000))
+REPLICA_BUSY_TIMEOUT = float(os.environ.get("REPLICA_BUSY_TIMEOUT", 5))
+
+# table -> (sort column, incremental?, indexed columns)
+TABLES = {
+    "leads": ("created_at", True, ("phone_number", "user_id", "status")),
+    "users": ("created_at", False, ("username",)),
+    "whatsapp_campaigns": ("created_at", False, ("user_id",)),
+    "lead_shares": ("share_date", False, ("phone",)),
+}
+
+
+def _key(value):
+    """Ids compare like Postgres: numeric ids as numbers, everything else as text"""
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value
+
+
+def _before(timestamp, seconds: float) -> Optional[str]:
+    """ISO timestamp ``seconds`` earlier, or None when it does not parse"""
+    try:
+        return (datetime.fromisoformat(str(timestamp)) - timedelta(seconds=seconds)).isoformat()
+    except ValueError:
+        return None
+
+
+def _column(table: str, name: str) -> str:
+    if name == "id":
+        return "id"
+    if name == TABLES[table][0]:
+        return "sort"
+    return f"json_extract(data, '$.{name}')"
+
+
+class LocalReplica:
+    def __init__(self, path: str, interval: float = REPLICA_SYNC, full_interval: float = REPLICA_FULL_SYNC,
+                 page_size: int = REPLICA_PAGE, overlap: float = REPLICA_OVERLAP):
+        self.path = path
+        self.interval = interval
+        self.full_interval = full_interval
+        self.page_size = page_size
+        self.overlap = overlap
+        self.pid = os.getpid()
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loaded: set = set()
+        self.state: Dict[str, dict] = {}
+        self.reads = self.writes = self.synced_rows = self.sync_errors = 0
+        self.last_error: Optional[str] = None
+        self._db()
+        self._load_state()
+
+    # ---------- connections ----------
+    def _db(self) -> "sqlite3.Connection":
+        # One connection per thread (WAL lets readers run alongside the writer); re-opened after a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            import sqlite3
+
+            conn = sqlite3.connect(self.path, timeout=REPLICA_BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS replica_state (
+                    tbl TEXT PRIMARY KEY, sort, last_id, loaded INTEGER, synced_at REAL);
+                CREATE TABLE IF NOT EXISTS replica_lease (name TEXT PRIMARY KEY, pid INTEGER, expires REAL);
+            """)
+            for table, (_, _, indexed) in TABLES.items():
+                # No declared type on id/sort: integer ids stay integers and order like Postgres
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (id PRIMARY KEY, sort, data TEXT NOT NULL)')
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_sort" ON "{table}" (sort, id)')
+                for column in indexed:
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{column}" ON "{table}" '
+                                 f"(json_extract(data, '$.{column}'))")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """Write transaction, exclusive across threads and worker processes"""
+        with self._write_lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _load_state(self):
+        rows = self._db().execute("SELECT tbl, sort, last_id, loaded, synced_at FROM replica_state").fetchall()
+        self.state = {
+            table: {"sort": sort, "last_id": last_id, "loaded": bool(loaded), "synced_at": synced_at}
+            for table, sort, last_id, loaded, synced_at in rows
+        }
+        self.loaded = {table for table, state in self.state.items() if state["loaded"]}
+
+    def _save_state(self, conn, table: str, sort=None, last_id=None, loaded: bool = False):
+        conn.execute(
+            "INSERT OR REPLACE INTO replica_state (tbl, sort, last_id, loaded, synced_at) VALUES (?, ?, ?, ?, ?)",
+            (table, sort, last_id, int(loaded), time.time()),
+        )
+
+    def ready(self, table: str) -> bool:
+        return table in self.loaded
+
+    # ---------- reads ----------
+    def _where(self, table: str, filters: dict, in_: dict = None, created_from=None, created_to=None,
+               after=None, before=None, after_id=None):
+        clauses, params = [], []
+        for name, value in filters.items():
+            if value is not None:
+                clauses.append(f"{_column(table, name)} = ?")
+                params.append(_key(value) if name == "id" else value)
+        for name, values in (in_ or {}).items():
+            clauses.append(f"{_column(table, name)} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        if created_from:
+            clauses.append("sort >= ?")
+            params.append(created_from)
+        if created_to:
+            clauses.append("sort < ?")
+            params.append(created_to)
+        for position, op in ((after, ">"), (before, "<")):
+            if position:
+                clauses.append(f"(sort {op} ? OR (sort = ? AND id {op} ?))")
+                params.extend((position[0], position[0], _key(position[1])))
+        if after_id is not None:
+            clauses.append("id > ?")
+            params.append(_key(after_id))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def select(self, table: str, order: str = "sort", desc: bool = False, limit: int = None,
+               in_: dict = None, created_from=None, created_to=None, after=None, before=None,
+               after_id=None, **filters) -> List[dict]:
+        """Rows matching equality ``filters`` ordered by (sort, id) or by id"""
+        where, params = self._where(table, filters, in_, created_from, created_to, after, before, after_id)
+        direction = " DESC" if desc else ""
+        sql = f'SELECT data FROM "{table}"{where} ORDER BY '
+        sql += f"sort{direction}, id{direction}" if order == "sort" else f"id{direction}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        self.reads += 1
+        return [json.loads(data) for (data,) in self._db().execute(sql, params)]
+
+    def find(self, table: str, **filters) -> Optional[dict]:
+        rows = self.select(table, limit=1, **filters)
+        return rows[0] if rows else None
+
+    def count(self, table: str, created_from=None, created_to=None, **filters) -> int:
+        where, params = self._where(table, filters, created_from=created_from, created_to=created_to)
+        self.reads += 1
+        return self._db().execute(f'SELECT COUNT(*) FROM "{table}"{where}', params).fetchone()[0]
+
+    # ---------- write-through ----------
+    def _rows(self, table: str, rows: Iterable[dict]):
+        sort_column = TABLES[table][0]
+        return [(_key(row["id"]), row.get(sort_column), json.dumps(row, ensure_ascii=False, default=str))
+                for row in rows if row.get("id") is not None]
+
+    def upsert(self, table: str, rows: Iterable[dict]):
+        """Store rows exactly as Supabase returned them"""
+        values = self._rows(table, rows)
+        if values:
+            with self._write() as conn:
+                conn.executemany(f'INSERT OR REPLACE INTO "{table}" (id, sort, data) VALUES (?, ?, ?)', values)
+            self.writes += len(values)
+
+    def update(self, table: str, changes: dict, **filters):
+        """Apply an UPDATE ... WHERE filters to the local rows"""
+        where, params = self._where(table, filters)
+        with self._write() as conn:
+            rows = [{**json.loads(data), **changes} for (data,) in
+                    conn.execute(f'SELECT data FROM "{table}"{where}', params).fetchall()]
+            conn.executemany(f'INSERT OR REPLACE INTO "{table}" (id, sort, data) VALUES (?, ?, ?)',
+                             self._rows(table, rows))
+        self.writes += len(rows)
+
+    def delete(self, table: str, **filters):
+        where, params = self._where(table, filters)
+        with self._write() as conn:
+            self.writes += conn.execute(f'DELETE FROM "{table}"{where}', params).rowcount
+
+    def poke(self):
+        """Sync soon (after a write whose rows could not be mirrored directly); thread-safe"""
+        if self._wake is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # ---------- sync ----------
+    def _claim(self) -> bool:
+        """Take or renew the sync lease; only one worker sharing the file syncs"""
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute("SELECT pid, expires FROM replica_lease WHERE name = 'sync'").fetchone()
+            if row and row[0] != os.getpid() and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO replica_lease (name, pid, expires) VALUES ('sync', ?, ?)",
+                         (os.getpid(), now + 3 * max(self.interval, 1)))
+        return True
+
+    def _sync_incremental(self, client, table: str) -> int:
+        """Pull rows past the (sort, id) watermark, committing the watermark with each page"""
+        sort_column = TABLES[table][0]
+        state = self.state.get(table, {})
+        position, read = (state.get("sort"), state.get("last_id")), 0
+        # Once loaded, start a little behind the watermark for rows that committed late
+        rescan = _before(position[0], self.overlap) if state.get("loaded") and position[0] else None
+        while True:
+            query = client.table(table).select("*")
+            if rescan is not None:
+                query, rescan = query.gte(sort_column, rescan), None
+            elif position[0] is not None:
+                query = query.or_(f'{sort_column}.gt."{position[0]}",'
+                                  f'and({sort_column}.eq."{position[0]}",id.gt."{position[1]}")')
+            rows = query.order(sort_column).order("id").limit(self.page_size).execute().data or []
+            if rows:
+                position = (rows[-1][sort_column], rows[-1]["id"])
+            done = len(rows) < self.page_size
+            with self._write() as conn:
+                # Rows already here came from a write-through, which is at least as new
+                added = conn.executemany(f'INSERT OR IGNORE INTO "{table}" (id, sort, data) VALUES (?, ?, ?)',
+                                         self._rows(table, rows)).rowcount
+                self._save_state(conn, table, position[0], position[1], loaded=done or state.get("loaded", False))
+            read += added
+            if done:
+                return read
+
+    def _sync_full(self, client, table: str) -> int:
+        """Re-read a small table whole and replace the local copy in one transaction"""
+        rows, last_id = [], None
+        while True:
+            query = client.table(table).select("*")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            page = query.order("id").limit(self.page_size).execute().data or []
+            rows.extend(page)
+            if len(page) < self.page_size:
+                break
+            last_id = page[-1]["id"]
+        with self._write() as conn:
+            conn.execute(f'DELETE FROM "{table}"')
+            conn.executemany(f'INSERT INTO "{table}" (id, sort, data) VALUES (?, ?, ?)', self._rows(table, rows))
+            self._save_state(conn, table, loaded=True)
+        return len(rows)
+
+    def sync_once(self, client) -> int:
+        """One sync pass over every table (blocking; run it off the event loop)"""
+        if not self._claim():
+            self._load_state()  # another worker is syncing the shared file
+            return 0
+        read = 0
+        for table, (_, incremental, _) in TABLES.items():
+            try:
+                if incremental:
+                    read += self._sync_incremental(client, table)
+                else:
+                    synced_at = self.state.get(table, {}).get("synced_at") or 0
+                    if table not in self.loaded or time.time() - synced_at >= self.full_interval:
+                        read += self._sync_full(client, table)
+            except Exception as e:
+                self.sync_errors += 1
+                self.last_error = f"{table}: {e}"
+                print(f"⚠️ Replica sync of {table} failed (serving the local copy): {e}")
+        self._load_state()
+        self.synced_rows += read
+        return read
+
+    def start(self, db):
+        """Sync in the background every ``interval`` seconds, or sooner after ``poke()``"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+
+        async def loop():
+            announced = False
+            while True:
+                started = time.time()
+                try:
+                    await db.run(self.sync_once, db.client)
+                    if not announced and len(self.loaded) == len(TABLES):
+                        announced = True
+                        print(f"🪞 Replica ready: {self.synced_rows} rows synced this run")
+                except Exception as e:
+                    print(f"⚠️ Replica sync failed: {e}")
+                try:
+                    await asyncio.wait_for(self._wake.wait(), max(0.0, self.interval - (time.time() - started)))
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        self._task = asyncio.create_task(loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        now = time.time()
+        tables = {}
+        for table in TABLES:
+            state = self.state.get(table, {})
+            synced_at = state.get("synced_at")
+            tables[table] = {
+                "loaded": table in self.loaded,
+                "lag_seconds": round(now - synced_at, 1) if synced_at else None,
+            }
+        return {
+            "path": self.path,
+            "tables": tables,
+            "reads": self.reads,
+            "writes": self.writes,
+            "synced_rows": self.synced_rows,
+            "sync_errors": self.sync_errors,
+            "last_error": self.last_error,
+        }
+
+
+def make_replica(path: str = REPLICA_DB) -> Optional[LocalReplica]:
+    """LocalReplica when REPLICA_DB is set, else None"""
+    if not path:
+        return None
+    print(f"🪞 Serving reads from the local replica at {path}")
+    return LocalReplica(path)
@@ -0,0 +1,373 @@
+"""State shared by the worker processes of one node.
+
+With ``uvicorn --workers N`` every worker is its own interpreter, so anything
+kept in module globals (Serper key rotation, token buckets, open socket
+counts) would be counted N times over. SharedState keeps that state in one
+SQLite file in WAL mode that every worker opens:
+
+* rate limiters load their buckets, strikes, removed keys and rotation cursor
+  inside a ``BEGIN IMMEDIATE`` transaction, take a token and write back, so
+  two workers can never spend the same token and quotas hold for the node as
+  a whole (see ``KeyRateLimiter(store=...)``);
+* each worker publishes a small dict of gauges (open sockets, active hunts...)
+  every SHARED_STATE_INTERVAL seconds and reads everyone's back in the same
+  transaction; ``cluster()`` sums that copy, so /health and /metrics never
+  touch the file;
+* ``claim(name, ttl)`` is a lease held by one live worker at a time, used so
+  exactly one worker sends each campaign;
+* work that lives in one worker (a hunt, a campaign run) is visible to the
+  others: ``share(topic, render)`` publishes its latest state, which any
+  worker can read with ``snapshot(topic)``, and ``post(kind, payload)``
+  delivers a message to every other worker (a cancel, a delivery receipt).
+  Both are queued in memory and exchanged every SHARED_STATE_POLL seconds in
+  one transaction by the loop started with ``start_sync``.
+
+Transactions touch a handful of rows and never wait on the network, so
+they hold the write lock for tens of microseconds. Still, under contention
+``BEGIN IMMEDIATE`` waits up to SHARED_STATE_BUSY_TIMEOUT seconds, so every
+method that opens one is meant to be called through ``asyncio.to_thread``. Put the file on tmpfs
+(the default is /dev/shm when it exists); deleting it resets every bucket.
+
+SHARED_STATE_DB enables the store. When unset it is turned on automatically
+whenever WEB_CONCURRENCY > 1 (uvicorn also reads it as its default
+``--workers``); with a single worker everything stays
+in-process as before. Another backend (Redis, a database) only has to
+provide the same ``locked``/``load_limiter``/``save_limiter``/
+``publish_worker``/``cluster``/``claim``/``release``/``holder``/``exchange``/
+``snapshot`` methods.
+"""
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import sqlite3  # imported when the database is first opened, not at startup
+
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+SHARED_STATE_DB = os.environ.get("SHARED_STATE_DB", "")
+SHARED_STATE_INTERVAL = float(os.environ.get("SHARED_STATE_INTERVAL", 5))
+SHARED_STATE_BUSY_TIMEOUT = float(os.environ.get("SHARED_STATE_BUSY_TIMEOUT", 5))
+SHARED_STATE_POLL = float(os.environ.get("SHARED_STATE_POLL", 0.25))
+SHARED_SNAPSHOT_TTL = float(os.environ.get("SHARED_SNAPSHOT_TTL", 3600))
+SHARED_MESSAGE_TTL = 60
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def default_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "hunter-shared-state.sqlite3")
+
+
+class SharedState:
+    def __init__(self, path: str, interval: float = SHARED_STATE_INTERVAL, poll: float = SHARED_STATE_POLL):
+        self.path = path
+        self.interval = interval
+        self.poll = poll
+        self.pid = os.getpid()
+        self._conn: "Optional[sqlite3.Connection]" = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._workers: List[Tuple[int, str]] = []
+        self._shared: Dict[str, Callable[[], dict]] = {}
+        self._posted: List[Tuple[str, dict]] = []
+        self._seen: Optional[Tuple[int, int]] = None
+        self.received = 0
+        self.transactions = 0
+        self.wait_seconds = 0.0
+
+    def _db(self) -> "sqlite3.Connection":
+        # One connection per process; re-opened after a fork
+        if self._conn is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            import sqlite3
+
+            conn = sqlite3.connect(self.path, timeout=SHARED_STATE_BUSY_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # throwaway state; durability is not needed
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS limiter_keys (
+                    limiter TEXT, key TEXT, tokens REAL, updated REAL, blocked_until REAL,
+                    strikes INTEGER, requests INTEGER, throttled INTEGER, removed TEXT,
+                    PRIMARY KEY (limiter, key));
+                CREATE TABLE IF NOT EXISTS limiter_cursors (limiter TEXT PRIMARY KEY, position INTEGER);
+                CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY, heartbeat REAL, gauges TEXT);
+                CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, pid INTEGER, expires REAL);
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    topic TEXT PRIMARY KEY, pid INTEGER, seq INTEGER, data TEXT, updated REAL);
+                CREATE INDEX IF NOT EXISTS snapshots_seq ON snapshots (seq);
+                CREATE TABLE IF NOT EXISTS messages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER, kind TEXT, payload TEXT, created REAL);
+            """)
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def locked(self):
+        """Exclusive write transaction across every worker on the node"""
+        with self._lock:
+            conn = self._db()
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            self.wait_seconds += time.perf_counter() - started
+            self.transactions += 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    # ---------- rate limiters ----------
+    # Times are stored as wall clock and handed back on the caller's monotonic
+    # clock, so rows stay meaningful across processes and reboots.
+    @staticmethod
+    def _skew() -> float:
+        return time.time() - time.monotonic()
+
+    def load_limiter(self, conn, limiter: str) -> Tuple[int, Dict[str, dict], Dict[str, str]]:
+        """(cursor, {key: fields}, {removed key: reason}) inside ``locked()``"""
+        skew = self._skew()
+        row = conn.execute("SELECT position FROM limiter_cursors WHERE limiter = ?", (limiter,)).fetchone()
+        states, removed = {}, {}
+        for key, tokens, updated, blocked_until, strikes, requests, throttled, reason in conn.execute(
+            "SELECT key, tokens, updated, blocked_until, strikes, requests, throttled, removed "
+            "FROM limiter_keys WHERE limiter = ?", (limiter,)
+        ):
+            if reason:
+                removed[key] = reason
+                continue
+            states[key] = {
+                "tokens": tokens, "updated": updated - skew, "blocked_until": blocked_until - skew,
+                "strikes": strikes, "requests": requests, "throttled": throttled,
+            }
+        return (row[0] if row else 0), states, removed
+
+    def save_limiter(self, conn, limiter: str, cursor: int, states: Dict[str, dict], removed: Dict[str, str]):
+        skew = self._skew()
+        conn.execute("INSERT OR REPLACE INTO limiter_cursors (limiter, position) VALUES (?, ?)", (limiter, cursor))
+        conn.executemany(
+            "INSERT OR REPLACE INTO limiter_keys (limiter, key, tokens, updated, blocked_until, strikes, "
+            "requests, throttled, removed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+            [
+                (limiter, key, s["tokens"], s["updated"] + skew, s["blocked_until"] + skew,
+                 s["strikes"], s["requests"], s["throttled"])
+                for key, s in states.items()
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO limiter_keys (limiter, key, tokens, updated, blocked_until, strikes, requests, "
+            "throttled, removed) VALUES (?, ?, 0, 0, 0, 0, 0, 0, ?) "
+            "ON CONFLICT (limiter, key) DO UPDATE SET removed = excluded.removed",
+            [(limiter, key, reason) for key, reason in removed.items()],
+        )
+
+    # ---------- worker gauges ----------
+    def publish_worker(self, gauges: dict):
+        with self.locked() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (pid, heartbeat, gauges) VALUES (?, ?, ?)",
+                (os.getpid(), time.time(), json.dumps(gauges)),
+            )
+            # Workers that stopped reporting (crashed or restarted) drop out
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (time.time() - 3 * self.interval,))
+            self._workers = conn.execute("SELECT pid, gauges FROM workers").fetchall()
+            # The newest snapshot is kept so its seq is never handed out again
+            conn.execute(
+                "DELETE FROM snapshots WHERE updated < ? AND seq < (SELECT MAX(seq) FROM snapshots)",
+                (time.time() - SHARED_SNAPSHOT_TTL,),
+            )
+            conn.execute("DELETE FROM messages WHERE created < ?", (time.time() - SHARED_MESSAGE_TTL,))
+
+    def forget_worker(self):
+        with self.locked() as conn:
+            conn.execute("DELETE FROM workers WHERE pid = ?", (os.getpid(),))
+
+    def cluster(self) -> dict:
+        """Gauges summed over the workers seen at this worker's last report (no I/O)"""
+        rows = self._workers
+        totals: Dict[str, float] = {}
+        for _, gauges in rows:
+            for name, value in json.loads(gauges).items():
+                totals[name] = totals.get(name, 0) + value
+        return {"workers": len(rows), "pids": sorted(pid for pid, _ in rows), **totals}
+
+    # ---------- leases ----------
+    def claim(self, name: str, ttl: float) -> bool:
+        """Take or renew ``name`` for ``ttl`` seconds; False while another live worker holds it"""
+        now = time.time()
+        with self.locked() as conn:
+            row = conn.execute("SELECT pid, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != os.getpid() and row[1] > now and _alive(row[0]):
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (name, pid, expires) VALUES (?, ?, ?)",
+                         (name, os.getpid(), now + ttl))
+            return True
+
+    def release(self, name: str):
+        with self.locked() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND pid = ?", (name, os.getpid()))
+
+    def holder(self, name: str) -> Optional[int]:
+        """pid of the live worker holding ``name``, if any"""
+        with self._lock:
+            row = self._db().execute("SELECT pid, expires FROM leases WHERE name = ?", (name,)).fetchone()
+        if row and row[1] > time.time() and _alive(row[0]):
+            return row[0]
+        return None
+
+    # ---------- snapshots and messages ----------
+    def share(self, topic: str, render: Callable[[], dict]):
+        """Publish ``render()`` as ``topic``'s state at the next exchange (no I/O here)"""
+        self._shared[topic] = render
+
+    def post(self, kind: str, payload: dict):
+        """Deliver ``payload`` to every other worker's ``kind`` handler at the next exchange"""
+        self._posted.append((kind, payload))
+
+    def exchange(self, snapshots: Dict[str, dict], messages: List[Tuple[str, dict]]):
+        """Write ours, read what other workers wrote since the last call.
+
+        Returns ``([(topic, data)], [(kind, payload)])``; the first call only
+        notes where the tables end, so nothing older is replayed.
+        """
+        pid = os.getpid()
+        with self.locked() as conn:
+            if snapshots:
+                seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM snapshots").fetchone()[0]
+                conn.executemany(
+                    "INSERT OR REPLACE INTO snapshots (topic, pid, seq, data, updated) VALUES (?, ?, ?, ?, ?)",
+                    [(topic, pid, seq + i, json.dumps(data), time.time())
+                     for i, (topic, data) in enumerate(snapshots.items(), 1)],
+                )
+            if messages:
+                conn.executemany(
+                    "INSERT INTO messages (pid, kind, payload, created) VALUES (?, ?, ?, ?)",
+                    [(pid, kind, json.dumps(payload), time.time()) for kind, payload in messages],
+                )
+            changed, received = [], []
+            if self._seen is not None:
+                changed = conn.execute(
+                    "SELECT topic, data FROM snapshots WHERE seq > ? AND pid != ? ORDER BY seq", (self._seen[0], pid)
+                ).fetchall()
+                received = conn.execute(
+                    "SELECT kind, payload FROM messages WHERE seq > ? AND pid != ? ORDER BY seq", (self._seen[1], pid)
+                ).fetchall()
+            self._seen = (
+                conn.execute("SELECT COALESCE(MAX(seq), 0) FROM snapshots").fetchone()[0],
+                conn.execute("SELECT COALESCE(MAX(seq), 0) FROM messages").fetchone()[0],
+            )
+        return ([(topic, json.loads(data)) for topic, data in changed],
+                [(kind, json.loads(payload)) for kind, payload in received])
+
+    def snapshot(self, topic: str) -> Optional[dict]:
+        """Latest state shared for ``topic`` by any worker"""
+        with self._lock:
+            row = self._db().execute("SELECT data FROM snapshots WHERE topic = ?", (topic,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def _exchange_pending(self):
+        shared, self._shared = self._shared, {}
+        posted, self._posted = self._posted, []
+        try:
+            rendered = {topic: render() for topic, render in shared.items()}
+            return await asyncio.to_thread(self.exchange, rendered, posted)
+        except Exception:
+            # Keep what was queued (newer renders win) for the next attempt
+            self._shared = {**shared, **self._shared}
+            self._posted = posted + self._posted
+            raise
+
+    async def start_sync(self, on_snapshot: Callable[[str, dict], None],
+                         handlers: Dict[str, Callable[[dict], None]]):
+        """Exchange snapshots and messages every ``poll`` seconds.
+
+        ``on_snapshot(topic, data)`` sees every state another worker shares;
+        ``handlers[kind](payload)`` every message posted by another worker.
+        """
+        if self._sync_task is not None:
+            return
+
+        async def loop():
+            while True:
+                await asyncio.sleep(self.poll)
+                try:
+                    changed, received = await self._exchange_pending()
+                except Exception as e:
+                    print(f"⚠️ Shared state exchange failed: {e}")
+                    continue
+                self.received += len(changed) + len(received)
+                for topic, data in changed:
+                    on_snapshot(topic, data)
+                for kind, payload in received:
+                    handler = handlers.get(kind)
+                    if handler is None:
+                        continue
+                    try:
+                        handler(payload)
+                    except Exception as e:
+                        print(f"⚠️ Shared {kind} message failed: {e}")
+        self._sync_task = asyncio.create_task(loop())
+
+    async def start_reporting(self, collect: Callable[[], dict]):
+        """Publish ``collect()`` for this worker every ``interval`` seconds"""
+        if self._task is not None:
+            return
+
+        async def loop():
+            while True:
+                try:
+                    await asyncio.to_thread(self.publish_worker, collect())
+                except Exception as e:
+                    print(f"⚠️ Shared state report failed: {e}")
+                await asyncio.sleep(self.interval)
+        self._task = asyncio.create_task(loop())
+
+    async def close(self):
+        for task in (self._task, self._sync_task):
+            if task is not None:
+                task.cancel()
+        self._task = self._sync_task = None
+        try:
+            if self._shared or self._posted:
+                await self._exchange_pending()
+            await asyncio.to_thread(self.forget_worker)
+        except Exception:
+            pass
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "transactions": self.transactions,
+            "received": self.received,
+            "avg_lock_wait_ms": round(self.wait_seconds / self.transactions * 1000, 3) if self.transactions else 0.0,
+        }
+
+
+def make_shared_state(path: str = SHARED_STATE_DB, workers: int = WEB_CONCURRENCY) -> Optional[SharedState]:
+    """SharedState when configured (or when running several workers), else None"""
+    if not path and workers > 1:
+        path = default_path()
+    if not path:
+        return None
+    print(f"🔗 Sharing limiter and connection state between workers via {path}")
+    return SharedState(path)
@@ -0,0 +1,122 @@
+"""Pre-rendered HTML pages with compressed bodies and revalidation.
+
+A ``CachedPage`` renders its HTML once and keeps identity, gzip and (when the
+``brotli`` package is installed) brotli bodies plus a strong ETag. Pages are
+rendered at startup by ``prerender()``; after that a page only re-renders
+when its ``version()`` value changes: the config values it embeds, or a
+file's mtime. A request costs a header comparison and hands back
+a ready-made body, or a bodyless 304 when the client's copy is current.
+"""
+import asyncio
+import gzip
+import hashlib
+import os
+from typing import Callable, Hashable, Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # optional: without it clients get gzip
+    brotli = None
+
+PAGE_MAX_AGE = int(os.environ.get("PAGE_MAX_AGE", 60))
+
+
+class CachedPage:
+    def __init__(
+        self,
+        render: Callable[[], str],
+        version: Callable[[], Hashable] = lambda: None,
+        max_age: int = PAGE_MAX_AGE,
+        media_type: str = "text/html; charset=utf-8",
+    ):
+        self.render = render
+        self.version = version
+        self.media_type = media_type
+        self.cache_control = f"public, max-age={max_age}, must-revalidate"
+        self._version = object()  # never equal to a real version: prerender (or the first request) renders
+        self.bodies: dict = {}
+        self.etag = ""
+        self.renders = 0
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "CachedPage":
+        def read():
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        return cls(read, version=lambda: os.stat(path).st_mtime_ns, **kwargs)
+
+    def _build(self):
+        body = self.render().encode("utf-8")
+        bodies = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body, quality=11)
+        return bodies, hashlib.sha256(body).hexdigest()[:32]
+
+    def _install(self, version, bodies: dict, etag: str):
+        self.bodies, self.etag, self._version = bodies, etag, version
+        self.renders += 1
+
+    def _refresh(self):
+        version = self.version()
+        if version != self._version:
+            self._install(version, *self._build())
+
+    async def prerender(self):
+        """Render ahead of the first request (compression runs in a thread)"""
+        version = self.version()
+        if version != self._version:
+            bodies, etag = await asyncio.to_thread(self._build)
+            self._install(version, bodies, etag)
+
+    @staticmethod
+    def _accepted(accept: str) -> set:
+        """Codings listed in Accept-Encoding with a non-zero q value"""
+        offered = set()
+        for part in accept.lower().split(","):
+            name, *params = [piece.strip() for piece in part.split(";")]
+            q = 1.0
+            for param in params:
+                key, _, value = param.partition("=")
+                if key.strip() == "q":
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            if name and q > 0:
+                offered.add(name)
+        return offered
+
+    def _encoding(self, accept: str) -> str:
+        offered = self._accepted(accept)
+        for encoding in ("br", "gzip"):
+            if encoding in offered and encoding in self.bodies:
+                return encoding
+        return "identity"
+
+    def _matches(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            # Each encoding has its own tag ("<hash>-gzip"); any of them means the same content
+            if tag.removeprefix("W/").strip('"').split("-")[0] == self.etag:
+                return True
+        return False
+
+    def respond(self, request: Request) -> Response:
+        self._refresh()
+        encoding = self._encoding(request.headers.get("accept-encoding", ""))
+        etag = f'"{self.etag}"' if encoding == "identity" else f'"{self.etag}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if self._matches(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.bodies[encoding], media_type=self.media_type, headers=headers)
+
+    def stats(self) -> dict:
+        return {"renders": self.renders, "sizes": {name: len(body) for name, body in self.bodies.items()}}
@@ -0,0 +1,112 @@
+"""Admin statistics service.
+
+Totals come from server-side counts (``count=exact|planned|estimated``)
+instead of downloading tables, and breakdowns come from the
+``leads_breakdown`` SQL function (see QUICKSTART.md). Results are cached for
+STATS_TTL seconds. Writes made by this process bump the cached counters right
+away, so the dashboard stays current between refreshes.
+"""
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import date, timedelta
+from typing import Optional
+
+STATS_TTL = float(os.environ.get("STATS_TTL", 30))
+STATS_COUNT_METHOD = os.environ.get("STATS_COUNT_METHOD", "exact")  # exact | planned | estimated
+STATS_DAYS = int(os.environ.get("STATS_DAYS", 7))
+
+
+class StatsService:
+    def __init__(self, db, ttl: float = STATS_TTL, count: str = STATS_COUNT_METHOD, days: int = STATS_DAYS):
+        self.db = db
+        self.ttl = ttl
+        self.count = count
+        self.days = days
+        self._cache: dict = {}  # user_id -> (expires_at, stats)
+        self._refreshing: dict = {}  # user_id -> Future shared by concurrent callers
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, user_id: Optional[str] = None) -> dict:
+        entry = self._cache.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        # Coalesce: concurrent misses wait for one refresh instead of each counting
+        future = self._refreshing.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._refresh(user_id))
+            self._refreshing[user_id] = future
+            future.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+        return await asyncio.shield(future)
+
+    async def _refresh(self, user_id: Optional[str]) -> dict:
+        stats = await self.db.get_admin_stats(user_id, count=self.count)
+        if user_id is None:
+            stats.update(await self._breakdown())
+        stats["cached_at"] = time.time()
+        self._cache[user_id] = (time.monotonic() + self.ttl, stats)
+        return stats
+
+    async def _breakdown(self) -> dict:
+        try:
+            data = await self.db.get_leads_breakdown(self.days) or {}
+            return {
+                "by_status": data.get("by_status") or {},
+                "by_user": data.get("by_user") or {},
+                "by_day": data.get("by_day") or {},
+            }
+        except Exception:
+            # leads_breakdown not installed: fall back to one count per day
+            today = date.today()
+            days = [today - timedelta(days=i) for i in range(self.days - 1, -1, -1)]
+            counts = await asyncio.gather(*[
+                self.db.count_rows("leads", count=self.count,
+                                   created_from=d.isoformat(), created_to=(d + timedelta(days=1)).isoformat())
+                for d in days
+            ])
+            return {"by_status": None, "by_user": None, "by_day": {d.isoformat(): c for d, c in zip(days, counts)}}
+
+    # ---------- incremental updates from local writes ----------
+    def record_leads(self, rows):
+        """Account for newly inserted lead rows (dicts with user_id/status)"""
+        if not rows:
+            return
+        today = date.today().isoformat()
+        per_user = Counter(row.get("user_id") for row in rows)
+        per_status = Counter(row.get("status") or "NEW" for row in rows)
+        for user_id, (expires, stats) in list(self._cache.items()):
+            added = len(rows) if user_id is None else per_user.get(user_id, 0)
+            if not added:
+                continue
+            stats["total_leads"] = stats.get("total_leads", 0) + added
+            if user_id is None:
+                self._bump(stats, "by_day", {today: len(rows)})
+                self._bump(stats, "by_user", per_user)
+                self._bump(stats, "by_status", per_status)
+
+    def record_messages(self, n: int = 1):
+        for _, stats in self._cache.values():
+            stats["total_messages"] = stats.get("total_messages", 0) + n
+
+    def record_users(self, n: int = 1):
+        for _, stats in self._cache.values():
+            stats["total_users"] = stats.get("total_users", 0) + n
+
+    @staticmethod
+    def _bump(stats: dict, key: str, deltas):
+        bucket = stats.get(key)
+        if bucket is None:
+            return
+        for name, n in deltas.items():
+            name = "" if name is None else str(name)
+            bucket[name] = bucket.get(name, 0) + n
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def cache_stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._cache)}
@@ -0,0 +1,51 @@
+"""Extraction parity with the regex main.py used before phones.py existed"""
+import re
+
+import pytest
+
+from phones import extract_phones, normalize_phone, to_e164
+
+
+def baseline_extract(text):
+    phones = re.findall(r'(01[0125][0-9 \-]{8,15})', text)
+    clean_phones = []
+    for raw in phones:
+        clean = raw.replace(" ", "").replace("-", "")
+        if len(clean) == 11 and clean not in clean_phones:
+            clean_phones.append(clean)
+    return clean_phones
+
+
+@pytest.mark.parametrize("text", [
+    "010 - 1234 - 5678",
+    "010  1234 5678",
+    "201012345678",
+    "call 01012345678 now",
+    "00201012345678",
+    "tel:01512345678.",
+    "2 01012345678",
+    "010-123-45678 and 0111 222 3333",
+    "phone:201512345678,",
+    "0101234567",
+])
+def test_matches_baseline(text):
+    assert extract_phones(text) == baseline_extract(text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("+20 101 234 5678", ["01012345678"]),
+    ("0020 10 1234 5678", ["01012345678"]),
+    ("٠١٠١٢٣٤٥٦٧٨", ["01012345678"]),
+    ("01112345678-01212345678", ["01112345678", "01212345678"]),
+    ("2024 01512345678", ["01512345678"]),
+    ("010123456789", []),
+])
+def test_prefixes_and_boundaries(text, expected):
+    assert extract_phones(text) == expected
+
+
+def test_normalize():
+    assert normalize_phone("+20 10 1234 5678") == "01012345678"
+    assert normalize_phone("1012345678") == "01012345678"
+    assert normalize_phone("0301234567") is None
+    assert to_e164("010 1234 5678") == "+201012345678"